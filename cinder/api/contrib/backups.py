@@ -28,6 +28,7 @@ from cinder.api import xmlutil
 from cinder import backup as backupAPI
 from cinder import exception
 from cinder.openstack.common import log as logging
+from cinder.openstack.common import strutils
 
 
 LOG = logging.getLogger(__name__)
@@ -91,7 +92,7 @@ class CreateDeserializer(wsgi.MetadataXMLDeserializer):
         backup_node = self.find_first_child_named(node, 'backup')
 
         attributes = ['container', 'display_name',
-                      'display_description', 'volume_id']
+                      'display_description', 'volume_id', 'incremental']
 
         for attr in attributes:
             if backup_node.getAttribute(attr):
@@ -108,11 +109,22 @@ class RestoreDeserializer(wsgi.MetadataXMLDeserializer):
     def _extract_restore(self, node):
         restore = {}
         restore_node = self.find_first_child_named(node, 'restore')
-        if restore_node.getAttribute('volume_id'):
-            restore['volume_id'] = restore_node.getAttribute('volume_id')
+        for attr in ('volume_id', 'offset', 'length'):
+            if restore_node.getAttribute(attr):
+                restore[attr] = restore_node.getAttribute(attr)
         return restore
 
 
+class VerifyDeserializer(wsgi.MetadataXMLDeserializer):
+    def default(self, string):
+        dom = minidom.parseString(string)
+        verify = {}
+        verify_node = self.find_first_child_named(dom, 'verify')
+        if verify_node.getAttribute('decompress'):
+            verify['decompress'] = verify_node.getAttribute('decompress')
+        return {'body': {'verify': verify}}
+
+
 class BackupsController(wsgi.Controller):
     """The Backups API controller for the OpenStack API."""
 
@@ -197,6 +209,8 @@ class BackupsController(wsgi.Controller):
         container = backup.get('container', None)
         name = backup.get('name', None)
         description = backup.get('description', None)
+        incremental = strutils.bool_from_string(backup.get('incremental',
+                                                           False))
 
         LOG.audit(_("Creating backup of volume %(volume_id)s in container"
                     " %(container)s"),
@@ -205,9 +219,12 @@ class BackupsController(wsgi.Controller):
 
         try:
             new_backup = self.backup_api.create(context, name, description,
-                                                volume_id, container)
+                                                volume_id, container,
+                                                incremental=incremental)
         except exception.InvalidVolume as error:
             raise exc.HTTPBadRequest(explanation=unicode(error))
+        except exception.InvalidBackup as error:
+            raise exc.HTTPBadRequest(explanation=unicode(error))
         except exception.VolumeNotFound as error:
             raise exc.HTTPNotFound(explanation=unicode(error))
         except exception.ServiceNotFound as error:
@@ -234,6 +251,16 @@ class BackupsController(wsgi.Controller):
             msg = _("Incorrect request body format")
             raise exc.HTTPBadRequest(explanation=msg)
         volume_id = restore.get('volume_id', None)
+        try:
+            offset = restore.get('offset', None)
+            if offset is not None:
+                offset = int(offset)
+            length = restore.get('length', None)
+            if length is not None:
+                length = int(length)
+        except (TypeError, ValueError):
+            msg = _("offset and length must be integers")
+            raise exc.HTTPBadRequest(explanation=msg)
 
         LOG.audit(_("Restoring backup %(backup_id)s to volume %(volume_id)s"),
                   {'backup_id': id, 'volume_id': volume_id},
@@ -242,7 +269,9 @@ class BackupsController(wsgi.Controller):
         try:
             new_restore = self.backup_api.restore(context,
                                                   backup_id=id,
-                                                  volume_id=volume_id)
+                                                  volume_id=volume_id,
+                                                  offset=offset,
+                                                  length=length)
         except exception.InvalidInput as error:
             raise exc.HTTPBadRequest(explanation=unicode(error))
         except exception.InvalidVolume as error:
@@ -264,6 +293,30 @@ class BackupsController(wsgi.Controller):
             req, dict(new_restore.iteritems()))
         return retval
 
+    @wsgi.deserializers(xml=VerifyDeserializer)
+    def verify(self, req, id, body):
+        """Check the stored data of an existing backup."""
+        LOG.debug(_('Verifying backup %(backup_id)s (%(body)s)'),
+                  {'backup_id': id, 'body': body})
+        if not self.is_valid_body(body, 'verify'):
+            raise exc.HTTPBadRequest()
+
+        context = req.environ['cinder.context']
+        decompress = strutils.bool_from_string(
+            body['verify'].get('decompress', False))
+
+        LOG.audit(_("Verifying backup %s"), id, context=context)
+
+        try:
+            self.backup_api.verify(context, backup_id=id,
+                                   decompress=decompress)
+        except exception.InvalidBackup as error:
+            raise exc.HTTPBadRequest(explanation=unicode(error))
+        except exception.BackupNotFound as error:
+            raise exc.HTTPNotFound(explanation=unicode(error))
+
+        return webob.Response(status_int=202)
+
 
 class Backups(extensions.ExtensionDescriptor):
     """Backups support."""
@@ -278,6 +331,6 @@ class Backups(extensions.ExtensionDescriptor):
         res = extensions.ResourceExtension(
             Backups.alias, BackupsController(),
             collection_actions={'detail': 'GET'},
-            member_actions={'restore': 'POST'})
+            member_actions={'restore': 'POST', 'verify': 'POST'})
         resources.append(res)
         return resources
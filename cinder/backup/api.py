@@ -27,6 +27,7 @@ from cinder import context
 from cinder.db import base
 from cinder import exception
 from cinder.openstack.common import log as logging
+from cinder import units
 from cinder import utils
 
 import cinder.policy
@@ -68,6 +69,12 @@ class API(base.Base):
             msg = _('Backup status must be available or error')
             raise exception.InvalidBackup(reason=msg)
 
+        backups = self.db.backup_get_all_by_volume(context,
+                                                   backup['volume_id'])
+        if any(b['parent_id'] == backup_id for b in backups):
+            msg = _('Incremental backups exist for this backup')
+            raise exception.InvalidBackup(reason=msg)
+
         self.db.backup_update(context, backup_id, {'status': 'deleting'})
         self.backup_rpcapi.delete_backup(context,
                                          backup['host'],
@@ -99,15 +106,41 @@ class API(base.Base):
         return False
 
     def create(self, context, name, description, volume_id,
-               container, availability_zone=None):
+               container, availability_zone=None, incremental=False):
         """
         Make the RPC call to create a volume backup.
+
+        An incremental backup uses the most recent available backup of the
+        volume as its parent, and only stores the data that changed since.
         """
         check_policy(context, 'create')
         volume = self.volume_api.get(context, volume_id)
         if volume['status'] != "available":
             msg = _('Volume to be backed up must be available')
             raise exception.InvalidVolume(reason=msg)
+
+        parent_id = None
+        if incremental:
+            backups = sorted((b for b in
+                              self.db.backup_get_all_by_volume(context,
+                                                               volume_id)
+                              if b['status'] == 'available'),
+                             key=lambda b: b['created_at'])
+            if not backups:
+                msg = _('No backups available to do an incremental backup')
+                raise exception.InvalidBackup(reason=msg)
+            parent = backups[-1]
+            parent_id = parent['id']
+            if container is None:
+                container = parent['container']
+            elif container != parent['container']:
+                msg = (_('An incremental backup must be in the container '
+                         'of its parent backup %(parent_id)s, '
+                         '%(container)s') %
+                       {'parent_id': parent_id,
+                        'container': parent['container']})
+                raise exception.InvalidBackup(reason=msg)
+
         self.db.volume_update(context, volume_id, {'status': 'backing-up'})
 
         options = {'user_id': context.user_id,
@@ -117,6 +150,7 @@ class API(base.Base):
                    'volume_id': volume_id,
                    'status': 'creating',
                    'container': container,
+                   'parent_id': parent_id,
                    'size': volume['size'],
                    # TODO(DuncanT): This will need de-managling once
                    #                multi-backend lands
@@ -136,9 +170,34 @@ class API(base.Base):
 
         return backup
 
-    def restore(self, context, backup_id, volume_id=None):
+    def verify(self, context, backup_id, decompress=False):
+        """
+        Make the RPC call to check the stored data of a volume backup.
+
+        If decompress is True the data of every object is decompressed and
+        checked too, otherwise only the checksums of the stored objects are.
+        """
+        check_policy(context, 'verify')
+        backup = self.get(context, backup_id)
+        if backup['status'] != 'available':
+            msg = _('Backup status must be available')
+            raise exception.InvalidBackup(reason=msg)
+
+        LOG.audit(_("Verifying backup %s"), backup_id, context=context)
+        self.db.backup_update(context, backup_id, {'status': 'verifying'})
+        self.backup_rpcapi.verify_backup(context,
+                                         backup['host'],
+                                         backup['id'],
+                                         decompress)
+
+    def restore(self, context, backup_id, volume_id=None, offset=None,
+                length=None):
         """
         Make the RPC call to restore a volume backup.
+
+        If offset or length are given only that byte range of the backup is
+        restored, to the same offset of the given volume. offset defaults
+        to the start and length to the rest of the backup.
         """
         check_policy(context, 'restore')
         backup = self.get(context, backup_id)
@@ -151,6 +210,20 @@ class API(base.Base):
             msg = _('Backup to be restored has invalid size')
             raise exception.InvalidBackup(reason=msg)
 
+        if offset is not None or length is not None:
+            if volume_id is None:
+                msg = _('A volume must be given to restore part of a backup')
+                raise exception.InvalidInput(reason=msg)
+            backup_bytes = size * units.GiB
+            offset = offset or 0
+            if length is None:
+                length = backup_bytes - offset
+            if offset < 0 or length <= 0 or offset + length > backup_bytes:
+                msg = (_('Cannot restore %(length)d bytes at offset '
+                         '%(offset)d of a backup of %(size)d GB') %
+                       {'length': length, 'offset': offset, 'size': size})
+                raise exception.InvalidInput(reason=msg)
+
         # Create a volume if none specified. If a volume is specified check
         # it is large enough for the backup
         if volume_id is None:
@@ -202,7 +275,9 @@ class API(base.Base):
         self.backup_rpcapi.restore_backup(context,
                                           backup['host'],
                                           backup['id'],
-                                          volume_id)
+                                          volume_id,
+                                          offset,
+                                          length)
 
         d = {'backup_id': backup_id,
              'volume_id': volume_id, }
@@ -0,0 +1,945 @@
+# Copyright (C) 2012 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Base class for backup drivers that store volumes as a series of objects
+
+A volume is read in fixed size chunks. Each chunk is compressed and stored
+as an object in a container of an object store, and a metadata object
+describing every chunk is stored alongside them. Drivers derived from
+ChunkedBackupDriver only provide the connection to their object store, see
+_create_connection, and the way a container is created.
+
+**Related Flags**
+
+:backup_compression_algorithm: Compression algorithm to use for volume
+                               backups. Supported options are:
+                               None (to disable), zlib and bz2 (default: zlib)
+:backup_compression_level: The compression level, from 1 (fastest) to 9
+                           (smallest), or None for the algorithm's default
+                           (default: None).
+:backup_compression_adaptive: Compress a sample of each chunk first and store
+                              chunks that do not compress well uncompressed
+                              (default: False).
+:backup_compression_min_savings: The fraction of a sample that compression
+                                 must save for its chunk to be compressed in
+                                 adaptive mode (default: 0.1).
+:backup_compression_sample_size: The size in bytes of the sample taken from
+                                 each chunk in adaptive mode (default: 65536).
+:backup_compression_cpu_budget: In adaptive mode, the maximum ratio of time
+                                spent compressing to the elapsed time of the
+                                backup, 0 for no limit (default: 0).
+
+Incremental backups (backups with a parent_id) hash every chunk with SHA-256
+and only store chunks whose hash differs from the chunk at the same offset
+in the parent backup. Unchanged chunks reference the object that already
+holds their data, so a restore resolves every chunk through the backup chain
+without having to read the parent's metadata.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import StringIO
+import sys
+import time
+
+import eventlet
+from eventlet import pools
+from eventlet import tpool
+from oslo.config import cfg
+
+from cinder.backup.driver import BackupDriver
+from cinder import exception
+from cinder.openstack.common import excutils
+from cinder.openstack.common import log as logging
+from cinder.openstack.common import timeutils
+from cinder import utils
+
+
+LOG = logging.getLogger(__name__)
+
+chunkedbackup_service_opts = [
+    cfg.StrOpt('backup_compression_algorithm',
+               default='zlib',
+               help='Compression algorithm (None to disable)'),
+    cfg.IntOpt('backup_compression_level',
+               default=None,
+               help='Compression level from 1 (fastest) to 9 (smallest). '
+                    'None uses the default level of the algorithm'),
+    cfg.BoolOpt('backup_compression_adaptive',
+                default=False,
+                help='Compress a sample of each chunk first and store '
+                     'chunks that do not compress well, such as encrypted '
+                     'or already compressed data, uncompressed'),
+    cfg.FloatOpt('backup_compression_min_savings',
+                 default=0.1,
+                 help='The fraction of its size that compression must save '
+                      'on a sample for the chunk to be compressed in '
+                      'adaptive mode'),
+    cfg.IntOpt('backup_compression_sample_size',
+               default=65536,
+               help='The size in bytes of the sample compressed from each '
+                    'chunk in adaptive mode'),
+    cfg.FloatOpt('backup_compression_cpu_budget',
+                 default=0,
+                 help='In adaptive mode, the maximum ratio of time spent '
+                      'compressing to the elapsed time of the backup. '
+                      'Chunks are stored uncompressed while the budget is '
+                      'exceeded. 0 disables the limit'),
+    cfg.IntOpt('backup_object_delete_retries',
+               default=2,
+               help='The number of times the deletion of backup objects '
+                    'that failed is retried before the backup is put in '
+                    'the error state'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(chunkedbackup_service_opts)
+
+# Size of the writes of object data that is not held in memory whole
+WRITE_BLOCK_SIZE = 1024 * 1024
+
+
+def _capture_result(func, *args):
+    """Run func, returning its outcome rather than raising.
+
+    Used for pool workers so that a failed transfer is re-raised in the
+    greenthread driving the operation instead of being reported by the
+    eventlet hub.
+    """
+    try:
+        return True, func(*args)
+    except Exception:
+        return False, sys.exc_info()
+
+
+def _wait_result(worker):
+    """Return the result of a _capture_result worker, re-raising failures."""
+    succeeded, result = worker.wait()
+    if not succeeded:
+        raise result[0], result[1], result[2]
+    return result
+
+
+class ChunkedBackupDriver(BackupDriver):
+    """Backs up volumes as a series of compressed objects.
+
+    The connection returned by _create_connection must provide the
+    put_object, get_object, get_container and delete_object calls of a
+    swiftclient connection. Errors in TRANSFER_ERRORS raised by the
+    connection are reported as TRANSFER_EXCEPTION.
+    """
+
+    DRIVER_VERSION = '1.2.0'
+    DRIVER_VERSION_MAPPING = {'1.0.0': '_restore_v1',
+                              '1.1.0': '_restore_v1',
+                              '1.2.0': '_restore_v1'}
+
+    TRANSFER_ERRORS = ()
+    TRANSFER_EXCEPTION = exception.BackupDriverException
+
+    # Seconds to wait before the first retry of failed deletes, doubled
+    # for each further attempt.
+    DELETE_RETRY_BACKOFF = 1
+
+    def _get_compressor(self, algorithm):
+        try:
+            if algorithm.lower() in ('none', 'off', 'no'):
+                return None
+            elif algorithm.lower() in ('zlib', 'gzip'):
+                import zlib as compressor
+                return compressor
+            elif algorithm.lower() in ('bz2', 'bzip2'):
+                import bz2 as compressor
+                return compressor
+        except ImportError:
+            pass
+
+        err = _('unsupported compression algorithm: %s') % algorithm
+        raise ValueError(unicode(err))
+
+    def __init__(self, context, chunk_size_bytes, pipeline_depth,
+                 restore_depth, sparse, default_container, db_driver=None,
+                 delete_depth=1):
+        self.context = context
+        self.az = CONF.storage_availability_zone
+        self.data_block_size_bytes = chunk_size_bytes
+        self.compressor = \
+            self._get_compressor(CONF.backup_compression_algorithm)
+        self.compression_level = CONF.backup_compression_level
+        self.adaptive = CONF.backup_compression_adaptive
+        self.compress_seconds = 0
+        self.backup_started = None
+        self.pipeline_depth = max(1, pipeline_depth)
+        self.restore_depth = max(1, restore_depth)
+        self.delete_depth = max(1, delete_depth)
+        self.delete_retries = CONF.backup_object_delete_retries
+        self.sparse = sparse
+        self.default_container = default_container
+        self.conn = self._create_connection()
+
+        super(ChunkedBackupDriver, self).__init__(db_driver)
+
+    def _create_connection(self):
+        """Open a new connection to the object store."""
+        raise NotImplementedError()
+
+    def _ensure_container(self, container):
+        """Create the container if it does not exist yet."""
+        raise NotImplementedError()
+
+    def _connection_pool(self, size):
+        """Return a pool of size connections for concurrent transfers.
+
+        A connection can only carry one request at a time, so each
+        in-flight transfer needs its own. The driver's connection is
+        handed out first so that a depth of one opens no extra connections.
+        """
+        spare = [self.conn]
+
+        def create():
+            if spare:
+                return spare.pop()
+            return self._create_connection()
+
+        return pools.Pool(max_size=size, create=create)
+
+    def _create_container(self, context, backup):
+        backup_id = backup['id']
+        container = backup['container']
+        LOG.debug(_('_create_container started, container: %(container)s,'
+                    'backup: %(backup_id)s') %
+                  {'container': container, 'backup_id': backup_id})
+        if container is None:
+            container = self.default_container
+            self.db.backup_update(context, backup_id, {'container': container})
+        self._ensure_container(container)
+        return container
+
+    def _generate_object_name_prefix(self, backup):
+        az = 'az_%s' % self.az
+        backup_name = '%s_backup_%s' % (az, backup['id'])
+        volume = 'volume_%s' % (backup['volume_id'])
+        timestamp = timeutils.strtime(fmt="%Y%m%d%H%M%S")
+        prefix = volume + '/' + timestamp + '/' + backup_name
+        LOG.debug(_('_generate_object_name_prefix: %s') % prefix)
+        return prefix
+
+    def _generate_object_names(self, backup):
+        prefix = backup['service_metadata']
+        objects = self.conn.get_container(backup['container'],
+                                          prefix=prefix,
+                                          full_listing=True)[1]
+        object_names = [obj['name'] for obj in objects]
+        LOG.debug(_('generated object list: %s') % object_names)
+        return object_names
+
+    def _metadata_filename(self, backup):
+        object_name = backup['service_metadata']
+        filename = '%s_metadata' % object_name
+        return filename
+
+    def _write_metadata(self, backup, volume_id, container, object_list):
+        filename = self._metadata_filename(backup)
+        LOG.debug(_('_write_metadata started, container name: %(container)s,'
+                    ' metadata filename: %(filename)s') %
+                  {'container': container, 'filename': filename})
+        metadata = {}
+        metadata['version'] = self.DRIVER_VERSION
+        metadata['backup_id'] = backup['id']
+        metadata['volume_id'] = volume_id
+        metadata['parent_id'] = backup['parent_id']
+        metadata['backup_name'] = backup['display_name']
+        metadata['backup_description'] = backup['display_description']
+        metadata['created_at'] = str(backup['created_at'])
+        metadata['objects'] = object_list
+        metadata_json = json.dumps(metadata, sort_keys=True, indent=2)
+        reader = StringIO.StringIO(metadata_json)
+        etag = self.conn.put_object(container, filename, reader,
+                                    content_length=reader.len)
+        md5 = hashlib.md5(metadata_json).hexdigest()
+        if etag is not None and etag != md5:
+            err = _('error writing metadata file, MD5 of the stored metadata'
+                    ' file [%(etag)s] is not the same as MD5 of the '
+                    'metadata file sent [%(md5)s]') % {'etag': etag,
+                                                       'md5': md5}
+            raise exception.InvalidBackup(reason=err)
+        LOG.debug(_('_write_metadata finished'))
+
+    def _read_metadata(self, backup):
+        container = backup['container']
+        filename = self._metadata_filename(backup)
+        LOG.debug(_('_read_metadata started, container name: %(container)s, '
+                    'metadata filename: %(filename)s') %
+                  {'container': container, 'filename': filename})
+        (resp, body) = self.conn.get_object(container, filename)
+        metadata = json.loads(body)
+        LOG.debug(_('_read_metadata finished (%s)') % metadata)
+        return metadata
+
+    def _prepare_backup(self, backup):
+        """Prepare the backup process and return the backup metadata"""
+        backup_id = backup['id']
+        volume_id = backup['volume_id']
+        volume = self.db.volume_get(self.context, volume_id)
+
+        if volume['size'] <= 0:
+            err = _('volume size %d is invalid.') % volume['size']
+            raise exception.InvalidVolume(reason=err)
+
+        try:
+            container = self._create_container(self.context, backup)
+        except self.TRANSFER_ERRORS as err:
+            raise self.TRANSFER_EXCEPTION(reason=str(err))
+
+        object_prefix = self._generate_object_name_prefix(backup)
+        backup['service_metadata'] = object_prefix
+        self.db.backup_update(self.context, backup_id, {'service_metadata':
+                                                        object_prefix})
+        volume_size_bytes = volume['size'] * 1024 * 1024 * 1024
+        availability_zone = self.az
+        LOG.debug(_('starting backup of volume: %(volume_id)s,'
+                    ' volume size: %(volume_size_bytes)d, object names'
+                    ' prefix %(object_prefix)s, availability zone:'
+                    ' %(availability_zone)s') %
+                  {
+                      'volume_id': volume_id,
+                      'volume_size_bytes': volume_size_bytes,
+                      'object_prefix': object_prefix,
+                      'availability_zone': availability_zone,
+                  })
+        object_meta = {'id': 1, 'list': [], 'prefix': object_prefix,
+                       'parent': self._read_parent_objects(backup, container)}
+        return object_meta, container
+
+    def _read_parent_objects(self, backup, container):
+        """Return the hashed objects of the parent backup keyed by offset.
+
+        Returns an empty dict for full backups, and for incremental backups
+        whose parent cannot be used, in which case a full backup is taken.
+        """
+        parent_id = backup['parent_id']
+        if parent_id is None:
+            return {}
+        parent = self.db.backup_get(self.context, parent_id)
+        if parent['container'] != container:
+            LOG.warn(_('parent backup %(parent_id)s is in container '
+                       '%(parent_container)s, not %(container)s, taking a '
+                       'full backup') %
+                     {'parent_id': parent_id,
+                      'parent_container': parent['container'],
+                      'container': container})
+            return {}
+        try:
+            metadata = self._read_metadata(parent)
+        except self.TRANSFER_ERRORS as err:
+            raise self.TRANSFER_EXCEPTION(reason=str(err))
+        parent_objects = {}
+        for metadata_object in metadata['objects']:
+            for object_name, object_meta in metadata_object.items():
+                if 'sha256' not in object_meta:
+                    continue
+                object_meta = dict(object_meta)
+                object_meta.setdefault('backup_id', parent_id)
+                parent_objects[object_meta['offset']] = (object_name,
+                                                         object_meta)
+        LOG.debug(_('incremental backup %(backup_id)s of parent '
+                    '%(parent_id)s, %(count)d parent objects can be reused') %
+                  {'backup_id': backup['id'], 'parent_id': parent_id,
+                   'count': len(parent_objects)})
+        return parent_objects
+
+    def _read_chunks(self, volume_file, object_meta):
+        """Read the volume in object sized chunks, naming each object."""
+        object_prefix = object_meta['prefix']
+        while True:
+            data_offset = volume_file.tell()
+            data = volume_file.read(self.data_block_size_bytes)
+            if data == '':
+                break
+            object_name = '%s-%05d' % (object_prefix, object_meta['id'])
+            object_meta['id'] += 1
+            yield object_name, data, data_offset
+
+    def _compress(self, data):
+        """Compress data at the configured level, accounting the time."""
+        args = [data]
+        if self.compression_level is not None:
+            args.append(self.compression_level)
+        start = time.time()
+        # zlib and bz2 release the GIL, so compressing in a native thread
+        # lets several chunks be compressed at the same time.
+        compressed = tpool.execute(self.compressor.compress, *args)
+        self.compress_seconds += time.time() - start
+        return compressed
+
+    def _sample(self, data):
+        """Return a sample of data taken from its start, middle and end."""
+        sample_size = CONF.backup_compression_sample_size
+        if len(data) <= sample_size:
+            return data
+        part = sample_size // 3
+        middle = (len(data) - part) // 2
+        return (data[:part] + data[middle:middle + part] +
+                data[len(data) - part:])
+
+    def _should_compress(self, object_name, data):
+        """Decide whether a chunk is worth compressing.
+
+        Outside of adaptive mode every chunk is compressed when compression
+        is enabled. In adaptive mode chunks are stored uncompressed while
+        the compression CPU budget is spent, or when compressing a sample
+        of the chunk saves less than backup_compression_min_savings.
+        """
+        if self.compressor is None:
+            return False
+        if not self.adaptive:
+            return True
+        budget = CONF.backup_compression_cpu_budget
+        if budget > 0 and self.backup_started is not None:
+            elapsed = time.time() - self.backup_started
+            if self.compress_seconds > elapsed * budget:
+                LOG.debug(_('compression CPU budget spent, storing '
+                            '%s uncompressed') % object_name)
+                return False
+        sample = self._sample(data)
+        savings = 1 - float(len(self._compress(sample))) / len(sample)
+        if savings < CONF.backup_compression_min_savings:
+            LOG.debug(_('a sample of %(object_name)s compressed by '
+                        '%(savings).2f, storing it uncompressed') %
+                      {'object_name': object_name, 'savings': savings})
+            return False
+        return True
+
+    def _backup_chunk(self, conn_pool, container, object_name, data,
+                      data_offset, parent_object=None):
+        """Compress and store a data chunk, returning its object metadata
+
+        If parent_object, the (name, metadata) of the parent backup's object
+        at the same offset, holds the same data then nothing is stored and
+        the parent's object is returned instead.
+        """
+        obj = {}
+        obj[object_name] = {}
+        obj[object_name]['offset'] = data_offset
+        obj[object_name]['length'] = len(data)
+        if self.sparse and utils.is_all_zero(data):
+            LOG.debug(_('%(object_name)s contains only zeros, recording '
+                        'it as a hole') % {'object_name': object_name})
+            obj[object_name]['compression'] = 'none'
+            obj[object_name]['sparse'] = True
+            return obj
+        sha256 = tpool.execute(hashlib.sha256, data).hexdigest()
+        if parent_object is not None:
+            parent_name, parent_meta = parent_object
+            if (parent_meta['sha256'] == sha256 and
+                    parent_meta['length'] == len(data)):
+                LOG.debug(_('%(object_name)s is unchanged, reusing '
+                            '%(parent_name)s') %
+                          {'object_name': object_name,
+                           'parent_name': parent_name})
+                return {parent_name: parent_meta}
+        obj[object_name]['sha256'] = sha256
+        if self._should_compress(object_name, data):
+            algorithm = CONF.backup_compression_algorithm.lower()
+            data_size_bytes = len(data)
+            compressed = self._compress(data)
+            comp_size_bytes = len(compressed)
+            LOG.debug(_('compressed %(data_size_bytes)d bytes of data '
+                        'to %(comp_size_bytes)d bytes using '
+                        '%(algorithm)s') %
+                      {
+                          'data_size_bytes': data_size_bytes,
+                          'comp_size_bytes': comp_size_bytes,
+                          'algorithm': algorithm,
+                      })
+            if self.adaptive and comp_size_bytes >= data_size_bytes:
+                LOG.debug(_('%s did not compress, storing it uncompressed')
+                          % object_name)
+                obj[object_name]['compression'] = 'none'
+            else:
+                obj[object_name]['compression'] = algorithm
+                data = compressed
+        else:
+            LOG.debug(_('not compressing data'))
+            obj[object_name]['compression'] = 'none'
+
+        reader = StringIO.StringIO(data)
+        LOG.debug(_('About to put_object'))
+        with conn_pool.item() as conn:
+            try:
+                etag = conn.put_object(container, object_name, reader,
+                                       content_length=len(data))
+            except self.TRANSFER_ERRORS as err:
+                raise self.TRANSFER_EXCEPTION(reason=str(err))
+        LOG.debug(_('stored MD5 for %(object_name)s: %(etag)s') %
+                  {'object_name': object_name, 'etag': etag, })
+        md5 = tpool.execute(hashlib.md5, data).hexdigest()
+        obj[object_name]['md5'] = md5
+        LOG.debug(_('backup MD5 for %(object_name)s: %(md5)s') %
+                  {'object_name': object_name, 'md5': md5})
+        if etag is not None and etag != md5:
+            err = _('error writing object, MD5 of the stored object '
+                    '%(etag)s is not the same as MD5 of object sent '
+                    '%(md5)s') % {'etag': etag, 'md5': md5}
+            raise exception.InvalidBackup(reason=err)
+        return obj
+
+    def _finalize_backup(self, backup, container, object_meta):
+        """Finalize the backup by storing its metadata"""
+        object_list = object_meta['list']
+        object_id = object_meta['id']
+        try:
+            self._write_metadata(backup,
+                                 backup['volume_id'],
+                                 container,
+                                 object_list)
+        except self.TRANSFER_ERRORS as err:
+            raise self.TRANSFER_EXCEPTION(reason=str(err))
+        self.db.backup_update(self.context, backup['id'],
+                              {'object_count': object_id})
+        LOG.debug(_('backup %s finished.') % backup['id'])
+
+    def backup(self, backup, volume_file):
+        """Backup the given volume using the given backup metadata.
+
+        Chunks are read from the volume in order and handed to a pool of
+        up to pipeline_depth workers which compress, hash and store them
+        concurrently. The reader blocks while the pool is full, which
+        bounds the memory held by in-flight chunks. Results are collected
+        in the order the chunks were read so the object list in the backup
+        metadata matches the volume layout.
+        """
+        object_meta, container = self._prepare_backup(backup)
+        self.compress_seconds = 0
+        self.backup_started = time.time()
+        object_list = object_meta['list']
+        parent_objects = object_meta['parent']
+        conn_pool = self._connection_pool(self.pipeline_depth)
+        pool = eventlet.GreenPool(self.pipeline_depth)
+        pending = collections.deque()
+        try:
+            for object_name, data, data_offset in \
+                    self._read_chunks(volume_file, object_meta):
+                pending.append(pool.spawn(_capture_result,
+                                          self._backup_chunk, conn_pool,
+                                          container, object_name, data,
+                                          data_offset,
+                                          parent_objects.get(data_offset)))
+                while pending and pending[0].dead:
+                    object_list.append(_wait_result(pending.popleft()))
+            while pending:
+                object_list.append(_wait_result(pending.popleft()))
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for worker in pending:
+                    worker.kill()
+        self._finalize_backup(backup, container, object_meta)
+
+    def _restore_hole(self, volume_file, length):
+        """Restore a chunk that was recorded as a hole at backup time.
+
+        The target region is only written if it does not already read back
+        as zeros, so thinly provisioned or sparse restore targets are left
+        unallocated.
+        """
+        offset = volume_file.tell()
+        try:
+            existing = volume_file.read(length)
+        except IOError:
+            existing = ''
+        if len(existing) == length and utils.is_all_zero(existing):
+            return
+        volume_file.seek(offset)
+        volume_file.write('\0' * length)
+
+    def _get_object_data(self, conn, container, object_name, object_meta):
+        """Return the stored data of an object.
+
+        Drivers may return any object supporting len(), slicing and the
+        buffer interface, such as a memory map of the object. Data that is
+        not a string is written to the volume a block at a time.
+        """
+        (resp, body) = conn.get_object(container, object_name)
+        return body
+
+    def _fetch_chunk(self, conn_pool, container, object_name, object_meta):
+        """Fetch and decompress a backup object, returning its data."""
+        with conn_pool.item() as conn:
+            try:
+                body = self._get_object_data(conn, container, object_name,
+                                             object_meta)
+            except self.TRANSFER_ERRORS as err:
+                raise self.TRANSFER_EXCEPTION(reason=str(err))
+        compression_algorithm = object_meta['compression']
+        decompressor = self._get_compressor(compression_algorithm)
+        if decompressor is not None:
+            LOG.debug(_('decompressing data using %s algorithm') %
+                      compression_algorithm)
+            body = tpool.execute(decompressor.decompress, body)
+        return body
+
+    def _restore_chunk(self, volume_file, object_name, object_meta, worker,
+                       extent):
+        """Write the next chunk of a restore to the volume file.
+
+        worker is the _fetch_chunk worker fetching the chunk, or None if
+        the chunk was recorded as a hole. extent is None to write the whole
+        chunk at the current position of the volume file, or the tuple
+        (chunk offset, start, end) to only write the volume bytes from
+        start to end.
+        """
+        if extent is not None:
+            object_offset, start, end = extent
+            volume_file.seek(start)
+        if worker is None:
+            LOG.debug(_('restoring hole %s') % object_name)
+            length = object_meta['length']
+            if extent is not None:
+                length = end - start
+            self._restore_hole(volume_file, length)
+        else:
+            data = _wait_result(worker)
+            begin, finish = 0, len(data)
+            if extent is not None:
+                begin, finish = start - object_offset, end - object_offset
+            if isinstance(data, str):
+                if extent is not None:
+                    data = data[begin:finish]
+                volume_file.write(data)
+            else:
+                for pos in xrange(begin, finish, WRITE_BLOCK_SIZE):
+                    volume_file.write(
+                        data[pos:min(pos + WRITE_BLOCK_SIZE, finish)])
+
+            # force flush every write to avoid long blocking write on close
+            volume_file.flush()
+
+            # Be tolerant to IO implementations that do not support fileno()
+            try:
+                fileno = volume_file.fileno()
+            except IOError:
+                LOG.info("volume_file does not support fileno() so skipping "
+                         "fsync()")
+            else:
+                os.fsync(fileno)
+
+        # Restoring a backup to a volume can take some time. Yield so other
+        # threads can run, allowing for among other things the service
+        # status to be updated
+        eventlet.sleep(0)
+
+    def _restore_v1(self, backup, volume_id, metadata, volume_file,
+                    offset=None, length=None):
+        """Restore a v1 volume backup.
+
+        If offset is given only the length bytes of the volume starting at
+        offset are restored, fetching just the objects covering them.
+        """
+        backup_id = backup['id']
+        LOG.debug(_('v1 volume backup restore of %s started'), backup_id)
+        container = backup['container']
+        metadata_objects = metadata['objects']
+        # Holes have no object, and objects reused from an earlier backup in
+        # the chain are stored under that backup's prefix.
+        metadata_object_names = sum(([name for name, meta in obj.items()
+                                      if not meta.get('sparse') and
+                                      'backup_id' not in meta]
+                                     for obj in metadata_objects), [])
+        LOG.debug(_('metadata_object_names = %s') % metadata_object_names)
+        prune_list = [self._metadata_filename(backup)]
+        stored_object_names = [object_name for object_name in
+                               self._generate_object_names(backup)
+                               if object_name not in prune_list]
+        if sorted(stored_object_names) != sorted(metadata_object_names):
+            err = _('restore_backup aborted, actual object list in the '
+                    'backup store does not match object list stored in '
+                    'metadata')
+            raise exception.InvalidBackup(reason=err)
+
+        # Objects are fetched by up to restore_depth workers while the
+        # chunks ahead of them are written. At most restore_depth chunks
+        # are pending at any time, which bounds the memory held by
+        # fetched chunks waiting for their turn to be written.
+        conn_pool = self._connection_pool(self.restore_depth)
+        pool = eventlet.GreenPool(self.restore_depth)
+        pending = collections.deque()
+        # Chunks are contiguous, so their offsets follow from their lengths.
+        # This also holds for 1.0.0 metadata, which records chunk end
+        # offsets rather than start offsets.
+        position = 0
+        try:
+            for metadata_object in metadata_objects:
+                object_name = metadata_object.keys()[0]
+                object_meta = metadata_object[object_name]
+                object_offset = position
+                position += object_meta['length']
+                extent = None
+                if offset is not None:
+                    if object_offset >= offset + length:
+                        break
+                    start = max(offset, object_offset)
+                    end = min(offset + length, position)
+                    if start >= end:
+                        continue
+                    extent = (object_offset, start, end)
+                if len(pending) >= self.restore_depth:
+                    self._restore_chunk(volume_file, *pending.popleft())
+                if object_meta.get('sparse'):
+                    pending.append((object_name, object_meta, None, extent))
+                    continue
+                LOG.debug(_('restoring object. backup: %(backup_id)s, '
+                            'container: %(container)s, object name: '
+                            '%(object_name)s, volume: %(volume_id)s') %
+                          {
+                              'backup_id': backup_id,
+                              'container': container,
+                              'object_name': object_name,
+                              'volume_id': volume_id,
+                          })
+                worker = pool.spawn(_capture_result, self._fetch_chunk,
+                                    conn_pool, container, object_name,
+                                    object_meta)
+                pending.append((object_name, object_meta, worker, extent))
+            while pending:
+                self._restore_chunk(volume_file, *pending.popleft())
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for object_name, object_meta, worker, extent in pending:
+                    if worker is not None:
+                        worker.kill()
+        LOG.debug(_('v1 volume backup restore of %s finished'),
+                  backup_id)
+
+    def restore(self, backup, volume_id, volume_file):
+        """Restore the given volume backup."""
+        self._restore(backup, volume_id, volume_file)
+
+    def restore_range(self, backup, volume_id, volume_file, offset, length):
+        """Restore length bytes at offset of the given volume backup."""
+        self._restore(backup, volume_id, volume_file, offset, length)
+
+    def _restore(self, backup, volume_id, volume_file, offset=None,
+                 length=None):
+        backup_id = backup['id']
+        container = backup['container']
+        object_prefix = backup['service_metadata']
+        LOG.debug(_('starting restore of backup %(object_prefix)s from'
+                    ' container: %(container)s, to volume %(volume_id)s, '
+                    'backup: %(backup_id)s, offset: %(offset)s, length: '
+                    '%(length)s') %
+                  {
+                      'object_prefix': object_prefix,
+                      'container': container,
+                      'volume_id': volume_id,
+                      'backup_id': backup_id,
+                      'offset': offset,
+                      'length': length,
+                  })
+        try:
+            metadata = self._read_metadata(backup)
+        except self.TRANSFER_ERRORS as err:
+            raise self.TRANSFER_EXCEPTION(reason=str(err))
+        metadata_version = metadata['version']
+        LOG.debug(_('Restoring backup version %s'), metadata_version)
+        try:
+            restore_func = getattr(self, self.DRIVER_VERSION_MAPPING.get(
+                metadata_version))
+        except TypeError:
+            err = (_('No support to restore backup version %s')
+                   % metadata_version)
+            raise exception.InvalidBackup(reason=err)
+        restore_func(backup, volume_id, metadata, volume_file, offset, length)
+        LOG.debug(_('restore %(backup_id)s to %(volume_id)s finished.') %
+                  {'backup_id': backup_id, 'volume_id': volume_id})
+
+    def _verify_object(self, conn_pool, container, object_name, object_meta,
+                       decompress):
+        """Check a stored object, returning why it is corrupt or None."""
+        with conn_pool.item() as conn:
+            try:
+                data = self._get_object_data(conn, container, object_name,
+                                             object_meta)
+            except self.TRANSFER_ERRORS as err:
+                raise self.TRANSFER_EXCEPTION(reason=str(err))
+        md5 = tpool.execute(hashlib.md5, data).hexdigest()
+        if 'md5' in object_meta and md5 != object_meta['md5']:
+            return (_('MD5 %(md5)s does not match %(expected)s') %
+                    {'md5': md5, 'expected': object_meta['md5']})
+        if not decompress:
+            return None
+        decompressor = self._get_compressor(object_meta['compression'])
+        if decompressor is not None:
+            try:
+                data = tpool.execute(decompressor.decompress, data)
+            except Exception as err:
+                return _('data cannot be decompressed: %s') % err
+        if len(data) != object_meta['length']:
+            return (_('length %(length)d does not match %(expected)d') %
+                    {'length': len(data), 'expected': object_meta['length']})
+        if 'sha256' in object_meta:
+            sha256 = tpool.execute(hashlib.sha256, data).hexdigest()
+            if sha256 != object_meta['sha256']:
+                return (_('SHA-256 %(sha256)s does not match %(expected)s') %
+                        {'sha256': sha256,
+                         'expected': object_meta['sha256']})
+        return None
+
+    def verify(self, backup, decompress=False):
+        """Check the stored objects of the given backup.
+
+        Every object of the backup, including those reused from earlier
+        backups in its chain, is fetched by up to restore_depth workers and
+        checked against the MD5 recorded at backup time. If decompress is
+        True each object is decompressed and its length and SHA-256 are
+        checked as well. Nothing is written.
+        """
+        LOG.debug(_('verify of backup %(backup_id)s started, decompress: '
+                    '%(decompress)s') %
+                  {'backup_id': backup['id'], 'decompress': decompress})
+        container = backup['container']
+        try:
+            metadata = self._read_metadata(backup)
+        except self.TRANSFER_ERRORS as err:
+            raise self.TRANSFER_EXCEPTION(reason=str(err))
+        objects = [(object_name, object_meta)
+                   for metadata_object in metadata['objects']
+                   for object_name, object_meta in metadata_object.items()
+                   if not object_meta.get('sparse')]
+
+        # Reused objects are listed under the backup that stored them.
+        backup_ids = set(object_meta['backup_id']
+                         for object_name, object_meta in objects
+                         if 'backup_id' in object_meta)
+        stored = set()
+        try:
+            stored.update(self._generate_object_names(backup))
+            for backup_id in backup_ids:
+                stored.update(self._generate_object_names(
+                    self.db.backup_get(self.context, backup_id)))
+        except self.TRANSFER_ERRORS as err:
+            raise self.TRANSFER_EXCEPTION(reason=str(err))
+
+        result = {'missing': [], 'corrupt': {}}
+        conn_pool = self._connection_pool(self.restore_depth)
+        pool = eventlet.GreenPool(self.restore_depth)
+        workers = []
+        try:
+            for object_name, object_meta in objects:
+                if object_name not in stored:
+                    result['missing'].append(object_name)
+                    continue
+                workers.append((object_name,
+                                pool.spawn(_capture_result,
+                                           self._verify_object, conn_pool,
+                                           container, object_name,
+                                           object_meta, decompress)))
+            for object_name, worker in workers:
+                reason = _wait_result(worker)
+                if reason is not None:
+                    result['corrupt'][object_name] = reason
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for object_name, worker in workers:
+                    worker.kill()
+        LOG.debug(_('verify of backup %(backup_id)s finished, %(checked)d '
+                    'objects checked, %(missing)d missing, %(corrupt)d '
+                    'corrupt') %
+                  {'backup_id': backup['id'], 'checked': len(workers),
+                   'missing': len(result['missing']),
+                   'corrupt': len(result['corrupt'])})
+        return result
+
+    def _delete_object(self, conn_pool, container, object_name):
+        with conn_pool.item() as conn:
+            conn.delete_object(container, object_name)
+        LOG.debug(_('deleted object: %(object_name)s'
+                    ' in container: %(container)s') %
+                  {
+                      'object_name': object_name,
+                      'container': container
+                  })
+
+    def _delete_objects(self, container, object_names):
+        """Delete objects concurrently, returning those that should be retried.
+
+        Objects that failed with an error in TRANSFER_ERRORS are returned,
+        other errors are logged and the object is skipped.
+        """
+        conn_pool = self._connection_pool(self.delete_depth)
+        pool = eventlet.GreenPool(self.delete_depth)
+        failed = []
+        workers = collections.deque()
+
+        def collect(object_name, worker):
+            try:
+                _wait_result(worker)
+            except self.TRANSFER_ERRORS as err:
+                LOG.warn(_('error while deleting object %(object_name)s: '
+                           '%(err)s') %
+                         {'object_name': object_name, 'err': err})
+                failed.append(object_name)
+            except Exception:
+                LOG.warn(_('error while deleting object %s, '
+                           'continuing with delete') % object_name)
+
+        for object_name in object_names:
+            workers.append((object_name,
+                            pool.spawn(_capture_result, self._delete_object,
+                                       conn_pool, container, object_name)))
+            # Only keep as many pending results as there are workers.
+            while len(workers) > self.delete_depth:
+                collect(*workers.popleft())
+        while workers:
+            collect(*workers.popleft())
+        return failed
+
+    def delete(self, backup):
+        """Delete the given backup.
+
+        Objects are deleted by up to delete_depth workers. Objects whose
+        deletion failed are retried up to backup_object_delete_retries
+        times.
+        """
+        container = backup['container']
+        LOG.debug('delete started, backup: %s, container: %s, prefix: %s',
+                  backup['id'], container, backup['service_metadata'])
+
+        if container is not None:
+            object_names = []
+            try:
+                object_names = self._generate_object_names(backup)
+            except Exception:
+                LOG.warn(_('error while listing objects, continuing'
+                           ' with delete'))
+
+            attempt = 0
+            while True:
+                object_names = self._delete_objects(container, object_names)
+                if not object_names:
+                    break
+                if attempt >= self.delete_retries:
+                    err = _('%(count)d objects of backup %(backup_id)s could '
+                            'not be deleted') % {'count': len(object_names),
+                                                 'backup_id': backup['id']}
+                    raise self.TRANSFER_EXCEPTION(reason=err)
+                attempt += 1
+                LOG.warn(_('retrying the deletion of %(count)d objects, '
+                           'attempt %(attempt)d') %
+                         {'count': len(object_names), 'attempt': attempt})
+                eventlet.sleep(self.DELETE_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+        LOG.debug(_('delete %s finished') % backup['id'])
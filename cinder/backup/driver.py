@@ -28,6 +28,21 @@ class BackupDriver(base.Base):
         """Restores a saved backup"""
         raise NotImplementedError()
 
+    def restore_range(self, backup, volume_id, volume_file, offset, length):
+        """Restores length bytes at offset of a saved backup
+
+        The bytes are written at the same offset of volume_file.
+        """
+        raise NotImplementedError()
+
+    def verify(self, backup, decompress=False):
+        """Checks the stored data of a saved backup without restoring it
+
+        Returns a dict listing the 'missing' objects and mapping 'corrupt'
+        objects to the reason they are considered corrupt.
+        """
+        raise NotImplementedError()
+
     def delete(self, backup):
         """Deletes a saved backup"""
         raise NotImplementedError()
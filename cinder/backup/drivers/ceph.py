@@ -13,9 +13,29 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-"""Ceph Backup Service Implementation"""
-
+"""Ceph Backup Service Implementation
+
+When the volume being backed up is itself an RBD image, backups are
+differential. All backups of a volume share a single base image in the backup
+pool and each backup is a snapshot of that image. A backup snapshots the source
+volume and copies only the extents that changed since the previous backup
+snapshot, found with librbd diff iteration, into the base image. The base image
+is then snapshotted with the same name. Only the most recent backup snapshot
+is kept on the source volume. If there is no snapshot common to the source
+volume and the base image, all allocated extents of the source are copied
+instead.
+
+Backups of other volume types, or with a librbd that lacks diff iteration, are
+full copies to a separate image per backup.
+
+Full backups and restores keep several chunks in flight with asynchronous
+librbd I/O when it is available. All-zero chunks are not written so backup
+images stay sparse.
+"""
+
+import collections
 import os
+import re
 import time
 
 import eventlet
@@ -23,8 +43,10 @@ from oslo.config import cfg
 
 from cinder.backup.driver import BackupDriver
 from cinder import exception
+from cinder.openstack.common import excutils
 from cinder.openstack.common import log as logging
 from cinder import units
+from cinder import utils
 import cinder.volume.drivers.rbd as rbddriver
 
 try:
@@ -49,22 +71,43 @@ service_opts = [
     cfg.IntOpt('backup_ceph_stripe_unit', default=0,
                help='RBD stripe unit to use when creating a backup image'),
     cfg.IntOpt('backup_ceph_stripe_count', default=0,
-               help='RBD stripe count to use when creating a backup image')
+               help='RBD stripe count to use when creating a backup image'),
+    cfg.IntOpt('backup_ceph_queue_depth', default=4,
+               help='the number of chunks a backup or restore keeps in '
+                    'flight using asynchronous librbd I/O')
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(service_opts)
 
 
+class _ChunkRequest(object):
+    """A chunk transfer that may still be in flight in librbd."""
+
+    def __init__(self, index, chunks, offset, length):
+        self.index = index
+        self.chunks = chunks
+        self.offset = offset
+        self.length = length
+        self.started = time.time()
+        self.completion = None
+        self.data = None
+        self.skipped = False
+
+
 class CephBackupDriver(BackupDriver):
     """Backup up Cinder volumes to Ceph Object Store"""
 
+    # Seconds between checks of whether an asynchronous request is done.
+    AIO_POLL_INTERVAL = 0.01
+
     def __init__(self, context, db_driver=None):
         super(CephBackupDriver, self).__init__(db_driver)
         self.rbd = rbd
         self.rados = rados
         self.context = context
         self.chunk_size = CONF.backup_ceph_chunk_size
+        self.queue_depth = max(1, CONF.backup_ceph_queue_depth)
         if self._supports_stripingv2():
             self.rbd_stripe_unit = CONF.backup_ceph_stripe_unit
             self.rbd_stripe_count = CONF.backup_ceph_stripe_count
@@ -122,55 +165,272 @@ class CephBackupDriver(BackupDriver):
         ioctx.close()
         client.shutdown()
 
-    def _get_backup_base_name(self, volume_id, backup_id):
-        """Return name of base image used for backup."""
+    def _get_backup_base_name(self, volume_id, backup_id=None,
+                              diff_format=False):
+        """Return name of base image used for backup.
+
+        Differential backups of a volume share a single base image while
+        full backups each have their own image.
+        """
         # Ensure no unicode
+        if diff_format:
+            return str("volume-%s.backup.base" % (volume_id))
         return str("volume-%s.backup.%s" % (volume_id, backup_id))
 
+    def _get_new_snap_name(self, backup_id):
+        return str("backup.%s.snap.%s" % (backup_id, time.time()))
+
+    def _get_backup_snaps(self, rbd_image):
+        """Return the backup snapshots of an image, most recent first."""
+        snaps = []
+        for snap in rbd_image.list_snaps():
+            match = re.match(r"^backup\.(.+)\.snap\.([\d.]+)$", snap['name'])
+            if match:
+                snaps.append((float(match.group(2)), str(snap['name'])))
+        return [name for timestamp, name in sorted(snaps, reverse=True)]
+
+    def _get_backup_snap_name(self, rbd_image, backup_id):
+        """Return the name of the snapshot holding backup_id, if any."""
+        prefix = "backup.%s.snap." % (backup_id)
+        for snap in self._get_backup_snaps(rbd_image):
+            if snap.startswith(prefix):
+                return snap
+        return None
+
+    def _rbd_image_exists(self, ioctx, name):
+        return name in self.rbd.RBD().list(ioctx)
+
+    def _supports_diff(self):
+        """
+        Determine whether diff iteration is supported by our version of librbd
+        """
+        return hasattr(self.rbd.Image, 'diff_iterate')
+
+    def _get_rbd_source(self, volume_file):
+        """Return the RBD volume proxy behind volume_file, if there is one."""
+        source = getattr(volume_file, 'rbd_image', None)
+        if source is None or not hasattr(source, 'ioctx'):
+            return None
+        return source
+
+    def _discard(self, dest, offset, length):
+        """Deallocate a region of an rbd image, zeroing it if unsupported."""
+        if hasattr(dest, 'discard'):
+            dest.discard(offset, length)
+            return
+        end = offset + length
+        while offset < end:
+            chunk = min(self.chunk_size, end - offset)
+            dest.write('\0' * chunk, offset)
+            offset += chunk
+            eventlet.sleep(0)
+
+    def _transfer_diff(self, src, dest, dest_name, length, from_snap):
+        """
+        Transfer the extents of src that changed since from_snap to dest. If
+        from_snap is None all allocated extents of src are transferred.
+        """
+        extents = []
+
+        # NOTE: the callback runs inside librbd so only record the extents
+        # here and transfer them once the iteration has finished.
+        def iterate_cb(offset, length, exists):
+            extents.append((offset, length, exists))
+
+        src.diff_iterate(0, length, from_snap, iterate_cb)
+        LOG.debug("transferring %s changed extents since snapshot '%s' to "
+                  "'%s'" % (len(extents), from_snap, dest_name))
+        transferred = 0
+        before = time.time()
+        for offset, extent_length, exists in extents:
+            if not exists:
+                self._discard(dest, offset, extent_length)
+                continue
+            end = offset + extent_length
+            while offset < end:
+                chunk = min(self.chunk_size, end - offset)
+                dest.write(src.read(offset, chunk), offset)
+                offset += chunk
+                transferred += chunk
+
+                # yield to any other pending backups
+                eventlet.sleep(0)
+
+        delta = max(time.time() - before, 0.001)
+        LOG.debug("transferred %s bytes to '%s' (%dK/s)" %
+                  (transferred, dest_name, (transferred / delta) / 1024))
+
+    def _backup_rbd(self, backup_id, volume, source, length):
+        """Differential backup of an RBD volume to its base backup image."""
+        base_name = self._get_backup_base_name(volume['id'], diff_format=True)
+        new_snap = self._get_new_snap_name(backup_id)
+        LOG.debug("performing differential backup of '%s' to '%s'" %
+                  (volume['name'], base_name))
+
+        with rbddriver.RADOSClient(self, self._ceph_pool) as client:
+            base_created = False
+            if not self._rbd_image_exists(client.ioctx, base_name):
+                old_format, features = self._get_rbd_support()
+                self.rbd.RBD().create(ioctx=client.ioctx,
+                                      name=base_name,
+                                      size=length,
+                                      old_format=old_format,
+                                      features=features,
+                                      stripe_unit=self.rbd_stripe_unit,
+                                      stripe_count=self.rbd_stripe_count)
+                base_created = True
+
+            source_snaps = self._get_backup_snaps(source)
+            source.create_snap(new_snap)
+            base = self.rbd.Image(client.ioctx, base_name)
+            try:
+                base_snaps = self._get_backup_snaps(base)
+                from_snap = None
+                for snap in source_snaps:
+                    if snap in base_snaps:
+                        from_snap = snap
+                        break
+
+                if from_snap is None and not base_created:
+                    LOG.info(_("no backup snapshot common to '%(source)s' "
+                               "and '%(base)s', doing a full copy") %
+                             {'source': volume['name'], 'base': base_name})
+                    self._discard(base, 0, base.size())
+
+                if base.size() != length:
+                    base.resize(length)
+
+                src = self.rbd.Image(source.ioctx, str(volume['name']),
+                                     snapshot=new_snap, read_only=True)
+                try:
+                    self._transfer_diff(src, base, base_name, length,
+                                        from_snap)
+                finally:
+                    src.close()
+                base.create_snap(new_snap)
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    base.close()
+                    source.remove_snap(new_snap)
+                    if base_created:
+                        self.rbd.RBD().remove(client.ioctx, base_name)
+            else:
+                base.close()
+
+        # Only the most recent backup snapshot is needed on the source volume
+        for snap in source_snaps:
+            source.remove_snap(snap)
+
+    def _supports_aio(self):
+        """
+        Determine whether asynchronous I/O is supported by our version of
+        librbd
+        """
+        return hasattr(self.rbd.Image, 'aio_write')
+
+    def _wait_for_aio(self, completion):
+        """
+        Wait for an asynchronous librbd request to finish. librbd runs the
+        completion callbacks in its own threads so rather than blocking in
+        librbd we yield to other green threads until the request is done.
+        """
+        while not completion.is_complete():
+            eventlet.sleep(self.AIO_POLL_INTERVAL)
+        completion.wait_for_complete_and_cb()
+        ret = completion.get_return_value()
+        if ret < 0:
+            raise exception.BackupDriverException(
+                reason=_("asynchronous rbd request failed (%s)") % (ret))
+
+    def _start_chunk(self, src, dest, request, dest_is_rbd):
+        """
+        Start the transfer of a chunk, asynchronously if librbd supports it.
+        All-zero chunks are not written to rbd so that images stay sparse.
+        """
+        if not dest_is_rbd:
+            if not self._supports_aio():
+                request.data = src.read(request.offset, request.length)
+                return
+
+            # note: the callback runs in a librbd thread so it must only
+            # record the data.
+            def read_cb(completion, data):
+                request.data = data
+
+            request.completion = src.aio_read(request.offset, request.length,
+                                              read_cb)
+            return
+
+        data = src.read(request.length)
+        if utils.is_all_zero(data):
+            request.skipped = True
+        elif self._supports_aio():
+            request.completion = dest.aio_write(data, request.offset,
+                                                lambda completion: None)
+        else:
+            # note(dosaboy): librbd writes are synchronous so flush() will
+            # have not effect. Also, flush only supported in more recent
+            # versions of librbd.
+            dest.write(data, request.offset)
+
+    def _finish_chunk(self, dest, request, dest_is_rbd):
+        """Wait for a chunk transfer to finish and log its throughput."""
+        if request.completion is not None:
+            self._wait_for_aio(request.completion)
+        if not dest_is_rbd:
+            dest.write(request.data)
+            dest.flush()
+
+        delta = max(time.time() - request.started, 0.001)
+        if request.skipped:
+            LOG.debug("skipped all-zero chunk %s of %s" %
+                      (request.index, request.chunks))
+        else:
+            LOG.debug("transferred chunk %s of %s (%dK/s)" %
+                      (request.index, request.chunks,
+                       (request.length / delta) / 1024))
+
     def _transfer_data(self, src, dest, dest_name, length, dest_is_rbd=False):
         """
         Transfer data between file and rbd. If destination is rbd, source is
         assumed to be file, otherwise source is assumed to be rbd.
+
+        Up to backup_ceph_queue_depth chunks are kept in flight at once.
         """
         chunks = int(length / self.chunk_size)
+        if length % self.chunk_size:
+            chunks += 1
         LOG.debug("transferring %s chunks of %s bytes to '%s'" %
                   (chunks, self.chunk_size, dest_name))
-        for chunk in xrange(0, chunks):
-            offset = chunk * self.chunk_size
-            before = time.time()
-
-            if dest_is_rbd:
-                dest.write(src.read(self.chunk_size), offset)
-                # note(dosaboy): librbd writes are synchronous so flush() will
-                # have not effect. Also, flush only supported in more recent
-                # versions of librbd.
-            else:
-                dest.write(src.read(offset, self.chunk_size))
-                dest.flush()
-
-            delta = (time.time() - before)
-            rate = (self.chunk_size / delta) / 1024
-            LOG.debug("transferred chunk %s of %s (%dK/s)" %
-                      (chunk, chunks, rate))
-
-            # yield to any other pending backups
-            eventlet.sleep(0)
-
-        rem = int(length % self.chunk_size)
-        if rem:
-            LOG.debug("transferring remaining %s bytes" % (rem))
-            offset = (length - rem)
-            if dest_is_rbd:
-                dest.write(src.read(rem), offset)
-                # note(dosaboy): librbd writes are synchronous so flush() will
-                # have not effect. Also, flush only supported in more recent
-                # versions of librbd.
-            else:
-                dest.write(src.read(offset, rem))
-                dest.flush()
-
-            # yield to any other pending backups
-            eventlet.sleep(0)
+        pending = collections.deque()
+        transferred = 0
+        before = time.time()
+        try:
+            for chunk in xrange(0, chunks):
+                offset = chunk * self.chunk_size
+                request = _ChunkRequest(chunk, chunks, offset,
+                                        min(self.chunk_size, length - offset))
+                pending.append(request)
+                self._start_chunk(src, dest, request, dest_is_rbd)
+                while len(pending) >= self.queue_depth:
+                    self._finish_chunk(dest, pending.popleft(), dest_is_rbd)
+                transferred += request.length
+
+                # yield to any other pending backups
+                eventlet.sleep(0)
+
+            while pending:
+                self._finish_chunk(dest, pending.popleft(), dest_is_rbd)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                # librbd may still be using the buffers of requests in flight
+                for request in pending:
+                    if request.completion is not None:
+                        request.completion.wait_for_complete_and_cb()
+
+        delta = max(time.time() - before, 0.001)
+        LOG.debug("transferred %s bytes to '%s' (%dK/s)" %
+                  (transferred, dest_name, (transferred / delta) / 1024))
 
     def _backup_volume_from_file(self, backup_name, backup_size, volume_file):
         """Backup a volume from file stream"""
@@ -208,7 +468,10 @@ class CephBackupDriver(BackupDriver):
         else:
             backup_size = int(volume['size']) * units.GiB
 
-        if volume_file:
+        source = self._get_rbd_source(volume_file)
+        if source is not None and self._supports_diff():
+            self._backup_rbd(backup_id, volume, source, backup_size)
+        elif volume_file:
             self._backup_volume_from_file(backup_name, backup_size,
                                           volume_file)
         else:
@@ -224,8 +487,6 @@ class CephBackupDriver(BackupDriver):
     def restore(self, backup, volume_id, volume_file):
         """Restore the given volume backup from Ceph object store"""
         volume = self.db.volume_get(self.context, volume_id)
-        backup_name = self._get_backup_base_name(backup['volume_id'],
-                                                 backup['id'])
 
         LOG.debug('starting backup restore from Ceph backup=%s '
                   'to volume=%s' % (backup['id'], volume['name']))
@@ -236,7 +497,7 @@ class CephBackupDriver(BackupDriver):
         backup_size = int(volume['size']) * units.GiB
 
         with rbddriver.RADOSClient(self, self._ceph_pool) as client:
-            src_rbd = self.rbd.Image(client.ioctx, backup_name)
+            src_rbd = self._open_backup_image(client.ioctx, backup)
             try:
                 self._transfer_data(src_rbd, volume_file, volume['name'],
                                     backup_size)
@@ -254,6 +515,50 @@ class CephBackupDriver(BackupDriver):
 
         LOG.debug('restore %s to %s finished.' % (backup['id'], volume_id))
 
+    def _open_backup_image(self, ioctx, backup):
+        """Open the image, or base image snapshot, holding a backup."""
+        base_name = self._get_backup_base_name(backup['volume_id'],
+                                               diff_format=True)
+        if self._rbd_image_exists(ioctx, base_name):
+            base = self.rbd.Image(ioctx, base_name, read_only=True)
+            try:
+                snap = self._get_backup_snap_name(base, backup['id'])
+            finally:
+                base.close()
+            if snap is not None:
+                return self.rbd.Image(ioctx, base_name, snapshot=snap,
+                                      read_only=True)
+
+        backup_name = self._get_backup_base_name(backup['volume_id'],
+                                                 backup['id'])
+        return self.rbd.Image(ioctx, backup_name)
+
+    def _delete_backup_snap(self, ioctx, backup):
+        """
+        Delete the base image snapshot holding a differential backup, and the
+        base image once no backups remain in it. Returns False if the backup
+        is not a differential backup.
+        """
+        base_name = self._get_backup_base_name(backup['volume_id'],
+                                               diff_format=True)
+        if not self._rbd_image_exists(ioctx, base_name):
+            return False
+
+        base = self.rbd.Image(ioctx, base_name)
+        try:
+            snap = self._get_backup_snap_name(base, backup['id'])
+            if snap is None:
+                return False
+            base.remove_snap(snap)
+            remaining = self._get_backup_snaps(base)
+        finally:
+            base.close()
+
+        if not remaining:
+            LOG.debug("removing base image '%s'" % (base_name))
+            self.rbd.RBD().remove(ioctx, base_name)
+        return True
+
     def delete(self, backup):
         """Delete the given backup from Ceph object store"""
         backup_id = backup['id']
@@ -264,6 +569,9 @@ class CephBackupDriver(BackupDriver):
 
         try:
             with rbddriver.RADOSClient(self) as client:
+                if self._delete_backup_snap(client.ioctx, backup):
+                    LOG.debug(_("delete '%s' finished") % (backup_id))
+                    return
                 self.rbd.RBD().remove(client.ioctx, backup_name)
         except self.rbd.ImageNotFound:
             LOG.warning("rbd image '%s' not found but continuing anyway so "
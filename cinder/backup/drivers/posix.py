@@ -0,0 +1,249 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Implementation of a backup service that stores backups in a directory
+
+The directory may be local or a mounted network filesystem such as NFS,
+mounting it is left to the administrator. Backups use the same chunked
+object format as the Swift backup service. Each container is a
+subdirectory of backup_posix_path and objects are spread over two levels
+of hashed subdirectories of it, named after a hash of the volume the
+backup was taken from, so no single directory grows too large.
+
+**Related Flags**
+
+:backup_posix_path: The directory backups are stored in (default:
+                    $state_path/backup).
+:backup_posix_container: The default container, a subdirectory of
+                         backup_posix_path (default: backups).
+:backup_posix_object_size: The size in bytes of backup objects, rounded up
+                           to a multiple of the page size (default:
+                           52428800).
+:backup_posix_pipeline_depth: The number of backup chunks that may be
+                              compressed and written concurrently
+                              (default: 1).
+:backup_posix_restore_depth: The number of backup objects that may be read
+                             and decompressed concurrently during a restore
+                             (default: 1).
+:backup_posix_sparse: Record chunks that contain only zeros as holes in the
+                      backup metadata instead of writing them (default: True).
+"""
+
+import errno
+import hashlib
+import mmap
+import os
+import shutil
+
+from oslo.config import cfg
+
+from cinder.backup.chunkeddriver import ChunkedBackupDriver
+from cinder.backup.chunkeddriver import WRITE_BLOCK_SIZE
+from cinder import exception
+from cinder.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+posixbackup_service_opts = [
+    cfg.StrOpt('backup_posix_path',
+               default='$state_path/backup',
+               help='The directory backups are stored in'),
+    cfg.StrOpt('backup_posix_container',
+               default='backups',
+               help='The default container, a subdirectory of '
+                    'backup_posix_path'),
+    cfg.IntOpt('backup_posix_object_size',
+               default=52428800,
+               help='The size in bytes of backup objects, rounded up to a '
+                    'multiple of the page size'),
+    cfg.IntOpt('backup_posix_pipeline_depth',
+               default=1,
+               help='The number of backup chunks that may be compressed '
+                    'and written concurrently'),
+    cfg.IntOpt('backup_posix_restore_depth',
+               default=1,
+               help='The number of backup objects that may be read and '
+                    'decompressed concurrently during a restore'),
+    cfg.BoolOpt('backup_posix_sparse',
+                default=True,
+                help='Record chunks that contain only zeros as holes in the '
+                     'backup metadata instead of writing them'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(posixbackup_service_opts)
+
+
+class PosixObjectStore(object):
+    """Stores objects as files below a directory.
+
+    Provides the subset of the swiftclient connection interface used by
+    chunked backup drivers. Objects named '<volume>/<rest>' are stored at
+    '<container>/<h[0:2]>/<h[2:4]>/<volume>/<rest>', where h is the MD5 of
+    '<volume>', so all objects sharing a name prefix are in one directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _container_path(self, container):
+        """Return the directory of a container.
+
+        Containers are single directories right below path, anything that
+        would resolve elsewhere is rejected.
+        """
+        if (not container or os.path.isabs(container) or
+                os.sep in container or container in (os.curdir, os.pardir)):
+            msg = _('Invalid backup container name %s') % container
+            raise exception.InvalidBackup(reason=msg)
+        path = os.path.join(self.path, container)
+        base = os.path.realpath(self.path)
+        if os.path.dirname(os.path.realpath(path)) != base:
+            msg = (_('Backup container %(container)s is outside of '
+                     '%(path)s') % {'container': container, 'path': base})
+            raise exception.InvalidBackup(reason=msg)
+        return path
+
+    def _object_path(self, container, name):
+        volume = name.split('/', 1)[0]
+        digest = hashlib.md5(volume).hexdigest()
+        return os.path.join(self._container_path(container),
+                            digest[0:2], digest[2:4], name)
+
+    def put_container(self, container):
+        path = self._container_path(container)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def put_object(self, container, name, reader, content_length=None):
+        """Write an object, returning None as no ETag is computed.
+
+        The data is copied from reader a block at a time to a temporary
+        file that is synced and renamed into place, so an object is either
+        complete or absent.
+        """
+        path = self._object_path(container, name)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+        partial = '%s.part' % path
+        with open(partial, 'wb') as f:
+            shutil.copyfileobj(reader, f, WRITE_BLOCK_SIZE)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(partial, path)
+        return None
+
+    def get_object(self, container, name):
+        with open(self._object_path(container, name), 'rb') as f:
+            return None, f.read()
+
+    def map_object(self, container, name):
+        """Return a read only memory map of an object's data.
+
+        Pages are read from the file as the data is consumed, rather than
+        copying the whole object into memory first.
+        """
+        with open(self._object_path(container, name), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get_container(self, container, prefix, full_listing=True):
+        """List the objects whose name starts with prefix.
+
+        Only objects in the directory that prefix maps to are listed, which
+        holds every object of a backup.
+        """
+        directory, basename = os.path.split(
+            self._object_path(container, prefix))
+        try:
+            filenames = os.listdir(directory)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            filenames = []
+        name_dir = os.path.dirname(prefix)
+        objects = [{'name': '/'.join(filter(None, [name_dir, filename]))}
+                   for filename in sorted(filenames)
+                   if filename.startswith(basename) and
+                   not filename.endswith('.part')]
+        return None, objects
+
+    def delete_object(self, container, name):
+        """Delete an object and any directories left empty by it."""
+        path = self._object_path(container, name)
+        try:
+            os.unlink(path)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+        top = self._container_path(container)
+        directory = os.path.dirname(path)
+        while directory != top:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+
+class PosixBackupDriver(ChunkedBackupDriver):
+    """Provides backup, restore and delete of backups in a directory."""
+
+    TRANSFER_ERRORS = (IOError, OSError)
+    TRANSFER_EXCEPTION = exception.BackupDriverException
+
+    def __init__(self, context, db_driver=None):
+        self.backup_path = CONF.backup_posix_path
+        # Whole pages keep the volume reads and the object files aligned.
+        chunk_size_bytes = CONF.backup_posix_object_size
+        remainder = chunk_size_bytes % mmap.PAGESIZE
+        if remainder or chunk_size_bytes <= 0:
+            chunk_size_bytes = max(chunk_size_bytes - remainder +
+                                   mmap.PAGESIZE, mmap.PAGESIZE)
+            LOG.warn(_('backup_posix_object_size %(size)d is not a multiple '
+                       'of the page size, using %(aligned)d') %
+                     {'size': CONF.backup_posix_object_size,
+                      'aligned': chunk_size_bytes})
+
+        super(PosixBackupDriver, self).__init__(
+            context,
+            chunk_size_bytes=chunk_size_bytes,
+            pipeline_depth=CONF.backup_posix_pipeline_depth,
+            restore_depth=CONF.backup_posix_restore_depth,
+            sparse=CONF.backup_posix_sparse,
+            default_container=CONF.backup_posix_container,
+            db_driver=db_driver)
+
+    def _create_connection(self):
+        return PosixObjectStore(self.backup_path)
+
+    def _ensure_container(self, container):
+        self.conn.put_container(container)
+
+    def _get_object_data(self, conn, container, object_name, object_meta):
+        # Uncompressed data is written to the volume and compressed data
+        # read by the decompressor straight from the page cache, without
+        # the object being copied into memory first.
+        return conn.map_object(container, object_name)
+
+
+def get_backup_driver(context):
+    return PosixBackupDriver(context)
@@ -25,25 +25,50 @@
                                     operations (default: 10).
 :backup_swift_retry_backoff: The backoff time in seconds between retrying
                                     failed Swift operations (default: 10).
-:backup_compression_algorithm: Compression algorithm to use for volume
-                               backups. Supported options are:
-                               None (to disable), zlib and bz2 (default: zlib)
+:backup_swift_pipeline_depth: The number of backup chunks that may be
+                              compressed and uploaded concurrently
+                              (default: 1).
+:backup_swift_sparse: Record chunks that contain only zeros as holes in the
+                      backup metadata instead of uploading them
+                      (default: True).
+:backup_swift_restore_depth: The number of backup objects that may be
+                             downloaded and decompressed concurrently during
+                             a restore (default: 1).
+:backup_swift_pool_size: The number of idle Swift connections kept for
+                         reuse per set of credentials (default: 10).
+:backup_swift_pool_idle_timeout: Pooled connections unused for this many
+                                 seconds are closed (default: 300).
+:backup_swift_pool_check_interval: Pooled connections unused for this many
+                                   seconds are checked before being reused
+                                   (default: 30).
+:backup_swift_token_ttl: The number of seconds an auth token obtained in
+                         single_user mode is reused (default: 3600).
+:backup_swift_delete_depth: The number of backup objects deleted
+                            concurrently (default: 8).
+:backup_swift_bulk_delete: Delete backup objects with the bulk delete
+                           middleware when the Swift cluster provides it
+                           (default: True).
+
+Compression, incremental backups and the layout of the backup metadata are
+common to all chunked backup drivers, see :mod:`cinder.backup.chunkeddriver`.
 """
 
-import hashlib
+import collections
+import contextlib
 import httplib
 import json
-import os
 import socket
-import StringIO
+import time
+import urllib
+import urlparse
+
+from eventlet import semaphore
 
-import eventlet
 from oslo.config import cfg
 
-from cinder.backup.driver import BackupDriver
+from cinder.backup.chunkeddriver import ChunkedBackupDriver
 from cinder import exception
 from cinder.openstack.common import log as logging
-from cinder.openstack.common import timeutils
 from swiftclient import client as swift
 
 
@@ -74,47 +99,259 @@ swiftbackup_service_opts = [
     cfg.IntOpt('backup_swift_retry_backoff',
                default=2,
                help='The backoff time in seconds between Swift retries'),
-    cfg.StrOpt('backup_compression_algorithm',
-               default='zlib',
-               help='Compression algorithm (None to disable)'),
+    cfg.IntOpt('backup_swift_pipeline_depth',
+               default=1,
+               help='The number of backup chunks that may be compressed and '
+                    'uploaded to Swift concurrently. Memory use of a backup '
+                    'is bounded by this value times backup_swift_object_size'),
+    cfg.BoolOpt('backup_swift_sparse',
+                default=True,
+                help='Record chunks that contain only zeros as holes in the '
+                     'backup metadata instead of uploading them to Swift'),
+    cfg.IntOpt('backup_swift_restore_depth',
+               default=1,
+               help='The number of backup objects that may be downloaded '
+                    'from Swift and decompressed concurrently during a '
+                    'restore. Memory use of a restore is bounded by this '
+                    'value times the size of the backup objects'),
+    cfg.IntOpt('backup_swift_pool_size',
+               default=10,
+               help='The number of idle Swift connections kept for reuse by '
+                    'later transfers, per set of credentials. 0 disables '
+                    'connection reuse'),
+    cfg.IntOpt('backup_swift_pool_idle_timeout',
+               default=300,
+               help='The number of seconds an idle pooled Swift connection '
+                    'is kept'),
+    cfg.IntOpt('backup_swift_pool_check_interval',
+               default=30,
+               help='Pooled Swift connections idle for longer than this '
+                    'many seconds are checked with a HEAD of the account '
+                    'before being reused'),
+    cfg.IntOpt('backup_swift_token_ttl',
+               default=3600,
+               help='The number of seconds an auth token obtained in '
+                    'single_user mode is shared by Swift connections before '
+                    'it is refreshed. Should be less than the lifetime of '
+                    'the tokens issued by the auth service'),
+    cfg.IntOpt('backup_swift_delete_depth',
+               default=8,
+               help='The number of backup objects deleted from Swift '
+                    'concurrently'),
+    cfg.BoolOpt('backup_swift_bulk_delete',
+                default=True,
+                help='Delete backup objects with the bulk delete middleware '
+                     'when the Swift cluster lists it in its capabilities'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(swiftbackup_service_opts)
 
+_POOL = None
+
+# The capabilities reported by each Swift cluster, by host.
+_CAPABILITIES = {}
 
-class SwiftBackupDriver(BackupDriver):
-    """Provides backup, restore and delete of backup objects within Swift."""
 
-    DRIVER_VERSION = '1.0.0'
-    DRIVER_VERSION_MAPPING = {'1.0.0': '_restore_v1'}
+def _get_capabilities(url):
+    """Return the capabilities a Swift cluster reports at /info.
 
-    def _get_compressor(self, algorithm):
+    Clusters that predate /info report no capabilities. The result is
+    cached for the life of the process.
+    """
+    parsed = urlparse.urlparse(url)
+    if parsed.netloc not in _CAPABILITIES:
+        info_url = '%s://%s/info' % (parsed.scheme, parsed.netloc)
+        capabilities = {}
         try:
-            if algorithm.lower() in ('none', 'off', 'no'):
-                return None
-            elif algorithm.lower() in ('zlib', 'gzip'):
-                import zlib as compressor
-                return compressor
-            elif algorithm.lower() in ('bz2', 'bzip2'):
-                import bz2 as compressor
-                return compressor
-        except ImportError:
-            pass
-
-        err = _('unsupported compression algorithm: %s') % algorithm
-        raise ValueError(unicode(err))
+            info_parsed, conn = swift.http_connection(info_url)
+            conn.request('GET', info_parsed.path, '', {})
+            resp = conn.getresponse()
+            body = resp.read()
+            if resp.status == httplib.OK:
+                capabilities = json.loads(body)
+        except (socket.error, httplib.HTTPException, ValueError) as err:
+            LOG.debug(_('Unable to read capabilities from %(url)s: '
+                        '%(err)s') % {'url': info_url, 'err': err})
+        _CAPABILITIES[parsed.netloc] = capabilities
+    return _CAPABILITIES[parsed.netloc]
+
+
+def _bulk_delete(url, token, container, object_names, http_conn=None):
+    """Delete objects with one request to the bulk delete middleware.
+
+    Has the signature of the swiftclient request functions, so it can be
+    run with the retry and re-authentication handling of a connection.
+    Returns the names of the objects that could not be deleted.
+    """
+    if http_conn:
+        parsed, conn = http_conn
+    else:
+        parsed, conn = swift.http_connection(url)
+    body = '\n'.join(urllib.quote('/%s/%s' % (container, object_name))
+                     for object_name in object_names)
+    headers = {'X-Auth-Token': token,
+               'Content-Type': 'text/plain',
+               'Accept': 'application/json'}
+    conn.request('POST', '%s?bulk-delete' % parsed.path, body, headers)
+    resp = conn.getresponse()
+    body = resp.read()
+    if resp.status < 200 or resp.status >= 300:
+        raise swift.ClientException('Bulk delete failed',
+                                    http_scheme=parsed.scheme,
+                                    http_host=conn.host,
+                                    http_port=conn.port,
+                                    http_path=parsed.path,
+                                    http_status=resp.status,
+                                    http_reason=resp.reason,
+                                    http_response_content=body)
+    result = json.loads(body)
+    prefix = '/%s/' % container
+    failed = [urllib.unquote(name)[len(prefix):]
+              for name, status in result.get('Errors', [])]
+    if not failed and not result['Response Status'].startswith('2'):
+        failed = list(object_names)
+    return failed
+
+
+class SwiftConnectionPool(object):
+    """Keeps idle Swift connections for reuse by later transfers.
+
+    Connections are kept per set of credentials, so a request made with one
+    user's token never goes out on a connection holding another's. A pooled
+    swiftclient connection keeps its HTTP connection open, saving a TCP and
+    TLS handshake per transfer. Connections idle for longer than
+    check_interval are checked with a HEAD of the account before they are
+    reused, and those idle for longer than idle_timeout are dropped.
+
+    Connections that authenticate themselves (single_user mode) share one
+    auth token per set of credentials, which is refreshed once it is older
+    than token_ttl.
+    """
+
+    def __init__(self, max_idle, idle_timeout, check_interval, token_ttl):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.token_ttl = token_ttl
+        self._idle = collections.defaultdict(collections.deque)
+        self._tokens = {}
+        self._auth_lock = semaphore.Semaphore()
+
+    def _prune(self, now):
+        for key, idle in self._idle.items():
+            while idle and now - idle[0][1] > self.idle_timeout:
+                idle.popleft()
+            if not idle:
+                del self._idle[key]
+        for key, (url, token, issued) in self._tokens.items():
+            if now - issued > self.token_ttl:
+                LOG.debug(_('Swift auth token for %s expired') % key[1])
+                del self._tokens[key]
+
+    def _healthy(self, conn):
+        try:
+            conn.head_account()
+        except Exception as err:
+            LOG.debug(_('Dropping idle Swift connection: %s') % err)
+            return False
+        return True
+
+    def _authenticate(self, key, conn):
+        with self._auth_lock:
+            if key not in self._tokens:
+                url, token = conn.get_auth()
+                self._tokens[key] = (url, token, time.time())
+            conn.url, conn.token = self._tokens[key][:2]
+
+    def get(self, key, create):
+        """Return an idle connection for key, or a new one from create()."""
+        now = time.time()
+        self._prune(now)
+        conn = None
+        idle = self._idle.get(key)
+        while idle:
+            # The most recently used connection is the most likely to still
+            # have an open HTTP connection.
+            candidate, last_used = idle.pop()
+            if (now - last_used <= self.check_interval or
+                    self._healthy(candidate)):
+                conn = candidate
+                break
+        if conn is None:
+            conn = create()
+        if conn.authurl:
+            self._authenticate(key, conn)
+        return conn
+
+    def put(self, key, conn):
+        """Return a connection that is free for reuse to the pool."""
+        now = time.time()
+        if conn.authurl and conn.token:
+            cached = self._tokens.get(key)
+            if cached is None or cached[1] != conn.token:
+                # swiftclient authenticated again after a 401.
+                self._tokens[key] = (conn.url, conn.token, now)
+        if self.max_idle <= 0:
+            return
+        idle = self._idle[key]
+        idle.append((conn, now))
+        while len(idle) > self.max_idle:
+            idle.popleft()
+
+
+def _get_pool():
+    global _POOL
+    if _POOL is None:
+        _POOL = SwiftConnectionPool(CONF.backup_swift_pool_size,
+                                    CONF.backup_swift_pool_idle_timeout,
+                                    CONF.backup_swift_pool_check_interval,
+                                    CONF.backup_swift_token_ttl)
+    return _POOL
+
+
+class PooledConnection(object):
+    """A Swift connection that runs each request on a pooled connection.
+
+    Provides item() like an eventlet pool, so one object serves both the
+    driver's own requests and its concurrent transfers.
+    """
+
+    def __init__(self, pool, key, create):
+        self._pool = pool
+        self._key = key
+        self._create = create
+
+    @contextlib.contextmanager
+    def item(self):
+        conn = self._pool.get(self._key, self._create)
+        try:
+            yield conn
+        except swift.ClientException:
+            # The request completed, the connection can carry another.
+            self._pool.put(self._key, conn)
+            raise
+        self._pool.put(self._key, conn)
+
+    def __getattr__(self, attr):
+        def request(*args, **kwargs):
+            with self.item() as conn:
+                return getattr(conn, attr)(*args, **kwargs)
+        return request
+
+
+class SwiftBackupDriver(ChunkedBackupDriver):
+    """Provides backup, restore and delete of backup objects within Swift."""
+
+    TRANSFER_ERRORS = (socket.error,)
+    TRANSFER_EXCEPTION = exception.SwiftConnectionFailed
 
     def __init__(self, context, db_driver=None):
         self.context = context
         self.swift_url = '%s%s' % (CONF.backup_swift_url,
                                    self.context.project_id)
-        self.az = CONF.storage_availability_zone
-        self.data_block_size_bytes = CONF.backup_swift_object_size
         self.swift_attempts = CONF.backup_swift_retry_attempts
         self.swift_backoff = CONF.backup_swift_retry_backoff
-        self.compressor = \
-            self._get_compressor(CONF.backup_compression_algorithm)
         LOG.debug('Connect to %s in "%s" mode' % (CONF.backup_swift_url,
                                                   CONF.backup_swift_auth))
         if CONF.backup_swift_auth == 'single_user':
@@ -123,18 +360,85 @@ class SwiftBackupDriver(BackupDriver):
                             "but %(param)s not set")
                           % {'param': 'backup_swift_user'})
                 raise exception.ParameterNotFound(param='backup_swift_user')
-            self.conn = swift.Connection(authurl=CONF.backup_swift_url,
-                                         user=CONF.backup_swift_user,
-                                         key=CONF.backup_swift_key,
-                                         retries=self.swift_attempts,
-                                         starting_backoff=self.swift_backoff)
-        else:
-            self.conn = swift.Connection(retries=self.swift_attempts,
-                                         preauthurl=self.swift_url,
-                                         preauthtoken=self.context.auth_token,
-                                         starting_backoff=self.swift_backoff)
 
-        super(SwiftBackupDriver, self).__init__(db_driver)
+        super(SwiftBackupDriver, self).__init__(
+            context,
+            chunk_size_bytes=CONF.backup_swift_object_size,
+            pipeline_depth=CONF.backup_swift_pipeline_depth,
+            restore_depth=CONF.backup_swift_restore_depth,
+            sparse=CONF.backup_swift_sparse,
+            default_container=CONF.backup_swift_container,
+            db_driver=db_driver,
+            delete_depth=CONF.backup_swift_delete_depth)
+
+    def _create_connection(self):
+        """Return a connection drawing on the process wide pool."""
+        if CONF.backup_swift_auth == 'single_user':
+            key = ('single_user', CONF.backup_swift_url,
+                   CONF.backup_swift_user)
+        else:
+            key = ('per_user', self.swift_url, self.context.auth_token)
+        return PooledConnection(_get_pool(), key, self._new_connection)
+
+    def _connection_pool(self, size):
+        """Concurrent transfers borrow from the process wide pool too."""
+        return self.conn
+
+    def _bulk_delete_limit(self):
+        """Return the bulk delete batch size, 0 if it is not available."""
+        if not CONF.backup_swift_bulk_delete:
+            return 0
+        with self.conn.item() as conn:
+            url = conn.url
+        bulk_delete = _get_capabilities(url).get('bulk_delete')
+        if bulk_delete is None:
+            return 0
+        return bulk_delete.get('max_deletes_per_request', 10000)
+
+    def _delete_objects(self, container, object_names):
+        """Delete objects in bulk when Swift supports it.
+
+        Batches the bulk delete request fails for are deleted one object at
+        a time instead.
+        """
+        limit = self._bulk_delete_limit()
+        if not limit:
+            return super(SwiftBackupDriver, self)._delete_objects(
+                container, object_names)
+        failed = []
+        for start in xrange(0, len(object_names), limit):
+            batch = object_names[start:start + limit]
+            try:
+                with self.conn.item() as conn:
+                    # swiftclient has no bulk delete call, but its retry
+                    # handling applies to any request function.
+                    batch_failed = conn._retry(None, _bulk_delete, container,
+                                               batch)
+            except (socket.error, swift.ClientException) as err:
+                LOG.warn(_('bulk delete failed, deleting objects one at a '
+                           'time: %s') % err)
+                batch_failed = super(SwiftBackupDriver, self)._delete_objects(
+                    container, batch)
+            else:
+                LOG.debug(_('bulk deleted %(count)d objects in container '
+                            '%(container)s') %
+                          {'count': len(batch) - len(batch_failed),
+                           'container': container})
+            failed.extend(batch_failed)
+        return failed
+
+    def _new_connection(self):
+        """Open a new Swift connection using the configured auth mode."""
+        if CONF.backup_swift_auth == 'single_user':
+            return swift.Connection(authurl=CONF.backup_swift_url,
+                                    user=CONF.backup_swift_user,
+                                    key=CONF.backup_swift_key,
+                                    retries=self.swift_attempts,
+                                    starting_backoff=self.swift_backoff)
+        return swift.Connection(retries=self.swift_attempts,
+                                preauthurl=self.swift_url,
+                                preauthtoken=self.context.auth_token,
+                                starting_backoff=self.swift_backoff)
 
     def _check_container_exists(self, container):
         LOG.debug(_('_check_container_exists: container: %s') % container)
@@ -150,321 +454,9 @@ class SwiftBackupDriver(BackupDriver):
             LOG.debug(_('container %s exists') % container)
             return True
 
-    def _create_container(self, context, backup):
-        backup_id = backup['id']
-        container = backup['container']
-        LOG.debug(_('_create_container started, container: %(container)s,'
-                    'backup: %(backup_id)s') %
-                  {'container': container, 'backup_id': backup_id})
-        if container is None:
-            container = CONF.backup_swift_container
-            self.db.backup_update(context, backup_id, {'container': container})
+    def _ensure_container(self, container):
         if not self._check_container_exists(container):
             self.conn.put_container(container)
-        return container
-
-    def _generate_swift_object_name_prefix(self, backup):
-        az = 'az_%s' % self.az
-        backup_name = '%s_backup_%s' % (az, backup['id'])
-        volume = 'volume_%s' % (backup['volume_id'])
-        timestamp = timeutils.strtime(fmt="%Y%m%d%H%M%S")
-        prefix = volume + '/' + timestamp + '/' + backup_name
-        LOG.debug(_('_generate_swift_object_name_prefix: %s') % prefix)
-        return prefix
-
-    def _generate_object_names(self, backup):
-        prefix = backup['service_metadata']
-        swift_objects = self.conn.get_container(backup['container'],
-                                                prefix=prefix,
-                                                full_listing=True)[1]
-        swift_object_names = [swift_obj['name'] for swift_obj in swift_objects]
-        LOG.debug(_('generated object list: %s') % swift_object_names)
-        return swift_object_names
-
-    def _metadata_filename(self, backup):
-        swift_object_name = backup['service_metadata']
-        filename = '%s_metadata' % swift_object_name
-        return filename
-
-    def _write_metadata(self, backup, volume_id, container, object_list):
-        filename = self._metadata_filename(backup)
-        LOG.debug(_('_write_metadata started, container name: %(container)s,'
-                    ' metadata filename: %(filename)s') %
-                  {'container': container, 'filename': filename})
-        metadata = {}
-        metadata['version'] = self.DRIVER_VERSION
-        metadata['backup_id'] = backup['id']
-        metadata['volume_id'] = volume_id
-        metadata['backup_name'] = backup['display_name']
-        metadata['backup_description'] = backup['display_description']
-        metadata['created_at'] = str(backup['created_at'])
-        metadata['objects'] = object_list
-        metadata_json = json.dumps(metadata, sort_keys=True, indent=2)
-        reader = StringIO.StringIO(metadata_json)
-        etag = self.conn.put_object(container, filename, reader,
-                                    content_length=reader.len)
-        md5 = hashlib.md5(metadata_json).hexdigest()
-        if etag != md5:
-            err = _('error writing metadata file to swift, MD5 of metadata'
-                    ' file in swift [%(etag)s] is not the same as MD5 of '
-                    'metadata file sent to swift [%(md5)s]') % {'etag': etag,
-                                                                'md5': md5}
-            raise exception.InvalidBackup(reason=err)
-        LOG.debug(_('_write_metadata finished'))
-
-    def _read_metadata(self, backup):
-        container = backup['container']
-        filename = self._metadata_filename(backup)
-        LOG.debug(_('_read_metadata started, container name: %(container)s, '
-                    'metadata filename: %(filename)s') %
-                  {'container': container, 'filename': filename})
-        (resp, body) = self.conn.get_object(container, filename)
-        metadata = json.loads(body)
-        LOG.debug(_('_read_metadata finished (%s)') % metadata)
-        return metadata
-
-    def _prepare_backup(self, backup):
-        """Prepare the backup process and return the backup metadata"""
-        backup_id = backup['id']
-        volume_id = backup['volume_id']
-        volume = self.db.volume_get(self.context, volume_id)
-
-        if volume['size'] <= 0:
-            err = _('volume size %d is invalid.') % volume['size']
-            raise exception.InvalidVolume(reason=err)
-
-        try:
-            container = self._create_container(self.context, backup)
-        except socket.error as err:
-            raise exception.SwiftConnectionFailed(reason=str(err))
-
-        object_prefix = self._generate_swift_object_name_prefix(backup)
-        backup['service_metadata'] = object_prefix
-        self.db.backup_update(self.context, backup_id, {'service_metadata':
-                                                        object_prefix})
-        volume_size_bytes = volume['size'] * 1024 * 1024 * 1024
-        availability_zone = self.az
-        LOG.debug(_('starting backup of volume: %(volume_id)s to swift,'
-                    ' volume size: %(volume_size_bytes)d, swift object names'
-                    ' prefix %(object_prefix)s, availability zone:'
-                    ' %(availability_zone)s') %
-                  {
-                      'volume_id': volume_id,
-                      'volume_size_bytes': volume_size_bytes,
-                      'object_prefix': object_prefix,
-                      'availability_zone': availability_zone,
-                  })
-        object_meta = {'id': 1, 'list': [], 'prefix': object_prefix}
-        return object_meta, container
-
-    def _backup_chunk(self, backup, container, data, data_offset, object_meta):
-        """Backup data chunk based on the object metadata and offset"""
-        object_prefix = object_meta['prefix']
-        object_list = object_meta['list']
-        object_id = object_meta['id']
-        object_name = '%s-%05d' % (object_prefix, object_id)
-        obj = {}
-        obj[object_name] = {}
-        obj[object_name]['offset'] = data_offset
-        obj[object_name]['length'] = len(data)
-        LOG.debug(_('reading chunk of data from volume'))
-        if self.compressor is not None:
-            algorithm = CONF.backup_compression_algorithm.lower()
-            obj[object_name]['compression'] = algorithm
-            data_size_bytes = len(data)
-            data = self.compressor.compress(data)
-            comp_size_bytes = len(data)
-            LOG.debug(_('compressed %(data_size_bytes)d bytes of data '
-                        'to %(comp_size_bytes)d bytes using '
-                        '%(algorithm)s') %
-                      {
-                          'data_size_bytes': data_size_bytes,
-                          'comp_size_bytes': comp_size_bytes,
-                          'algorithm': algorithm,
-                      })
-        else:
-            LOG.debug(_('not compressing data'))
-            obj[object_name]['compression'] = 'none'
-
-        reader = StringIO.StringIO(data)
-        LOG.debug(_('About to put_object'))
-        try:
-            etag = self.conn.put_object(container, object_name, reader,
-                                        content_length=len(data))
-        except socket.error as err:
-            raise exception.SwiftConnectionFailed(reason=str(err))
-        LOG.debug(_('swift MD5 for %(object_name)s: %(etag)s') %
-                  {'object_name': object_name, 'etag': etag, })
-        md5 = hashlib.md5(data).hexdigest()
-        obj[object_name]['md5'] = md5
-        LOG.debug(_('backup MD5 for %(object_name)s: %(md5)s') %
-                  {'object_name': object_name, 'md5': md5})
-        if etag != md5:
-            err = _('error writing object to swift, MD5 of object in '
-                    'swift %(etag)s is not the same as MD5 of object sent '
-                    'to swift %(md5)s') % {'etag': etag, 'md5': md5}
-            raise exception.InvalidBackup(reason=err)
-        object_list.append(obj)
-        object_id += 1
-        object_meta['list'] = object_list
-        object_meta['id'] = object_id
-        LOG.debug(_('Calling eventlet.sleep(0)'))
-        eventlet.sleep(0)
-
-    def _finalize_backup(self, backup, container, object_meta):
-        """Finalize the backup by updating its metadata on Swift"""
-        object_list = object_meta['list']
-        object_id = object_meta['id']
-        try:
-            self._write_metadata(backup,
-                                 backup['volume_id'],
-                                 container,
-                                 object_list)
-        except socket.error as err:
-            raise exception.SwiftConnectionFailed(reason=str(err))
-        self.db.backup_update(self.context, backup['id'],
-                              {'object_count': object_id})
-        LOG.debug(_('backup %s finished.') % backup['id'])
-
-    def backup(self, backup, volume_file):
-        """Backup the given volume to swift using the given backup metadata."""
-        object_meta, container = self._prepare_backup(backup)
-        while True:
-            data = volume_file.read(self.data_block_size_bytes)
-            data_offset = volume_file.tell()
-            if data == '':
-                break
-            self._backup_chunk(backup, container, data,
-                               data_offset, object_meta)
-        self._finalize_backup(backup, container, object_meta)
-
-    def _restore_v1(self, backup, volume_id, metadata, volume_file):
-        """Restore a v1 swift volume backup from swift."""
-        backup_id = backup['id']
-        LOG.debug(_('v1 swift volume backup restore of %s started'), backup_id)
-        container = backup['container']
-        metadata_objects = metadata['objects']
-        metadata_object_names = sum((obj.keys() for obj in metadata_objects),
-                                    [])
-        LOG.debug(_('metadata_object_names = %s') % metadata_object_names)
-        prune_list = [self._metadata_filename(backup)]
-        swift_object_names = [swift_object_name for swift_object_name in
-                              self._generate_object_names(backup)
-                              if swift_object_name not in prune_list]
-        if sorted(swift_object_names) != sorted(metadata_object_names):
-            err = _('restore_backup aborted, actual swift object list in '
-                    'swift does not match object list stored in metadata')
-            raise exception.InvalidBackup(reason=err)
-
-        for metadata_object in metadata_objects:
-            object_name = metadata_object.keys()[0]
-            LOG.debug(_('restoring object from swift. backup: %(backup_id)s, '
-                        'container: %(container)s, swift object name: '
-                        '%(object_name)s, volume: %(volume_id)s') %
-                      {
-                          'backup_id': backup_id,
-                          'container': container,
-                          'object_name': object_name,
-                          'volume_id': volume_id,
-                      })
-            try:
-                (resp, body) = self.conn.get_object(container, object_name)
-            except socket.error as err:
-                raise exception.SwiftConnectionFailed(reason=str(err))
-            compression_algorithm = metadata_object[object_name]['compression']
-            decompressor = self._get_compressor(compression_algorithm)
-            if decompressor is not None:
-                LOG.debug(_('decompressing data using %s algorithm') %
-                          compression_algorithm)
-                decompressed = decompressor.decompress(body)
-                volume_file.write(decompressed)
-            else:
-                volume_file.write(body)
-
-            # force flush every write to avoid long blocking write on close
-            volume_file.flush()
-
-            # Be tolerant to IO implementations that do not support fileno()
-            try:
-                fileno = volume_file.fileno()
-            except IOError:
-                LOG.info("volume_file does not support fileno() so skipping "
-                         "fsync()")
-            else:
-                os.fsync(fileno)
-
-            # Restoring a backup to a volume can take some time. Yield so other
-            # threads can run, allowing for among other things the service
-            # status to be updated
-            eventlet.sleep(0)
-        LOG.debug(_('v1 swift volume backup restore of %s finished'),
-                  backup_id)
-
-    def restore(self, backup, volume_id, volume_file):
-        """Restore the given volume backup from swift."""
-        backup_id = backup['id']
-        container = backup['container']
-        object_prefix = backup['service_metadata']
-        LOG.debug(_('starting restore of backup %(object_prefix)s from swift'
-                    ' container: %(container)s, to volume %(volume_id)s, '
-                    'backup: %(backup_id)s') %
-                  {
-                      'object_prefix': object_prefix,
-                      'container': container,
-                      'volume_id': volume_id,
-                      'backup_id': backup_id,
-                  })
-        try:
-            metadata = self._read_metadata(backup)
-        except socket.error as err:
-            raise exception.SwiftConnectionFailed(reason=str(err))
-        metadata_version = metadata['version']
-        LOG.debug(_('Restoring swift backup version %s'), metadata_version)
-        try:
-            restore_func = getattr(self, self.DRIVER_VERSION_MAPPING.get(
-                metadata_version))
-        except TypeError:
-            err = (_('No support to restore swift backup version %s')
-                   % metadata_version)
-            raise exception.InvalidBackup(reason=err)
-        restore_func(backup, volume_id, metadata, volume_file)
-        LOG.debug(_('restore %(backup_id)s to %(volume_id)s finished.') %
-                  {'backup_id': backup_id, 'volume_id': volume_id})
-
-    def delete(self, backup):
-        """Delete the given backup from swift."""
-        container = backup['container']
-        LOG.debug('delete started, backup: %s, container: %s, prefix: %s',
-                  backup['id'], container, backup['service_metadata'])
-
-        if container is not None:
-            swift_object_names = []
-            try:
-                swift_object_names = self._generate_object_names(backup)
-            except Exception:
-                LOG.warn(_('swift error while listing objects, continuing'
-                           ' with delete'))
-
-            for swift_object_name in swift_object_names:
-                try:
-                    self.conn.delete_object(container, swift_object_name)
-                except socket.error as err:
-                    raise exception.SwiftConnectionFailed(reason=str(err))
-                except Exception:
-                    LOG.warn(_('swift error while deleting object %s, '
-                               'continuing with delete') % swift_object_name)
-                else:
-                    LOG.debug(_('deleted swift object: %(swift_object_name)s'
-                                ' in container: %(container)s') %
-                              {
-                                  'swift_object_name': swift_object_name,
-                                  'container': container
-                              })
-                # Deleting a backup's objects from swift can take some time.
-                # Yield so other threads can run
-                eventlet.sleep(0)
-
-        LOG.debug(_('delete %s finished') % backup['id'])
 
 
 def get_backup_driver(context):
@@ -0,0 +1,174 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Scheduling and throttling of the data transfers run by a backup service.
+
+Every backup and restore handled by a backup service takes a slot in a
+:class:`JobQueue` before it starts moving data. When all slots are in use,
+jobs wait in priority order, so restores are started before any queued
+backup. The data of running jobs can be rate limited by sharing a
+:class:`cinder.utils.TokenBucket` between them.
+"""
+
+import contextlib
+import heapq
+import itertools
+import time
+
+from eventlet import event
+
+from cinder.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+# Lower values are started first.
+PRIORITY_RESTORE = 0
+PRIORITY_BACKUP = 1
+PRIORITY_VERIFY = 2
+
+
+class JobQueue(object):
+    """Runs at most max_jobs jobs at once, queueing the rest by priority.
+
+    A max_jobs of 0 or less does not limit the number of running jobs.
+    Jobs of the same priority are started in the order they arrived.
+    """
+
+    def __init__(self, max_jobs=0):
+        self.max_jobs = max_jobs
+        self.running = 0
+        self._waiting = []
+        self._counter = itertools.count()
+
+    @property
+    def depth(self):
+        """The number of jobs waiting for a slot."""
+        return len(self._waiting)
+
+    def _has_slot(self):
+        return self.max_jobs <= 0 or self.running < self.max_jobs
+
+    def acquire(self, priority):
+        """Wait for a free slot, returning the number of seconds waited."""
+        if self._has_slot() and not self._waiting:
+            self.running += 1
+            return 0
+        start = time.time()
+        ready = event.Event()
+        entry = (priority, self._counter.next(), ready)
+        heapq.heappush(self._waiting, entry)
+        try:
+            ready.wait()
+        except BaseException:
+            # The waiter was killed or timed out.  Give back the slot if it
+            # had already been handed over, otherwise leave the queue.
+            if ready.ready():
+                self.release()
+            else:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+            raise
+        return time.time() - start
+
+    def release(self):
+        """Free a slot, handing it to the most urgent waiting job."""
+        self.running -= 1
+        while self._waiting and self._has_slot():
+            ready = heapq.heappop(self._waiting)[2]
+            self.running += 1
+            ready.send()
+
+    @contextlib.contextmanager
+    def job(self, description, priority):
+        """Run the body of the with statement as a job."""
+        if self.depth or not self._has_slot():
+            LOG.info(_('%(job)s queued, %(running)d jobs running and '
+                       '%(depth)d waiting') %
+                     {'job': description, 'running': self.running,
+                      'depth': self.depth})
+        waited = self.acquire(priority)
+        if waited:
+            LOG.info(_('%(job)s started after waiting %(waited).1f seconds')
+                     % {'job': description, 'waited': waited})
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class ThrottledFile(object):
+    """Wraps a volume file, counting and rate limiting the data moved.
+
+    Other attributes are passed through to the wrapped file.
+    """
+
+    def __init__(self, volume_file, bucket=None):
+        self._file = volume_file
+        self._bucket = bucket
+        self.bytes = 0
+
+    def _account(self, length):
+        self.bytes += length
+        if self._bucket is not None and length:
+            self._bucket.consume(length)
+
+    def read(self, *args):
+        data = self._file.read(*args)
+        self._account(len(data))
+        return data
+
+    def write(self, data):
+        self._account(len(data))
+        return self._file.write(data)
+
+    def __getattr__(self, attr):
+        return getattr(self._file, attr)
+
+
+class ThrottledBackupDriver(object):
+    """Wraps a backup driver so its transfers go through a ThrottledFile.
+
+    The number of bytes moved by the last backup or restore is available
+    as bytes_transferred once it has finished.
+    """
+
+    def __init__(self, backup_driver, bucket=None):
+        self._driver = backup_driver
+        self._bucket = bucket
+        self.bytes_transferred = 0
+
+    def _run(self, func, args, volume_file):
+        throttled = ThrottledFile(volume_file, self._bucket)
+        try:
+            return func(*(args + (throttled,)))
+        finally:
+            self.bytes_transferred = throttled.bytes
+
+    def backup(self, backup, volume_file):
+        return self._run(self._driver.backup, (backup,), volume_file)
+
+    def restore(self, backup, volume_id, volume_file):
+        return self._run(self._driver.restore, (backup, volume_id),
+                         volume_file)
+
+    def restore_range(self, backup, volume_id, volume_file, offset, length):
+        def restore(volume_file):
+            return self._driver.restore_range(backup, volume_id, volume_file,
+                                              offset, length)
+
+        return self._run(restore, (), volume_file)
+
+    def __getattr__(self, attr):
+        return getattr(self._driver, attr)
@@ -30,17 +30,28 @@ Volume backups can be created, restored, deleted and listed.
 :backup_manager:  The module name of a class derived from
                           :class:`manager.Manager` (default:
                           :class:`cinder.backup.manager.Manager`).
+:backup_max_concurrent_jobs: The maximum number of backups and restores
+                             run at once, 0 for no limit (default: 0).
+:backup_bandwidth_limit: The maximum number of bytes per second moved by
+                         all running backups and restores together, 0 for
+                         no limit (default: 0).
 
 """
 
+import time
+
 from oslo.config import cfg
 
+from cinder.backup import jobs
 from cinder import context
 from cinder import exception
 from cinder import manager
 from cinder.openstack.common import excutils
 from cinder.openstack.common import importutils
 from cinder.openstack.common import log as logging
+from cinder.openstack.common import periodic_task
+from cinder import units
+from cinder import utils
 
 
 LOG = logging.getLogger(__name__)
@@ -50,6 +61,21 @@ backup_manager_opts = [
                default='cinder.backup.drivers.swift',
                help='Driver to use for backups.',
                deprecated_name='backup_service'),
+    cfg.IntOpt('backup_max_concurrent_jobs',
+               default=0,
+               help='The maximum number of backups and restores this '
+                    'service runs at once. Further jobs are queued, with '
+                    'restores started before backups. 0 means no limit'),
+    cfg.IntOpt('backup_bandwidth_limit',
+               default=0,
+               help='The maximum number of bytes per second read from or '
+                    'written to volumes by all running backups and '
+                    'restores together. 0 means no limit'),
+    cfg.IntOpt('backup_bandwidth_burst',
+               default=0,
+               help='The number of bytes that may be moved in a burst above '
+                    'backup_bandwidth_limit. 0 means one second worth of '
+                    'the limit'),
 ]
 
 # This map doesn't need to be extended in the future since it's only
@@ -61,10 +87,26 @@ CONF = cfg.CONF
 CONF.register_opts(backup_manager_opts)
 
 
+class _RangeRestore(object):
+    """Turns the restore of a backup driver into a restore of a range."""
+
+    def __init__(self, backup_driver, offset, length):
+        self._driver = backup_driver
+        self._offset = offset
+        self._length = length
+
+    def restore(self, backup, volume_id, volume_file):
+        return self._driver.restore_range(backup, volume_id, volume_file,
+                                          self._offset, self._length)
+
+    def __getattr__(self, attr):
+        return getattr(self._driver, attr)
+
+
 class BackupManager(manager.SchedulerDependentManager):
     """Manages backup of block storage devices."""
 
-    RPC_API_VERSION = '1.0'
+    RPC_API_VERSION = '1.2'
 
     def __init__(self, service_name=None, *args, **kwargs):
         self.service = importutils.import_module(self.driver_name)
@@ -72,6 +114,11 @@ class BackupManager(manager.SchedulerDependentManager):
         self.volume_manager = importutils.import_object(
             CONF.volume_manager)
         self.driver = self.volume_manager.driver
+        self.jobs = jobs.JobQueue(CONF.backup_max_concurrent_jobs)
+        self.bandwidth = None
+        if CONF.backup_bandwidth_limit > 0:
+            self.bandwidth = utils.TokenBucket(CONF.backup_bandwidth_limit,
+                                               CONF.backup_bandwidth_burst)
         super(BackupManager, self).__init__(service_name='backup',
                                             *args, **kwargs)
         self.driver.db = self.db
@@ -89,6 +136,35 @@ class BackupManager(manager.SchedulerDependentManager):
             return mapper[service]
         return service
 
+    def _run_job(self, context, description, priority, func, *args):
+        """Run func as a job, passing a throttled backup driver last.
+
+        The job waits for a slot in the job queue first and logs the
+        throughput it achieved once it is done. Returns the result of func.
+        """
+        with self.jobs.job(description, priority):
+            backup_service = jobs.ThrottledBackupDriver(
+                self.service.get_backup_driver(context), self.bandwidth)
+            start = time.time()
+            result = func(*(args + (backup_service,)))
+            elapsed = max(time.time() - start, 0.001)
+            transferred = backup_service.bytes_transferred
+            LOG.info(_('%(job)s moved %(bytes)d bytes in %(elapsed).1f '
+                       'seconds (%(rate).1f MB/s)') %
+                     {'job': description, 'bytes': transferred,
+                      'elapsed': elapsed,
+                      'rate': transferred / elapsed / units.MiB})
+            return result
+
+    @periodic_task.periodic_task
+    def _report_job_queue(self, context):
+        """Log the number of running and queued backup jobs."""
+        if self.jobs.running or self.jobs.depth:
+            LOG.info(_('backup jobs running: %(running)d, queued: '
+                       '%(depth)d') %
+                     {'running': self.jobs.running,
+                      'depth': self.jobs.depth})
+
     def init_host(self):
         """Do any initialization that needs to be run if this is a
            standalone service.
@@ -127,6 +203,11 @@ class BackupManager(manager.SchedulerDependentManager):
                            '(was restoring)') % backup['id'])
                 self.db.backup_update(ctxt, backup['id'],
                                       {'status': 'available'})
+            if backup['status'] == 'verifying':
+                LOG.info(_('Resetting backup %s to available '
+                           '(was verifying)') % backup['id'])
+                self.db.backup_update(ctxt, backup['id'],
+                                      {'status': 'available'})
             if backup['status'] == 'deleting':
                 LOG.info(_('Resuming delete on backup: %s') % backup['id'])
                 self.delete_backup(ctxt, backup['id'])
@@ -170,9 +251,28 @@ class BackupManager(manager.SchedulerDependentManager):
                                                        'fail_reason': err})
             raise exception.InvalidBackup(reason=err)
 
+        if backup['parent_id'] is not None:
+            parent = self.db.backup_get(context, backup['parent_id'])
+            parent_service = self._map_service_to_driver(parent['service'])
+            if parent_service != self.driver_name:
+                err = _('create_backup aborted, the parent backup '
+                        '%(parent_id)s was made by %(parent_service)s, '
+                        'not %(configured_service)s') % {
+                            'parent_id': parent['id'],
+                            'parent_service': parent_service,
+                            'configured_service': self.driver_name,
+                        }
+                self.db.volume_update(context, volume_id,
+                                      {'status': 'available'})
+                self.db.backup_update(context, backup_id,
+                                      {'status': 'error',
+                                       'fail_reason': err})
+                raise exception.InvalidBackup(reason=err)
+
         try:
-            backup_service = self.service.get_backup_driver(context)
-            self.driver.backup_volume(context, backup, backup_service)
+            self._run_job(context, _('backup %s') % backup_id,
+                          jobs.PRIORITY_BACKUP, self.driver.backup_volume,
+                          context, backup)
         except Exception as err:
             with excutils.save_and_reraise_exception():
                 self.db.volume_update(context, volume_id,
@@ -188,13 +288,25 @@ class BackupManager(manager.SchedulerDependentManager):
                                                    self.az})
         LOG.info(_('create_backup finished. backup: %s'), backup_id)
 
-    def restore_backup(self, context, backup_id, volume_id):
+    def _restore_backup_range(self, context, backup, volume, offset, length,
+                              backup_service):
+        self.driver.restore_backup(context, backup, volume,
+                                   _RangeRestore(backup_service, offset,
+                                                 length))
+
+    def restore_backup(self, context, backup_id, volume_id, offset=None,
+                       length=None):
         """
         Restore volume backups from configured backup service.
+
+        If offset is given, only the length bytes of the backup starting at
+        offset are restored to the same offset of the volume.
         """
         LOG.info(_('restore_backup started, restoring backup: %(backup_id)s'
-                   ' to volume: %(volume_id)s') %
-                 {'backup_id': backup_id, 'volume_id': volume_id})
+                   ' to volume: %(volume_id)s, offset: %(offset)s, length: '
+                   '%(length)s') %
+                 {'backup_id': backup_id, 'volume_id': volume_id,
+                  'offset': offset, 'length': length})
         backup = self.db.backup_get(context, backup_id)
         volume = self.db.volume_get(context, volume_id)
         self.db.backup_update(context, backup_id, {'host': self.host})
@@ -244,10 +356,31 @@ class BackupManager(manager.SchedulerDependentManager):
             raise exception.InvalidBackup(reason=err)
 
         try:
-            backup_service = self.service.get_backup_driver(context)
-            self.driver.restore_backup(context, backup, volume,
-                                       backup_service)
+            if offset is None:
+                self._run_job(context, _('restore of backup %s') % backup_id,
+                              jobs.PRIORITY_RESTORE,
+                              self.driver.restore_backup,
+                              context, backup, volume)
+            else:
+                self._run_job(context,
+                              _('restore of %(length)d bytes at %(offset)d of '
+                                'backup %(backup_id)s') %
+                              {'length': length, 'offset': offset,
+                               'backup_id': backup_id},
+                              jobs.PRIORITY_RESTORE,
+                              self._restore_backup_range,
+                              context, backup, volume, offset, length)
         except Exception as err:
+            if offset is not None and isinstance(err, NotImplementedError):
+                # Nothing was written to the volume
+                err = _('restore_backup aborted, the backup service currently'
+                        ' configured [%s] does not support restoring part of'
+                        ' a backup') % self.driver_name
+                self.db.volume_update(context, volume_id,
+                                      {'status': 'available'})
+                self.db.backup_update(context, backup_id,
+                                      {'status': 'available'})
+                raise exception.InvalidBackup(reason=err)
             with excutils.save_and_reraise_exception():
                 self.db.volume_update(context, volume_id,
                                       {'status': 'error_restoring'})
@@ -260,6 +393,85 @@ class BackupManager(manager.SchedulerDependentManager):
                    ' to volume: %(volume_id)s') %
                  {'backup_id': backup_id, 'volume_id': volume_id})
 
+    def _verify_backup(self, backup, decompress, backup_service):
+        return backup_service.verify(backup, decompress)
+
+    def verify_backup(self, context, backup_id, decompress=False):
+        """
+        Check the stored data of a backup without restoring it.
+
+        A backup found to have missing or corrupt objects is put in the
+        error state, with the problems summarised in its fail_reason.
+        """
+        LOG.info(_('verify_backup started, backup: %s'), backup_id)
+        backup = self.db.backup_get(context, backup_id)
+        self.db.backup_update(context, backup_id, {'host': self.host})
+
+        expected_status = 'verifying'
+        actual_status = backup['status']
+        if actual_status != expected_status:
+            err = _('verify_backup aborted, expected backup status '
+                    '%(expected_status)s but got %(actual_status)s') % {
+                        'expected_status': expected_status,
+                        'actual_status': actual_status,
+                    }
+            self.db.backup_update(context, backup_id, {'status': 'error',
+                                                       'fail_reason': err})
+            raise exception.InvalidBackup(reason=err)
+
+        backup_service = self._map_service_to_driver(backup['service'])
+        configured_service = self.driver_name
+        if backup_service != configured_service:
+            err = _('verify_backup aborted, the backup service currently'
+                    ' configured [%(configured_service)s] is not the'
+                    ' backup service that was used to create this'
+                    ' backup [%(backup_service)s]') % {
+                        'configured_service': configured_service,
+                        'backup_service': backup_service,
+                    }
+            self.db.backup_update(context, backup_id, {'status': 'available'})
+            raise exception.InvalidBackup(reason=err)
+
+        try:
+            result = self._run_job(context, _('verify of backup %s') %
+                                   backup_id, jobs.PRIORITY_VERIFY,
+                                   self._verify_backup, backup, decompress)
+        except NotImplementedError:
+            err = _('verify_backup aborted, the backup service currently'
+                    ' configured [%s] does not support verifying backups'
+                    ) % self.driver_name
+            self.db.backup_update(context, backup_id, {'status': 'available'})
+            raise exception.InvalidBackup(reason=err)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self.db.backup_update(context, backup_id,
+                                      {'status': 'available'})
+
+        missing = result['missing']
+        corrupt = result['corrupt']
+        if missing or corrupt:
+            for object_name in missing:
+                LOG.error(_('backup %(backup_id)s object %(object_name)s is '
+                            'missing') %
+                          {'backup_id': backup_id, 'object_name': object_name})
+            for object_name, reason in corrupt.items():
+                LOG.error(_('backup %(backup_id)s object %(object_name)s is '
+                            'corrupt: %(reason)s') %
+                          {'backup_id': backup_id, 'object_name': object_name,
+                           'reason': reason})
+            err = _('verify found %(missing)d missing and %(corrupt)d '
+                    'corrupt objects') % {'missing': len(missing),
+                                          'corrupt': len(corrupt)}
+            self.db.backup_update(context, backup_id, {'status': 'error',
+                                                       'fail_reason': err})
+            LOG.info(_('verify_backup finished, backup %(backup_id)s is '
+                       'damaged: %(err)s') %
+                     {'backup_id': backup_id, 'err': err})
+            return
+
+        self.db.backup_update(context, backup_id, {'status': 'available'})
+        LOG.info(_('verify_backup finished, backup %s is intact'), backup_id)
+
     def delete_backup(self, context, backup_id):
         """
         Delete volume backup from configured backup service.
@@ -38,6 +38,8 @@ class BackupAPI(cinder.openstack.common.rpc.proxy.RpcProxy):
     API version history:
 
         1.0 - Initial version.
+        1.1 - Adds offset and length to restore_backup.
+        1.2 - Adds verify_backup.
     '''
 
     BASE_RPC_API_VERSION = '1.0'
@@ -56,15 +58,36 @@ class BackupAPI(cinder.openstack.common.rpc.proxy.RpcProxy):
                                 backup_id=backup_id),
                   topic=topic)
 
-    def restore_backup(self, ctxt, host, backup_id, volume_id):
+    def restore_backup(self, ctxt, host, backup_id, volume_id, offset=None,
+                       length=None):
         LOG.debug("restore_backup in rpcapi backup_id %s", backup_id)
         topic = rpc.queue_get_for(ctxt, self.topic, host)
         LOG.debug("restore queue topic=%s", topic)
+        if offset is None:
+            self.cast(ctxt,
+                      self.make_msg('restore_backup',
+                                    backup_id=backup_id,
+                                    volume_id=volume_id),
+                      topic=topic)
+        else:
+            self.cast(ctxt,
+                      self.make_msg('restore_backup',
+                                    backup_id=backup_id,
+                                    volume_id=volume_id,
+                                    offset=offset,
+                                    length=length),
+                      topic=topic,
+                      version='1.1')
+
+    def verify_backup(self, ctxt, host, backup_id, decompress):
+        LOG.debug("verify_backup in rpcapi backup_id %s", backup_id)
+        topic = rpc.queue_get_for(ctxt, self.topic, host)
         self.cast(ctxt,
-                  self.make_msg('restore_backup',
+                  self.make_msg('verify_backup',
                                 backup_id=backup_id,
-                                volume_id=volume_id),
-                  topic=topic)
+                                decompress=decompress),
+                  topic=topic,
+                  version='1.2')
 
     def delete_backup(self, ctxt, host, backup_id):
         LOG.debug("delete_backup  rpcapi backup_id %s", backup_id)
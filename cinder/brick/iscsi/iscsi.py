@@ -118,25 +118,38 @@ class TgtAdm(TargetAdmin):
 
     def __init__(self, execute=utils.execute):
         super(TgtAdm, self).__init__('tgtadm', execute)
+        # tid of every target, keyed by name, None until tgtd is queried
+        self._targets = None
 
-    def _get_target(self, iqn):
-        (out, err) = self._execute('tgt-admin', '--show', run_as_root=True)
-        lines = out.split('\n')
-        for line in lines:
-            if iqn in line:
-                parsed = line.split()
-                tid = parsed[1]
-                return tid[:-1]
+    def _get_targets(self):
+        """Returns a dict of the tid of every target, keyed by name.
 
-        return None
+        tgtd is only queried when the targets are not known yet. The
+        dict is then kept current as targets are created and removed.
+        """
+        if self._targets is None:
+            (out, err) = self._execute('tgt-admin', '--show',
+                                       run_as_root=True)
+            targets = {}
+            for line in out.split('\n'):
+                # Target 1: iqn.2010-10.org.openstack:volume-...
+                if line.startswith('Target '):
+                    tid, iqn = line.split()[1:3]
+                    targets[iqn] = tid[:-1]
+            self._targets = targets
+        return self._targets
 
-    def create_iscsi_target(self, name, tid, lun, path,
-                            chap_auth=None, **kwargs):
-        # Note(jdg) tid and lun aren't used by TgtAdm but remain for
-        # compatibility
+    def _get_target(self, iqn):
+        if self._targets is not None and iqn not in self._targets:
+            # The target may have been created since tgtd was queried
+            self._targets = None
+        return self._get_targets().get(iqn)
 
-        fileutils.ensure_tree(CONF.volumes_dir)
+    def _write_target_conf(self, name, path, chap_auth=None):
+        """Writes the persistent configuration of a target.
 
+        :returns: the path of the configuration file
+        """
         vol_id = name.split(':')[1]
         if chap_auth is None:
             volume_conf = """
@@ -152,13 +165,23 @@ class TgtAdm(TargetAdmin):
                 </target>
             """ % (name, path, chap_auth)
 
-        LOG.info(_('Creating iscsi_target for: %s') % vol_id)
-        volumes_dir = CONF.volumes_dir
-        volume_path = os.path.join(volumes_dir, vol_id)
-
+        volume_path = os.path.join(CONF.volumes_dir, vol_id)
         f = open(volume_path, 'w+')
         f.write(volume_conf)
         f.close()
+        return volume_path
+
+    def create_iscsi_target(self, name, tid, lun, path,
+                            chap_auth=None, **kwargs):
+        # Note(jdg) tid and lun aren't used by TgtAdm but remain for
+        # compatibility
+
+        fileutils.ensure_tree(CONF.volumes_dir)
+
+        vol_id = name.split(':')[1]
+        LOG.info(_('Creating iscsi_target for: %s') % vol_id)
+        volumes_dir = CONF.volumes_dir
+        volume_path = self._write_target_conf(name, path, chap_auth)
 
         old_persist_file = None
         old_name = kwargs.get('old_name', None)
@@ -180,6 +203,8 @@ class TgtAdm(TargetAdmin):
             raise exception.ISCSITargetCreateFailed(volume_id=vol_id)
 
         iqn = '%s%s' % (CONF.iscsi_target_prefix, vol_id)
+        # The update may have given the target a new tid
+        self._targets = None
         tid = self._get_target(iqn)
         if tid is None:
             LOG.error(_("Failed to create iscsi target for volume "
@@ -195,6 +220,57 @@ class TgtAdm(TargetAdmin):
 
         return tid
 
+    def create_iscsi_targets(self, targets):
+        """Create several iSCSI targets with a single update of tgtd.
+
+        The configuration files of all the targets are written first, then
+        tgtd is updated from them at once. If the bulk update fails each
+        target is created on its own instead.
+
+        :param targets: list of (name, path, chap_auth, old_name) tuples
+        :returns: dict of the tid of each target, keyed by name
+        """
+        if not targets:
+            return {}
+        fileutils.ensure_tree(CONF.volumes_dir)
+        for name, path, chap_auth, old_name in targets:
+            self._write_target_conf(name, path, chap_auth)
+
+        LOG.info(_('Creating %d iscsi targets'), len(targets))
+        try:
+            self._execute('tgt-admin', '--update', 'ALL', run_as_root=True)
+        except exception.ProcessExecutionError as e:
+            LOG.warn(_("Failed to update all iscsi targets, creating them "
+                       "one at a time: %s") % e)
+            return dict((name, self.create_iscsi_target(name, 1, 0, path,
+                                                        chap_auth,
+                                                        old_name=old_name))
+                        for name, path, chap_auth, old_name in targets)
+
+        self._targets = None
+        existing = self._get_targets()
+        tids = {}
+        missing = []
+        for name, path, chap_auth, old_name in targets:
+            if name not in existing:
+                missing.append(name.split(':')[1])
+                continue
+            tids[name] = existing[name]
+            if old_name is not None:
+                old_persist_file = os.path.join(CONF.volumes_dir, old_name)
+                if os.path.exists(old_persist_file):
+                    os.unlink(old_persist_file)
+
+        if missing:
+            LOG.error(_("Failed to create iscsi targets for volumes "
+                        "%(vol_ids)s. Please ensure your tgtd config file "
+                        "contains 'include %(volumes_dir)s/*'") % {
+                            'vol_ids': ', '.join(missing),
+                            'volumes_dir': CONF.volumes_dir,
+                        })
+            raise exception.NotFound()
+        return tids
+
     def remove_iscsi_target(self, tid, lun, vol_id, **kwargs):
         LOG.info(_('Removing iscsi_target for: %s') % vol_id)
         vol_uuid_file = CONF.volume_name_template % vol_id
@@ -213,11 +289,18 @@ class TgtAdm(TargetAdmin):
                           iqn,
                           run_as_root=True)
         except exception.ProcessExecutionError as e:
-            LOG.error(_("Failed to remove iscsi target for volume "
-                        "id:%(vol_id)s: %(e)s")
-                      % {'vol_id': vol_id, 'e': str(e)})
-            raise exception.ISCSITargetRemoveFailed(volume_id=vol_id)
+            # The known targets may be out of date, e.g. if tgtd restarted
+            self._targets = None
+            if self._get_target(iqn) is not None:
+                LOG.error(_("Failed to remove iscsi target for volume "
+                            "id:%(vol_id)s: %(e)s")
+                          % {'vol_id': vol_id, 'e': str(e)})
+                raise exception.ISCSITargetRemoveFailed(volume_id=vol_id)
+            LOG.info(_("iscsi target for volume id:%s was already "
+                       "removed") % vol_id)
 
+        if self._targets is not None:
+            self._targets.pop(iqn, None)
         os.unlink(volume_path)
 
     def show_target(self, tid, iqn=None, **kwargs):
@@ -356,6 +439,10 @@ class FakeIscsiHelper(object):
 
 class LioAdm(TargetAdmin):
     """iSCSI target administration for LIO using python-rtslib."""
+
+    # Lines of the last target listing, None until rtstool is queried
+    _targets = None
+
     def __init__(self, execute=utils.execute):
         super(LioAdm, self).__init__('rtstool', execute)
 
@@ -365,21 +452,31 @@ class LioAdm(TargetAdmin):
             LOG.error(_('rtstool is not installed correctly'))
             raise
 
+    def _get_targets(self):
+        """Returns the target listing of rtstool.
+
+        rtstool is only queried when the targets are not known yet. The
+        listing is then kept current as targets are created and removed.
+        """
+        if self._targets is None:
+            (out, err) = self._execute('rtstool',
+                                       'get-targets',
+                                       run_as_root=True)
+            self._targets = out.split('\n')
+        return self._targets
+
     def _get_target(self, iqn):
-        (out, err) = self._execute('rtstool',
-                                   'get-targets',
-                                   run_as_root=True)
-        lines = out.split('\n')
-        for line in lines:
+        known = self._targets is not None
+        for line in self._get_targets():
             if iqn in line:
                 return line
-
+        if known:
+            # The target may have been created since the last listing
+            self._targets = None
+            return self._get_target(iqn)
         return None
 
-    def create_iscsi_target(self, name, tid, lun, path,
-                            chap_auth=None, **kwargs):
-        # tid and lun are not used
-
+    def _create_target(self, name, path, chap_auth=None):
         vol_id = name.split(':')[1]
 
         LOG.info(_('Creating iscsi_target for volume: %s') % vol_id)
@@ -412,6 +509,16 @@ class LioAdm(TargetAdmin):
 
                 raise exception.ISCSITargetCreateFailed(volume_id=vol_id)
 
+        if self._targets is not None and not any(name in line
+                                                 for line in self._targets):
+            self._targets.append(name)
+
+    def create_iscsi_target(self, name, tid, lun, path,
+                            chap_auth=None, **kwargs):
+        # tid and lun are not used
+        self._create_target(name, path, chap_auth)
+
+        vol_id = name.split(':')[1]
         iqn = '%s%s' % (CONF.iscsi_target_prefix, vol_id)
         tid = self._get_target(iqn)
         if tid is None:
@@ -421,6 +528,29 @@ class LioAdm(TargetAdmin):
 
         return tid
 
+    def create_iscsi_targets(self, targets):
+        """Create several iSCSI targets, listing the targets only once.
+
+        :param targets: list of (name, path, chap_auth, old_name) tuples,
+                        old_name is not used
+        :returns: dict of the tid of each target, keyed by name
+        """
+        if not targets:
+            return {}
+        for name, path, chap_auth, old_name in targets:
+            self._create_target(name, path, chap_auth)
+
+        self._targets = None
+        tids = {}
+        for name, path, chap_auth, old_name in targets:
+            tid = self._get_target(name)
+            if tid is None:
+                LOG.error(_("Failed to create iscsi target for volume "
+                            "id:%s.") % name.split(':')[1])
+                raise exception.NotFound()
+            tids[name] = tid
+        return tids
+
     def remove_iscsi_target(self, tid, lun, vol_id, **kwargs):
         LOG.info(_('Removing iscsi_target: %s') % vol_id)
         vol_uuid_name = 'volume-%s' % vol_id
@@ -437,6 +567,10 @@ class LioAdm(TargetAdmin):
             LOG.error("%s" % str(e))
             raise exception.ISCSITargetRemoveFailed(volume_id=vol_id)
 
+        if self._targets is not None:
+            self._targets = [line for line in self._targets
+                             if iqn not in line]
+
     def show_target(self, tid, iqn=None, **kwargs):
         if iqn is None:
             raise exception.InvalidParameterValue(
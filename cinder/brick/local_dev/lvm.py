@@ -19,6 +19,7 @@
 LVM class for performing LVM operations.
 """
 
+import collections
 import math
 import re
 
@@ -27,9 +28,13 @@ from itertools import izip
 from cinder.openstack.common.gettextutils import _
 from cinder.openstack.common import log as logging
 from cinder.openstack.common import processutils as putils
+from cinder.openstack.common import timeutils
 
 LOG = logging.getLogger(__name__)
 
+# Seconds an LVMInventory is trusted before the VG is listed again
+DEFAULT_INVENTORY_TTL = 60
+
 
 class VolumeGroupNotFound(Exception):
     def __init__(self, vg_name):
@@ -43,6 +48,214 @@ class VolumeGroupCreationFailed(Exception):
         super(VolumeGroupCreationFailed, self).__init__(message)
 
 
+def _size_to_gb(size_str):
+    """Convert an LVM size string such as '1.00g' or '100M' to GB."""
+    size_str = size_str.strip().lower().replace(',', '.')
+    factor = 1.0
+    if size_str[-1:] in ('m', 'g', 't'):
+        factor = {'m': 1.0 / 1024, 'g': 1.0, 't': 1024.0}[size_str[-1]]
+        size_str = size_str[:-1]
+    return float(size_str) * factor
+
+
+class LVMInventory(object):
+    """Cached view of the LVs and the capacity of a Volume Group.
+
+    Every LV of the VG is loaded with a single lvs call, and the VG size
+    and free space with a single vgs call.  Changes made through the
+    add/remove/rename methods are applied in place, and the whole VG is
+    listed again once the inventory is older than ttl seconds, so that
+    changes made outside Cinder are eventually seen.  Changes that cannot
+    be modelled cheaply simply invalidate the inventory.
+    """
+
+    def __init__(self, vg_name, executor=putils.execute, root_helper='sudo',
+                 ttl=DEFAULT_INVENTORY_TTL):
+        """Initialize the inventory.
+
+        :param vg_name: Name of the VG to track
+        :param executor: Function used to run the LVM commands
+        :param root_helper: root_helper passed to the executor, None lets
+                            the executor pick its own
+        :param ttl: Seconds the inventory is trusted, 0 lists the VG on
+                    every query
+        """
+        self.vg_name = vg_name
+        self.ttl = ttl
+        self._execute = executor
+        self._root_helper = root_helper
+        self._volumes = collections.OrderedDict()
+        self._vg_size = 0.0
+        self._vg_free = 0.0
+        self._loaded_at = None
+        # Bumped by every in place update, a listing that raced with one
+        # is not trusted.
+        self._generation = 0
+
+    def _run(self, *cmd):
+        kwargs = {'run_as_root': True}
+        if self._root_helper is not None:
+            kwargs['root_helper'] = self._root_helper
+        (out, err) = self._execute(*cmd, **kwargs)
+        return out or ''
+
+    def _changed(self):
+        self._generation += 1
+
+    def invalidate(self):
+        """Force the VG to be listed again on the next query."""
+        self._loaded_at = None
+        self._changed()
+
+    def refresh(self):
+        """List all LVs and the VG capacity."""
+        generation = self._generation
+        lv_out = self._run('lvs', '--noheadings', '--unit=g',
+                           '-o', 'vg_name,name,size,attr,origin',
+                           self.vg_name)
+        vg_out = self._run('vgs', '--noheadings', '--unit=g',
+                           '-o', 'name,size,free', self.vg_name)
+
+        volumes = collections.OrderedDict()
+        for line in lv_out.splitlines():
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            volumes[fields[1]] = {'vg': fields[0],
+                                  'name': fields[1],
+                                  'size': fields[2],
+                                  'attr': fields[3] if len(fields) > 3
+                                  else '',
+                                  'origin': fields[4] if len(fields) > 4
+                                  else ''}
+        vg_fields = vg_out.split()
+        if len(vg_fields) >= 3:
+            vg_size = _size_to_gb(vg_fields[1])
+            vg_free = _size_to_gb(vg_fields[2])
+        else:
+            vg_size = vg_free = 0.0
+
+        self._volumes = volumes
+        self._vg_size = vg_size
+        self._vg_free = vg_free
+        if generation == self._generation:
+            self._loaded_at = timeutils.utcnow()
+        else:
+            self._loaded_at = None
+
+    def _load(self):
+        if (self._loaded_at is None or not self.ttl or
+                timeutils.is_older_than(self._loaded_at, self.ttl)):
+            self.refresh()
+
+    def get_volumes(self):
+        """Return a list of Dictionaries with the info of every LV."""
+        self._load()
+        return [dict(lv) for lv in self._volumes.values()]
+
+    def get_volume(self, name):
+        """Return a Dictionary with the info of an LV, or None."""
+        self._load()
+        lv = self._volumes.get(name)
+        if lv is not None:
+            return dict(lv)
+
+    def volume_exists(self, name):
+        self._load()
+        return name in self._volumes
+
+    def lv_has_snapshot(self, name):
+        """Return whether an LV is the origin of a (thick) snapshot."""
+        self._load()
+        lv = self._volumes.get(name)
+        return lv is not None and lv['attr'][:1] in ('o', 'O')
+
+    def get_capacity(self):
+        """Return the size and free space of the VG in GB."""
+        self._load()
+        return self._vg_size, self._vg_free
+
+    def add_volume(self, name, size_str, thin=False, origin=None):
+        """Record an LV just created.
+
+        :param name: Name of the new LV
+        :param size_str: Size of the LV, as given to lvcreate
+        :param thin: Whether the LV is allocated from a thin pool
+        :param origin: Name of the LV the new one is a snapshot of
+        """
+        self._changed()
+        if self._loaded_at is None:
+            return
+        size = _size_to_gb(size_str)
+        if thin:
+            attr = 'Vwi-a-tz--'
+        elif origin:
+            attr = 'swi-a-s---'
+            source = self._volumes.get(origin)
+            if source is not None:
+                source['attr'] = 'o' + source['attr'][1:]
+        else:
+            attr = '-wi-a-----'
+        if not thin:
+            self._vg_free -= size
+        self._volumes[name] = {'vg': self.vg_name,
+                               'name': name,
+                               'size': '%.2fg' % size,
+                               'attr': attr,
+                               'origin': origin or ''}
+
+    def add_snapshot(self, name, origin, size_str=None, thin=False):
+        """Record a snapshot just created.
+
+        By default the snapshot is as big as its origin.
+        """
+        if size_str is None:
+            source = self._volumes.get(origin)
+            if source is None:
+                self.invalidate()
+                return
+            size_str = source['size']
+        self.add_volume(name, size_str, thin=thin, origin=origin)
+
+    def remove_volume(self, name):
+        """Record an LV just removed."""
+        self._changed()
+        if self._loaded_at is None:
+            return
+        lv = self._volumes.pop(name, None)
+        if lv is None:
+            return
+        kind = lv['attr'][:1]
+        if kind in ('m', 'M', 'o', 'O'):
+            # Removing a mirror or an origin frees space that is not
+            # tracked here, removing an origin drops its snapshots too.
+            self.invalidate()
+            return
+        if kind != 'V':
+            self._vg_free += _size_to_gb(lv['size'])
+        if kind in ('s', 'S'):
+            source = self._volumes.get(lv['origin'])
+            if source is not None and not any(
+                    other['origin'] == lv['origin'] and
+                    other['attr'][:1] in ('s', 'S')
+                    for other in self._volumes.values()):
+                source['attr'] = '-' + source['attr'][1:]
+
+    def rename_volume(self, name, new_name):
+        """Record an LV just renamed."""
+        self._changed()
+        if self._loaded_at is None:
+            return
+        lv = self._volumes.pop(name, None)
+        if lv is None:
+            return
+        lv['name'] = new_name
+        self._volumes[new_name] = lv
+        for other in self._volumes.values():
+            if other['origin'] == name:
+                other['origin'] = new_name
+
+
 class LVM(object):
     """LVM object to enable various LVM related operations."""
 
@@ -51,7 +264,8 @@ class LVM(object):
                  create_vg=False,
                  physical_volumes=None,
                  lvm_type='default',
-                 executor=putils.execute):
+                 executor=putils.execute,
+                 inventory=None):
         """Initialize the LVM object.
 
         The LVM object is based on an LVM VolumeGroup, one instantiation
@@ -61,6 +275,8 @@ class LVM(object):
         :param create_vg: Indicates the VG doesn't exist
                           and we want to create it
         :param physical_volumes: List of PVs to build VG on
+        :param inventory: LVMInventory of the VG to share, by default
+                          the object keeps its own
 
         """
         self.vg_name = vg_name
@@ -72,6 +288,9 @@ class LVM(object):
         self.vg_uuid = None
         self._execute = executor
         self.vg_thin_pool = None
+        if inventory is None:
+            inventory = LVMInventory(vg_name, executor=executor)
+        self.inventory = inventory
 
         if create_vg and physical_volumes is not None:
             self.pv_list = physical_volumes
@@ -184,7 +403,7 @@ class LVM(object):
         :returns: List of Dictionaries with LV info
 
         """
-        self.lv_list = self.get_all_volumes(self.vg_name)
+        self.lv_list = self.inventory.get_volumes()
         return self.lv_list
 
     def get_volume(self, name):
@@ -193,10 +412,7 @@ class LVM(object):
         :returns: dict representation of Logical Volume if exists
 
         """
-        ref_list = self.get_volumes()
-        for r in ref_list:
-            if r['name'] == name:
-                return r
+        return self.inventory.get_volume(name)
 
     @staticmethod
     def get_all_physical_volumes(vg_name=None):
@@ -325,6 +541,7 @@ class LVM(object):
                        root_helper='sudo',
                        run_as_root=True)
         self.vg_thin_pool = pool_path
+        self.inventory.invalidate()
 
     def create_volume(self, name, size_str, lv_type='default', mirror_count=0):
         """Creates a logical volume on the object's VG.
@@ -356,6 +573,11 @@ class LVM(object):
         self._execute(*cmd,
                       root_helper='sudo',
                       run_as_root=True)
+        if mirror_count > 0:
+            self.inventory.invalidate()
+        else:
+            self.inventory.add_volume(name, size_str,
+                                      thin=(lv_type == 'thin'))
 
     def create_lv_snapshot(self, name, source_lv_name, lv_type='default'):
         """Creates a snapshot of a logical volume.
@@ -378,6 +600,9 @@ class LVM(object):
         self._execute(*cmd,
                       root_helper='sudo',
                       run_as_root=True)
+        self.inventory.add_snapshot(name, source_lv_name,
+                                    size_str=source_lvref['size'],
+                                    thin=(lv_type == 'thin'))
 
     def delete(self, name):
         """Delete logical volume or snapshot.
@@ -389,6 +614,7 @@ class LVM(object):
                       '-f',
                       '%s/%s' % (self.vg_name, name),
                       root_helper='sudo', run_as_root=True)
+        self.inventory.remove_volume(name)
 
     def revert(self, snapshot_name):
         """Revert an LV from snapshot.
@@ -399,13 +625,7 @@ class LVM(object):
         self._execute('lvconvert', '--merge',
                       snapshot_name, root_helper='sudo',
                       run_as_root=True)
+        self.inventory.invalidate()
 
     def lv_has_snapshot(self, name):
-        out, err = self._execute('lvdisplay', '--noheading',
-                                 '-C', '-o', 'Attr',
-                                 '%s/%s' % (self.vg_name, name))
-        if out:
-            out = out.strip()
-            if (out[0] == 'o') or (out[0] == 'O'):
-                return True
-        return False
+        return self.inventory.lv_has_snapshot(name)
@@ -172,6 +172,11 @@ global_opts = [
                default=None,
                help='Path to the rootwrap configuration file to use for '
                     'running commands as root'),
+    cfg.BoolOpt('use_rootwrap_daemon',
+                default=False,
+                help='Run commands as root through a cinder-rootwrap-daemon '
+                     'started once by the service instead of starting '
+                     'cinder-rootwrap for every command'),
     cfg.BoolOpt('monkey_patch',
                 default=False,
                 help='Whether to log monkey patching'),
@@ -744,6 +744,11 @@ def backup_get_all_by_host(context, host):
     return IMPL.backup_get_all_by_host(context, host)
 
 
+def backup_get_all_by_volume(context, volume_id):
+    """Get all backups of a volume."""
+    return IMPL.backup_get_all_by_volume(context, volume_id)
+
+
 def backup_create(context, values):
     """Create a backup from the values dictionary."""
     return IMPL.backup_create(context, values)
@@ -799,3 +804,35 @@ def transfer_destroy(context, transfer_id):
 def transfer_accept(context, transfer_id, user_id, project_id):
     """Accept a volume transfer."""
     return IMPL.transfer_accept(context, transfer_id, user_id, project_id)
+
+
+###################
+
+
+def image_volume_cache_create(context, values):
+    """Create an entry in the image volume cache table."""
+    return IMPL.image_volume_cache_create(context, values)
+
+
+def image_volume_cache_get_by_image(context, host, image_id):
+    """Get the cache entry for an image on a host, or None."""
+    return IMPL.image_volume_cache_get_by_image(context, host, image_id)
+
+
+def image_volume_cache_get_all_for_host(context, host):
+    """Get all cache entries on a host, least recently used first."""
+    return IMPL.image_volume_cache_get_all_for_host(context, host)
+
+
+def image_volume_cache_update(context, entry_id, values):
+    """
+    Set the given properties on a cache entry and update it.
+
+    Raises NotFound if the cache entry does not exist.
+    """
+    return IMPL.image_volume_cache_update(context, entry_id, values)
+
+
+def image_volume_cache_destroy(context, entry_id):
+    """Destroy a record in the image volume cache table."""
+    return IMPL.image_volume_cache_destroy(context, entry_id)
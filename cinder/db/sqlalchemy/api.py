@@ -2113,6 +2113,13 @@ def backup_get_all_by_project(context, project_id):
         filter_by(project_id=project_id).all()
 
 
+@require_context
+def backup_get_all_by_volume(context, volume_id):
+    return model_query(context, models.Backup, project_only=True).\
+        filter_by(volume_id=volume_id).\
+        order_by(models.Backup.created_at).all()
+
+
 @require_context
 def backup_create(context, values):
     backup = models.Backup()
@@ -2287,3 +2294,58 @@ def transfer_accept(context, transfer_id, user_id, project_id):
             update({'deleted': True,
                     'deleted_at': timeutils.utcnow(),
                     'updated_at': literal_column('updated_at')})
+
+
+###############################
+
+
+@require_admin_context
+def image_volume_cache_create(context, values):
+    entry = models.ImageVolumeCacheEntry()
+    if not values.get('id'):
+        values['id'] = str(uuid.uuid4())
+    entry.update(values)
+    entry.save()
+    return entry
+
+
+@require_admin_context
+def image_volume_cache_get_by_image(context, host, image_id):
+    return model_query(context, models.ImageVolumeCacheEntry).\
+        filter_by(host=host).\
+        filter_by(image_id=image_id).\
+        first()
+
+
+@require_admin_context
+def image_volume_cache_get_all_for_host(context, host):
+    return model_query(context, models.ImageVolumeCacheEntry).\
+        filter_by(host=host).\
+        order_by(models.ImageVolumeCacheEntry.last_used).all()
+
+
+@require_admin_context
+def image_volume_cache_update(context, entry_id, values):
+    session = get_session()
+    with session.begin():
+        entry = model_query(context, models.ImageVolumeCacheEntry,
+                            session=session).\
+            filter_by(id=entry_id).first()
+
+        if not entry:
+            raise exception.ImageVolumeCacheEntryNotFound(entry_id=entry_id)
+
+        entry.update(values)
+        entry.save(session=session)
+    return entry
+
+
+@require_admin_context
+def image_volume_cache_destroy(context, entry_id):
+    session = get_session()
+    with session.begin():
+        session.query(models.ImageVolumeCacheEntry).\
+            filter_by(id=entry_id).\
+            update({'deleted': True,
+                    'deleted_at': timeutils.utcnow(),
+                    'updated_at': literal_column('updated_at')})
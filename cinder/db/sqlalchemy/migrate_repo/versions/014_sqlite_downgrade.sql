@@ -0,0 +1,50 @@
+BEGIN TRANSACTION;
+
+CREATE TABLE backups_v13 (
+    created_at DATETIME,
+    updated_at DATETIME,
+    deleted_at DATETIME,
+    deleted BOOLEAN,
+    id VARCHAR(36) NOT NULL,
+    volume_id VARCHAR(36) NOT NULL,
+    user_id VARCHAR(255),
+    project_id VARCHAR(255),
+    host VARCHAR(255),
+    availability_zone VARCHAR(255),
+    display_name VARCHAR(255),
+    display_description VARCHAR(255),
+    container VARCHAR(255),
+    status VARCHAR(255),
+    fail_reason VARCHAR(255),
+    service_metadata VARCHAR(255),
+    service VARCHAR(255),
+    size INTEGER,
+    object_count INTEGER,
+    PRIMARY KEY (id)
+);
+
+INSERT INTO backups_v13
+    SELECT created_at,
+        updated_at,
+        deleted_at,
+        deleted,
+        id,
+        volume_id,
+        user_id,
+        project_id,
+        host,
+        availability_zone,
+        display_name,
+        display_description,
+        container,
+        status,
+        fail_reason,
+        service_metadata,
+        service,
+        size,
+        object_count
+    FROM backups;
+
+DROP TABLE backups;
+ALTER TABLE backups_v13 RENAME TO backups;
+COMMIT;
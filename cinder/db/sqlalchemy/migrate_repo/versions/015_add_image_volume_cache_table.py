@@ -0,0 +1,62 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Boolean, Column, DateTime, Integer
+from sqlalchemy import MetaData, String, Table
+
+from cinder.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    # New table
+    image_volume_cache = Table(
+        'image_volume_cache_entries', meta,
+        Column('created_at', DateTime(timezone=False)),
+        Column('updated_at', DateTime(timezone=False)),
+        Column('deleted_at', DateTime(timezone=False)),
+        Column('deleted', Boolean),
+        Column('id', String(36), primary_key=True, nullable=False),
+        Column('host', String(length=255), nullable=False),
+        Column('image_id', String(length=36), nullable=False),
+        Column('image_checksum', String(length=255)),
+        Column('size', Integer),
+        Column('status', String(length=255)),
+        Column('provider_location', String(length=255)),
+        Column('last_used', DateTime(timezone=False)),
+        mysql_engine='InnoDB'
+    )
+
+    try:
+        image_volume_cache.create()
+    except Exception:
+        LOG.error(_("Table |%s| not created!"), repr(image_volume_cache))
+        raise
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+    image_volume_cache = Table('image_volume_cache_entries',
+                               meta,
+                               autoload=True)
+    try:
+        image_volume_cache.drop()
+    except Exception:
+        LOG.error(_("image_volume_cache_entries table not dropped"))
+        raise
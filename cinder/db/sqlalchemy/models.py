@@ -391,6 +391,7 @@ class Backup(BASE, CinderBase):
     service = Column(String(255))
     size = Column(Integer)
     object_count = Column(Integer)
+    parent_id = Column(String(36))
 
 
 class Transfer(BASE, CinderBase):
@@ -409,6 +410,24 @@ class Transfer(BASE, CinderBase):
                           'Transfer.deleted == False)')
 
 
+class ImageVolumeCacheEntry(BASE, CinderBase):
+    """Represents a cached copy of an image kept on a volume backend."""
+    __tablename__ = 'image_volume_cache_entries'
+    id = Column(String(36), primary_key=True)
+
+    @property
+    def name(self):
+        return CONF.volume_name_template % self.id
+
+    host = Column(String(255), nullable=False)
+    image_id = Column(String(36), nullable=False)
+    image_checksum = Column(String(255))
+    size = Column(Integer)
+    status = Column(String(255))
+    provider_location = Column(String(255))
+    last_used = Column(DateTime)
+
+
 def register_models():
     """Register Models and create metadata.
 
@@ -418,6 +437,7 @@ def register_models():
     """
     from sqlalchemy import create_engine
     models = (Backup,
+              ImageVolumeCacheEntry,
               Migration,
               Service,
               SMBackendConf,
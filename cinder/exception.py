@@ -576,9 +576,17 @@ class InvalidBackup(Invalid):
     message = _("Invalid backup: %(reason)s")
 
 
+class BackupDriverException(CinderException):
+    message = _("Backup driver reported an error") + ": %(reason)s"
+
+
 class SwiftConnectionFailed(CinderException):
     message = _("Connection to swift failed") + ": %(reason)s"
 
 
 class TransferNotFound(NotFound):
     message = _("Transfer %(transfer_id)s could not be found.")
+
+
+class ImageVolumeCacheEntryNotFound(NotFound):
+    message = _("Image volume cache entry %(entry_id)s could not be found.")
@@ -27,16 +27,26 @@ we should look at maybe pushign this up to OSLO
 
 
 import contextlib
+import errno
+import hashlib
 import os
 import re
+import stat
+import sys
 import tempfile
+import time
 
+import eventlet
+from eventlet import queue
+from eventlet import tpool
 from oslo.config import cfg
 
 from cinder import exception
+from cinder.image import qcow2
 from cinder.openstack.common import fileutils
 from cinder.openstack.common import log as logging
 from cinder.openstack.common import strutils
+from cinder import units
 from cinder import utils
 
 
@@ -44,11 +54,26 @@ LOG = logging.getLogger(__name__)
 
 image_helper_opt = [cfg.StrOpt('image_conversion_dir',
                     default='/tmp',
-                    help='parent dir for tempdir used for image conversion'), ]
+                    help='parent dir for tempdir used for image conversion'),
+                    cfg.IntOpt('image_conversion_cache_size_gb',
+                               default=0,
+                               help='Size in GB of the cache of converted '
+                                    'raw images kept in image_conversion_dir, '
+                                    '0 disables the cache'), ]
 
 CONF = cfg.CONF
 CONF.register_opts(image_helper_opt)
 
+# Subdirectory of image_conversion_dir holding the converted image cache.
+IMAGE_CACHE_DIR = 'image-cache'
+# Partial downloads untouched for this many seconds are left over from an
+# interrupted fetch and are removed at service start.
+STALE_DOWNLOAD_AGE = 3600
+# Block size used when streaming raw images straight to the volume.
+RAW_STREAM_BLOCKSIZE = units.MiB
+# Number of blocks read from the volume ahead of an image upload.
+UPLOAD_QUEUE_DEPTH = 8
+
 
 class QemuImgInfo(object):
     BACKING_FILE_RE = re.compile((r"^(.*?)\s*\(actual\s+path\s*:"
@@ -189,9 +214,12 @@ def qemu_img_info(path):
     return QemuImgInfo(out)
 
 
-def convert_image(source, dest, out_format):
+def convert_image(source, dest, out_format, in_format=None):
     """Convert image to other format"""
-    cmd = ('qemu-img', 'convert', '-O', out_format, source, dest)
+    cmd = ('qemu-img', 'convert')
+    if in_format:
+        cmd += ('-f', in_format)
+    cmd += ('-O', out_format, source, dest)
     utils.execute(*cmd, run_as_root=True)
 
 
@@ -232,12 +260,13 @@ def fetch_verify_image(context, image_service, image_id, dest,
                          "%(backing_file)s") % locals())
 
 
-def fetch_to_raw(context, image_service,
-                 image_id, dest,
-                 user_id=None, project_id=None):
-    if (CONF.image_conversion_dir and not
-            os.path.exists(CONF.image_conversion_dir)):
-        os.makedirs(CONF.image_conversion_dir)
+def _fetch_and_convert(context, image_service, image_id, image_meta, dest,
+                       user_id, project_id):
+    if image_meta.get('disk_format') == 'raw':
+        LOG.debug(_("%(image)s is raw, streaming it to %(dest)s"),
+                  {'image': image_id, 'dest': dest})
+        _stream_raw_image(context, image_service, image_id, image_meta, dest)
+        return
 
     # NOTE(avishay): I'm not crazy about creating temp files which may be
     # large and cause disk full errors which would confuse users.
@@ -246,7 +275,7 @@ def fetch_to_raw(context, image_service,
     with temporary_file() as tmp:
         fetch(context, image_service, image_id, tmp, user_id, project_id)
 
-        if is_xenserver_image(context, image_service, image_id):
+        if is_xenserver_format(image_meta):
             replace_xenserver_image_with_coalesced_vhd(tmp)
 
         data = qemu_img_info(tmp)
@@ -268,20 +297,316 @@ def fetch_to_raw(context, image_service,
 
         # NOTE(jdg): I'm using qemu-img convert to write
         # to the volume regardless if it *needs* conversion or not
-        # TODO(avishay): We can speed this up by checking if the image is raw
-        # and if so, writing directly to the device. However, we need to keep
-        # check via 'qemu-img info' that what we copied was in fact a raw
-        # image and not a different format with a backing file, which may be
-        # malicious.
         LOG.debug("%s was %s, converting to raw" % (image_id, fmt))
         convert_image(tmp, dest, 'raw')
+        _verify_raw(image_id, dest)
+
+
+class _RawImageWriter(object):
+    """File-like object writing a raw image stream to its destination.
+
+    The first block is probed with qemu-img before anything is written, the
+    data is checksummed on the way through, and all-zero blocks are skipped
+    when the destination is known to read back zeroes.
+    """
+
+    def __init__(self, image_id, dest_file, sparse):
+        self.image_id = image_id
+        self.dest_file = dest_file
+        self.sparse = sparse
+        self.md5 = hashlib.md5()
+        self.offset = 0
+        self._pending = []
+        self._pending_len = 0
+        self._probed = False
+
+    def write(self, data):
+        self.md5.update(data)
+        self._pending.append(data)
+        self._pending_len += len(data)
+        if self._pending_len >= RAW_STREAM_BLOCKSIZE:
+            self._flush()
+
+    def _flush(self, final=False):
+        data = ''.join(self._pending)
+        end = len(data)
+        if not final:
+            end -= end % RAW_STREAM_BLOCKSIZE
+        for start in xrange(0, end, RAW_STREAM_BLOCKSIZE):
+            self._write_block(data[start:start + RAW_STREAM_BLOCKSIZE])
+        self._pending = [data[end:]]
+        self._pending_len = len(data) - end
+
+    def _write_block(self, block):
+        if not self._probed:
+            _probe_raw(self.image_id, block)
+            self._probed = True
+        if not (self.sparse and utils.is_all_zero(block)):
+            self.dest_file.seek(self.offset)
+            self.dest_file.write(block)
+        self.offset += len(block)
+
+    def finish(self):
+        """Write out the buffered tail and flush the data to disk."""
+        self._flush(final=True)
+        if self.sparse:
+            self.dest_file.truncate(self.offset)
+        self.dest_file.flush()
+        os.fsync(self.dest_file.fileno())
+
+
+def _probe_raw(image_id, header):
+    """Reject an image claiming to be raw whose data is another format."""
+    with temporary_file() as tmp:
+        with open(tmp, 'wb') as header_file:
+            header_file.write(header)
+        try:
+            data = qemu_img_info(tmp)
+        except exception.ProcessExecutionError:
+            data = None
+    if data is None or data.file_format != 'raw' or data.backing_file:
+        raise exception.ImageUnacceptable(
+            image_id=image_id,
+            reason=_("disk_format is raw but the image data is not"))
+
+
+def _stream_raw_image(context, image_service, image_id, image_meta, dest):
+    """Download a raw image straight to dest without a scratch copy."""
+    if not os.path.exists(dest):
+        open(dest, 'wb').close()
+
+    # NOTE: a new block device may hold stale data, so zero blocks are only
+    # skipped for files, which are truncated first and read back zeroes.
+    sparse = not stat.S_ISBLK(os.stat(dest).st_mode)
+    with utils.temporary_chown(dest):
+        with open(dest, 'wb' if sparse else 'r+b') as dest_file:
+            writer = _RawImageWriter(image_id, dest_file, sparse)
+            image_service.download(context, image_id, writer)
+            writer.finish()
+
+    checksum = image_meta.get('checksum')
+    if checksum and writer.md5.hexdigest() != checksum:
+        raise exception.ImageUnacceptable(
+            image_id=image_id,
+            reason=_("checksum mismatch, expected %(expected)s but got "
+                     "%(actual)s") % {'expected': checksum,
+                                      'actual': writer.md5.hexdigest()})
+
+
+def _verify_raw(image_id, path):
+    data = qemu_img_info(path)
+    if data.file_format != "raw":
+        raise exception.ImageUnacceptable(
+            image_id=image_id,
+            reason=_("Converted to raw, but format is now %s") %
+            data.file_format)
 
-        data = qemu_img_info(dest)
-        if data.file_format != "raw":
-            raise exception.ImageUnacceptable(
-                image_id=image_id,
-                reason=_("Converted to raw, but format is now %s") %
-                data.file_format)
+
+def fetch_to_raw(context, image_service,
+                 image_id, dest,
+                 user_id=None, project_id=None):
+    if (CONF.image_conversion_dir and not
+            os.path.exists(CONF.image_conversion_dir)):
+        os.makedirs(CONF.image_conversion_dir)
+
+    image_meta = image_service.show(context, image_id)
+    if not (CONF.image_conversion_cache_size_gb and
+            image_meta.get('checksum')):
+        _fetch_and_convert(context, image_service, image_id, image_meta,
+                           dest, user_id, project_id)
+        return
+
+    with temporary_file() as tmp:
+        _link_cached_image(context, image_service, image_id, image_meta, tmp,
+                           user_id, project_id)
+        # NOTE: the cached copy was verified when it was converted, so it is
+        # copied as plain raw data and never probed for another format.
+        convert_image(tmp, dest, 'raw', in_format='raw')
+        _verify_raw(image_id, dest)
+
+
+def _image_cache_dir():
+    return os.path.join(CONF.image_conversion_dir, IMAGE_CACHE_DIR)
+
+
+def _link_cached_image(context, image_service, image_id, image_meta, dest,
+                       user_id, project_id):
+    """Hard link the cached raw copy of an image over dest.
+
+    The image is downloaded and converted into the cache on a miss.  A lock
+    per image makes concurrent requests for the same image wait for a
+    single download, and the converted file is only renamed into place
+    once complete.  Linking instead of opening the cached file keeps the
+    data reachable for the caller even if the entry is evicted meanwhile.
+    """
+    cache_dir = _image_cache_dir()
+    fileutils.ensure_tree(cache_dir)
+    name = '%s-%s' % (image_id, image_meta['checksum'])
+    path = os.path.join(cache_dir, name + '.raw')
+
+    def _link():
+        tmp_link = dest + '.link'
+        os.link(path, tmp_link)
+        os.rename(tmp_link, dest)
+        os.utime(path, None)
+
+    @utils.synchronized('image-cache-%s' % name, external=True)
+    def _fetch():
+        try:
+            _link()
+            LOG.debug(_("Using cached raw copy of image %s"), image_id)
+            return
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        fd, part = tempfile.mkstemp(dir=cache_dir, prefix=name,
+                                    suffix='.part')
+        os.close(fd)
+        with fileutils.remove_path_on_error(part):
+            _fetch_and_convert(context, image_service, image_id, image_meta,
+                               part, user_id, project_id)
+            os.rename(part, path)
+        _link()
+        prune_image_cache()
+
+    _fetch()
+
+
+def _image_cache_entries(cache_dir):
+    """Return (mtime, path, size) of the cached images, oldest first."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.raw'):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, path, st.st_blocks * 512))
+    return sorted(entries)
+
+
+def prune_image_cache():
+    """Evict least recently used images until the cache fits its size."""
+    cache_dir = _image_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return
+
+    limit = CONF.image_conversion_cache_size_gb * units.GiB
+    entries = _image_cache_entries(cache_dir)
+    total = sum(entry[2] for entry in entries)
+    for mtime, path, size in entries:
+        if total <= limit:
+            break
+        LOG.debug(_("Evicting %s from the image cache"), path)
+        fileutils.delete_if_exists(path)
+        total -= size
+
+
+def cleanup_image_cache():
+    """Remove stale entries from the converted image cache.
+
+    Partial downloads left behind by an interrupted fetch are removed, and
+    the cache is pruned in case its size was lowered.
+    """
+    if not CONF.image_conversion_cache_size_gb:
+        return
+    cache_dir = _image_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return
+
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.part'):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            if now - os.stat(path).st_mtime < STALE_DOWNLOAD_AGE:
+                continue
+        except OSError:
+            continue
+        LOG.info(_("Removing stale partial image download %s"), path)
+        fileutils.delete_if_exists(path)
+    prune_image_cache()
+
+
+def _read_blocks(volume_file, blocksize=RAW_STREAM_BLOCKSIZE):
+    while True:
+        data = tpool.execute(volume_file.read, blocksize)
+        if not data:
+            break
+        yield data
+
+
+class _PipelinedReader(object):
+    """File-like object reading ahead from an iterator of chunks.
+
+    A greenthread pulls chunks into a bounded queue, so the volume is read
+    while the previous chunks are being sent to the image service.
+    """
+
+    def __init__(self, chunks, depth=UPLOAD_QUEUE_DEPTH):
+        self._queue = queue.Queue(depth)
+        self._chunk = ''
+        self._offset = 0
+        self._eof = False
+        self._exc_info = None
+        self._thread = eventlet.spawn(self._fill, chunks)
+
+    def _fill(self, chunks):
+        try:
+            for chunk in chunks:
+                self._queue.put(chunk)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._queue.put(None)
+
+    def _next_chunk(self):
+        chunk = self._queue.get()
+        if chunk is None:
+            self._eof = True
+            if self._exc_info:
+                exc_info, self._exc_info = self._exc_info, None
+                raise exc_info[0], exc_info[1], exc_info[2]
+            chunk = ''
+        self._chunk = chunk
+        self._offset = 0
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self._offset >= len(self._chunk):
+                if self._eof:
+                    break
+                self._next_chunk()
+                continue
+            end = len(self._chunk)
+            if size > 0:
+                end = min(end, self._offset + size)
+                size -= end - self._offset
+            parts.append(self._chunk[self._offset:end])
+            self._offset = end
+        return ''.join(parts)
+
+    def close(self):
+        self._thread.kill()
+
+
+def _upload_chunks(context, image_service, image_id, chunks):
+    reader = _PipelinedReader(chunks)
+    try:
+        image_service.update(context, image_id, {}, reader)
+    finally:
+        reader.close()
+
+
+def _volume_size(volume_file):
+    volume_file.seek(0, os.SEEK_END)
+    size = volume_file.tell()
+    volume_file.seek(0)
+    return size
 
 
 def upload_volume(context, image_service, image_meta, volume_path):
@@ -291,7 +616,20 @@ def upload_volume(context, image_service, image_meta, volume_path):
                   (image_id, image_meta['disk_format']))
         with utils.temporary_chown(volume_path):
             with fileutils.file_open(volume_path) as image_file:
-                image_service.update(context, image_id, {}, image_file)
+                _upload_chunks(context, image_service, image_id,
+                               _read_blocks(image_file))
+        return
+
+    if (image_meta['disk_format'] == 'qcow2'):
+        # NOTE: qcow2 is generated on the fly, skipping zero clusters, so it
+        # does not need a scratch copy in image_conversion_dir.
+        LOG.debug(_("%s was raw, streaming it as qcow2"), image_id)
+        with utils.temporary_chown(volume_path):
+            with fileutils.file_open(volume_path) as volume_file:
+                image = qcow2.Qcow2Image.from_volume(
+                    volume_file, _volume_size(volume_file))
+                _upload_chunks(context, image_service, image_id,
+                               image.chunks(volume_file))
         return
 
     if (CONF.image_conversion_dir and not
@@ -313,7 +651,8 @@ def upload_volume(context, image_service, image_meta, volume_path):
                 {'f1': image_meta['disk_format'], 'f2': data.file_format})
 
         with fileutils.file_open(tmp) as image_file:
-            image_service.update(context, image_id, {}, image_file)
+            _upload_chunks(context, image_service, image_id,
+                           _read_blocks(image_file))
         os.unlink(tmp)
 
 
@@ -0,0 +1,191 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Stream a raw volume as a qcow2 image without a scratch copy.
+
+qemu-img needs a seekable output file, so converting a volume to qcow2
+normally means writing the whole image to local disk before uploading it.
+The qcow2 layout can however be written front to back once the clusters
+holding data are known: the volume is scanned for them first, then the
+header, tables and data clusters are generated in file order.  All-zero
+clusters are left unallocated.
+
+The image uses qcow2 version 2 with 64k clusters, the qemu-img defaults.
+"""
+
+import struct
+
+from eventlet import tpool
+
+from cinder import utils
+
+
+CLUSTER_BITS = 16
+CLUSTER_SIZE = 1 << CLUSTER_BITS
+QCOW_MAGIC = 0x514649fb
+QCOW_VERSION = 2
+# Set on L1 and L2 entries whose cluster has a refcount of exactly one.
+QCOW_OFLAG_COPIED = 1 << 63
+L2_ENTRIES = CLUSTER_SIZE / 8
+REFCOUNTS_PER_BLOCK = CLUSTER_SIZE / 2
+# magic, version, backing_file_offset, backing_file_size, cluster_bits,
+# size, crypt_method, l1_size, l1_table_offset, refcount_table_offset,
+# refcount_table_clusters, nb_snapshots, snapshots_offset
+HEADER_FORMAT = '>IIQIIQIIQQIIQ'
+# Number of clusters read from the volume at a time.
+READ_CLUSTERS = 16
+
+
+def _clusters(nbytes):
+    return (nbytes + CLUSTER_SIZE - 1) / CLUSTER_SIZE
+
+
+def _pad(data):
+    return data + '\0' * (_clusters(len(data)) * CLUSTER_SIZE - len(data))
+
+
+def _read(volume_file, offset, length):
+    volume_file.seek(offset)
+    return tpool.execute(volume_file.read, length)
+
+
+class Qcow2Image(object):
+    """Layout of the qcow2 image of a volume, and its contents."""
+
+    def __init__(self, size, allocated):
+        """Compute the layout.
+
+        :param size: virtual size of the image in bytes
+        :param allocated: bytearray with one flag per guest cluster, set
+                          for the clusters holding data
+        """
+        self.size = size
+        self.allocated = allocated
+        self.data_clusters = allocated.count('\x01')
+        self.l1_size = (_clusters(size) + L2_ENTRIES - 1) / L2_ENTRIES
+        self.l1_clusters = max(_clusters(self.l1_size * 8), 1)
+        self.l2_tables = [index for index in xrange(self.l1_size)
+                          if 1 in allocated[index * L2_ENTRIES:
+                                            (index + 1) * L2_ENTRIES]]
+
+        # The refcount blocks cover every cluster in the file, themselves
+        # and the refcount table included, so iterate to a fixed point.
+        fixed = 1 + self.l1_clusters + len(self.l2_tables)
+        self.refcount_blocks = self.refcount_table_clusters = 0
+        while True:
+            self.total_clusters = (fixed + self.refcount_table_clusters +
+                                   self.refcount_blocks + self.data_clusters)
+            blocks = ((self.total_clusters + REFCOUNTS_PER_BLOCK - 1) /
+                      REFCOUNTS_PER_BLOCK)
+            table_clusters = _clusters(blocks * 8)
+            if (blocks, table_clusters) == (self.refcount_blocks,
+                                            self.refcount_table_clusters):
+                break
+            self.refcount_blocks = blocks
+            self.refcount_table_clusters = table_clusters
+
+        self.l1_table_offset = CLUSTER_SIZE
+        self.refcount_table_offset = (self.l1_table_offset +
+                                      self.l1_clusters * CLUSTER_SIZE)
+        self.refcount_blocks_offset = (
+            self.refcount_table_offset +
+            self.refcount_table_clusters * CLUSTER_SIZE)
+        self.l2_tables_offset = (self.refcount_blocks_offset +
+                                 self.refcount_blocks * CLUSTER_SIZE)
+        self.data_offset = (self.l2_tables_offset +
+                            len(self.l2_tables) * CLUSTER_SIZE)
+
+    @classmethod
+    def from_volume(cls, volume_file, size):
+        """Scan a volume for the clusters holding data."""
+        allocated = bytearray(_clusters(size))
+        step = READ_CLUSTERS * CLUSTER_SIZE
+        for offset in xrange(0, size, step):
+            data = _read(volume_file, offset, min(step, size - offset))
+            for start in xrange(0, len(data), CLUSTER_SIZE):
+                if not utils.is_all_zero(data[start:start + CLUSTER_SIZE]):
+                    allocated[(offset + start) / CLUSTER_SIZE] = 1
+        return cls(size, allocated)
+
+    @property
+    def image_size(self):
+        """Size in bytes of the generated qcow2 file."""
+        return self.total_clusters * CLUSTER_SIZE
+
+    def _header(self):
+        return _pad(struct.pack(HEADER_FORMAT, QCOW_MAGIC, QCOW_VERSION,
+                                0, 0, CLUSTER_BITS, self.size, 0,
+                                self.l1_size, self.l1_table_offset,
+                                self.refcount_table_offset,
+                                self.refcount_table_clusters, 0, 0))
+
+    def _l1_table(self):
+        entries = [0] * self.l1_size
+        for position, index in enumerate(self.l2_tables):
+            entries[index] = (self.l2_tables_offset +
+                              position * CLUSTER_SIZE) | QCOW_OFLAG_COPIED
+        data = struct.pack('>%dQ' % len(entries), *entries)
+        return data + '\0' * (self.l1_clusters * CLUSTER_SIZE - len(data))
+
+    def _refcount_table(self):
+        entries = [self.refcount_blocks_offset + block * CLUSTER_SIZE
+                   for block in xrange(self.refcount_blocks)]
+        return _pad(struct.pack('>%dQ' % len(entries), *entries))
+
+    def _refcount_block(self, block):
+        used = min(self.total_clusters - block * REFCOUNTS_PER_BLOCK,
+                   REFCOUNTS_PER_BLOCK)
+        return _pad(struct.pack('>%dH' % used, *([1] * used)))
+
+    def _l2_tables(self):
+        host_offset = self.data_offset
+        for index in self.l2_tables:
+            entries = [0] * L2_ENTRIES
+            first = index * L2_ENTRIES
+            for entry, flag in enumerate(self.allocated[first:
+                                                        first + L2_ENTRIES]):
+                if flag:
+                    entries[entry] = host_offset | QCOW_OFLAG_COPIED
+                    host_offset += CLUSTER_SIZE
+            yield struct.pack('>%dQ' % L2_ENTRIES, *entries)
+
+    def _data(self, volume_file):
+        cluster = 0
+        count = len(self.allocated)
+        while cluster < count:
+            if not self.allocated[cluster]:
+                cluster += 1
+                continue
+            run = 1
+            while (run < READ_CLUSTERS and cluster + run < count and
+                   self.allocated[cluster + run]):
+                run += 1
+            offset = cluster * CLUSTER_SIZE
+            data = _read(volume_file, offset,
+                         min(run * CLUSTER_SIZE, self.size - offset))
+            yield data + '\0' * (run * CLUSTER_SIZE - len(data))
+            cluster += run
+
+    def chunks(self, volume_file):
+        """Generate the qcow2 image, reading the data from volume_file."""
+        yield self._header()
+        yield self._l1_table()
+        yield self._refcount_table()
+        for block in xrange(self.refcount_blocks):
+            yield self._refcount_block(block)
+        for table in self._l2_tables():
+            yield table
+        for data in self._data(volume_file):
+            yield data
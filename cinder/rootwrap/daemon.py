@@ -0,0 +1,221 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Root wrapper daemon
+
+   Loads the rootwrap configuration and filters once, then runs the
+   commands sent to it over a UNIX socket when they match the filters,
+   exactly as cinder-rootwrap does for a single command.
+
+   The daemon is started through sudo by the service using it and prints
+   the path of its socket on stdout. The socket is only accessible to the
+   user that ran sudo, and the daemon exits when its stdin is closed, so
+   it does not outlive the service.
+
+   Each connection carries one JSON request, {"cmd": [...], "stdin": ...},
+   and gets one JSON reply, {"returncode": ..., "stdout": ...,
+   "stderr": ...}. The stdin, stdout and stderr data are base64 encoded.
+"""
+
+import base64
+import ConfigParser
+import json
+import logging
+import os
+import pwd
+import shutil
+import signal
+import socket
+import SocketServer
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+
+from cinder.openstack.common.rootwrap import cmd
+from cinder.openstack.common.rootwrap import wrapper
+from cinder.rootwrap import filtercache
+
+
+SOCKET_NAME = 'rootwrap.sock'
+# Message fields holding raw process data
+DATA_FIELDS = ('stdin', 'stdout', 'stderr')
+# From <asm-generic/socket.h>, not exposed by the socket module
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+
+
+def dump_message(message):
+    """Serialize a request or reply."""
+    message = dict(message)
+    for field in DATA_FIELDS:
+        if message.get(field) is not None:
+            message[field] = base64.b64encode(message[field])
+    return json.dumps(message)
+
+
+def load_message(data):
+    """Deserialize a request or reply."""
+    message = json.loads(data)
+    for field in DATA_FIELDS:
+        if message.get(field) is not None:
+            message[field] = base64.b64decode(message[field])
+    return message
+
+
+def _subprocess_setup():
+    # Python installs a SIGPIPE handler by default. This is usually not what
+    # non-Python subprocesses expect.
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        if not self.server.is_allowed_peer(self.request):
+            return
+        request = load_message(self.rfile.read())
+        returncode, stdout, stderr = self.server.run_command(
+            map(str, request['cmd']), request.get('stdin'))
+        self.wfile.write(dump_message({'returncode': returncode,
+                                       'stdout': stdout,
+                                       'stderr': stderr}))
+
+
+class RootwrapServer(SocketServer.ThreadingMixIn,
+                     SocketServer.UnixStreamServer):
+    """Runs the commands received on a UNIX socket through the filters."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, config, filters, execname='rootwrap',
+                 uid=None):
+        """Bind the socket.
+
+        :param config: RootwrapConfig to use
+        :param filters: filters loaded with
+                        filtercache.load_config_and_filters()
+        :param uid: user allowed to connect besides root, the socket is
+                    made accessible to it
+        """
+        SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                               _RequestHandler)
+        self.config = config
+        self.filters = filters
+        self.execname = execname
+        self.uid = uid
+        os.chmod(socket_path, 0o600)
+        if uid is not None:
+            os.chown(socket_path, uid, -1)
+
+    def is_allowed_peer(self, sock):
+        try:
+            creds = sock.getsockopt(socket.SOL_SOCKET, SO_PEERCRED,
+                                    struct.calcsize('3i'))
+        except socket.error:
+            # Not Linux, rely on the permissions of the socket
+            return True
+        pid, uid, gid = struct.unpack('3i', creds)
+        return uid in (0, self.uid if self.uid is not None else os.getuid())
+
+    def _error(self, message, errorcode, log=True):
+        if log:
+            logging.error(message)
+        return errorcode, "%s: %s\n" % (self.execname, message), ''
+
+    def run_command(self, userargs, process_input=None):
+        """Run a command if it matches a filter.
+
+        :returns: (returncode, stdout, stderr)
+        """
+        use_syslog = self.config.use_syslog
+        try:
+            filtermatch = filtercache.match_filter(
+                self.filters, userargs, exec_dirs=self.config.exec_dirs)
+        except wrapper.FilterMatchNotExecutable as exc:
+            msg = ("Executable not found: %s (filter match = %s)"
+                   % (exc.match.exec_path, exc.match.name))
+            return self._error(msg, cmd.RC_NOEXECFOUND, log=use_syslog)
+        except wrapper.NoFilterMatched:
+            msg = ("Unauthorized command: %s (no filter matched)"
+                   % ' '.join(userargs))
+            return self._error(msg, cmd.RC_UNAUTHORIZED, log=use_syslog)
+
+        command = filtermatch.get_command(userargs,
+                                          exec_dirs=self.config.exec_dirs)
+        if use_syslog:
+            logging.info("(%s > %s) Executing %s (filter match = %s)" % (
+                self.uid, pwd.getpwuid(os.getuid())[0],
+                command, filtermatch.name))
+
+        obj = subprocess.Popen(command,
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               close_fds=True,
+                               preexec_fn=_subprocess_setup,
+                               env=filtermatch.get_environment(userargs))
+        stdout, stderr = obj.communicate(process_input)
+        return obj.returncode, stdout, stderr
+
+
+def _exit_on_eof(server):
+    sys.stdin.read()
+    server.shutdown()
+
+
+def main():
+    execname = sys.argv.pop(0)
+    if len(sys.argv) != 1:
+        cmd._exit_error(execname, "No configuration file specified",
+                        cmd.RC_NOCOMMAND, log=False)
+    configfile = sys.argv.pop(0)
+
+    try:
+        config, filters = filtercache.load_config_and_filters(configfile)
+    except ValueError as exc:
+        msg = "Incorrect value in %s: %s" % (configfile, exc.message)
+        cmd._exit_error(execname, msg, cmd.RC_BADCONFIG, log=False)
+    except ConfigParser.Error:
+        cmd._exit_error(execname,
+                        "Incorrect configuration file: %s" % configfile,
+                        cmd.RC_BADCONFIG, log=False)
+
+    if config.use_syslog:
+        wrapper.setup_syslog(execname,
+                             config.syslog_log_facility,
+                             config.syslog_log_level)
+
+    # Only let the user that ran sudo reach the socket
+    uid = int(os.environ['SUDO_UID']) if 'SUDO_UID' in os.environ else None
+    socket_dir = tempfile.mkdtemp(prefix='rootwrap-')
+    try:
+        if uid is not None:
+            os.chown(socket_dir, uid, -1)
+        socket_path = os.path.join(socket_dir, SOCKET_NAME)
+        server = RootwrapServer(socket_path, config, filters,
+                                execname=os.path.basename(execname), uid=uid)
+
+        watcher = threading.Thread(target=_exit_on_eof, args=(server,))
+        watcher.daemon = True
+        watcher.start()
+
+        sys.stdout.write(socket_path + '\n')
+        sys.stdout.flush()
+        server.serve_forever()
+    finally:
+        shutil.rmtree(socket_dir, ignore_errors=True)
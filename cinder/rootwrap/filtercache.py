@@ -0,0 +1,239 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compiled and indexed rootwrap filters
+
+   load_config_and_filters() compiles the rootwrap configuration and its
+   filter definitions into a JSON cache next to the configuration file.
+   Later loads rebuild the filters from the cache without parsing any
+   file, until the configuration or a filter file changes. Like the
+   filters, the cache is ignored unless it is owned by the running user
+   and not writeable by others.
+
+   The filters are returned in a FilterList, indexed by the command each
+   of them can match, so match_filter() only tries the candidates for a
+   command.
+"""
+
+import ConfigParser
+import json
+import os
+import re
+import string
+import tempfile
+
+from cinder.openstack.common.rootwrap import filters
+from cinder.openstack.common.rootwrap import wrapper
+
+
+# RootwrapConfig settings saved in the cache
+CACHED_SETTINGS = ('filters_path', 'exec_dirs', 'syslog_log_facility',
+                   'syslog_log_level', 'use_syslog')
+
+
+def get_index_key(f):
+    """Returns the command a filter can match, None if it may match any."""
+    if isinstance(f, filters.RegExpFilter):
+        if not f.args or re.search(r'[\\.^$*+?{}\[\]|()]', f.args[0]):
+            return None
+        return f.args[0]
+    if isinstance(f, filters.DnsmasqFilter):
+        return 'env'
+    if isinstance(f, filters.KillFilter):
+        return 'kill'
+    if isinstance(f, filters.ReadFileFilter):
+        return 'cat'
+    if type(f) in (filters.CommandFilter, filters.PathFilter):
+        return os.path.basename(f.exec_path)
+    # Filters this module does not know may match anything
+    return None
+
+
+class FilterList(list):
+    """List of filters, indexed by the command each of them can match."""
+
+    def __init__(self, filters=(), index=None, unindexed=None):
+        super(FilterList, self).__init__(filters)
+        if index is None:
+            index, unindexed = {}, []
+            for position, f in enumerate(self):
+                key = get_index_key(f)
+                if key is None:
+                    unindexed.append(position)
+                else:
+                    index.setdefault(key, []).append(position)
+        self.index = index
+        self.unindexed = unindexed
+
+    def candidates(self, userargs):
+        """Returns the filters that may match userargs, in order."""
+        positions = self.index.get(userargs[0] if userargs else None, [])
+        if self.unindexed:
+            positions = sorted(positions + self.unindexed)
+        return [self[position] for position in positions]
+
+
+def _read_filter_definitions(filters_path):
+    """Returns the (name, definition) of the filters in a list of dirs."""
+    definitions = []
+    for filterdir in filters_path:
+        if not os.path.isdir(filterdir):
+            continue
+        for filterfile in os.listdir(filterdir):
+            filterconfig = ConfigParser.RawConfigParser()
+            filterconfig.read(os.path.join(filterdir, filterfile))
+            for (name, value) in filterconfig.items("Filters"):
+                filterdefinition = [string.strip(s) for s in value.split(',')]
+                definitions.append((name, filterdefinition))
+    return definitions
+
+
+def _build_filters(definitions):
+    """Returns the FilterList of (name, definition) pairs."""
+    filterlist = []
+    for name, filterdefinition in definitions:
+        newfilter = wrapper.build_filter(*filterdefinition)
+        if newfilter is None:
+            continue
+        newfilter.name = name
+        filterlist.append(newfilter)
+    return FilterList(filterlist)
+
+
+def load_filters(filters_path):
+    """Load filters from a list of directories into a FilterList."""
+    return _build_filters(_read_filter_definitions(filters_path))
+
+
+def _cache_key(configfile, filters_path):
+    """Returns the modification times of the rootwrap configuration.
+
+    Covers the configuration file, the filter directories (whose mtime
+    changes when files are added or removed) and every filter file.
+    """
+    key = []
+    for path in [configfile] + filters_path:
+        if not os.path.exists(path):
+            continue
+        st = os.stat(path)
+        key.append([path, st.st_mtime, st.st_size])
+        if os.path.isdir(path):
+            for filterfile in sorted(os.listdir(path)):
+                st = os.stat(os.path.join(path, filterfile))
+                key.append([filterfile, st.st_mtime, st.st_size])
+    return key
+
+
+def _load_cache(cache_path, configfile):
+    try:
+        st = os.stat(cache_path)
+        # Like the filters, the cache must only be writeable by us
+        if st.st_uid != os.geteuid() or st.st_mode & 0o022:
+            return None
+        with open(cache_path) as f:
+            cache = json.load(f)
+        settings = cache['config']
+        if cache['key'] != _cache_key(configfile, settings['filters_path']):
+            return None
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+    config = wrapper.RootwrapConfig.__new__(wrapper.RootwrapConfig)
+    for name in CACHED_SETTINGS:
+        setattr(config, name, settings[name])
+    if config.exec_dirs is None:
+        # Use system PATH if exec_dirs is not specified
+        config.exec_dirs = os.environ["PATH"].split(':')
+
+    filterlist = []
+    for name, filterdefinition in cache['filters']:
+        newfilter = wrapper.build_filter(*[s.encode('utf-8')
+                                           for s in filterdefinition])
+        newfilter.name = name.encode('utf-8')
+        filterlist.append(newfilter)
+    return config, FilterList(filterlist, cache['index'], cache['unindexed'])
+
+
+def _write_cache(cache_path, configfile, config, path_exec_dirs,
+                 definitions):
+    settings = dict((name, getattr(config, name))
+                    for name in CACHED_SETTINGS)
+    if path_exec_dirs:
+        settings['exec_dirs'] = None
+    # Only keep the filters that could be built
+    definitions = [(name, filterdefinition)
+                   for name, filterdefinition in definitions
+                   if hasattr(filters, filterdefinition[0])]
+    filterlist = _build_filters(definitions)
+    cache = {'key': _cache_key(configfile, config.filters_path),
+             'config': settings,
+             'filters': definitions,
+             'index': filterlist.index,
+             'unindexed': filterlist.unindexed}
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path),
+                                        prefix='.rootwrap-cache-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, cache_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+    except (IOError, OSError):
+        # The cache is optional, e.g. the directory may be read-only
+        pass
+    return filterlist
+
+
+def load_config_and_filters(configfile, cache_path=None):
+    """Load the rootwrap configuration and its filters.
+
+    The filters are compiled, along with the configuration, into
+    cache_path (by default next to the configuration file). Later loads
+    use it without parsing any file, until the configuration or a filter
+    file changes.
+
+    :returns: (RootwrapConfig, FilterList)
+    :raises: ValueError or ConfigParser.Error for a bad configuration
+    """
+    if cache_path is None:
+        cache_path = configfile + '.cache'
+    cached = _load_cache(cache_path, configfile)
+    if cached is not None:
+        return cached
+
+    rawconfig = ConfigParser.RawConfigParser()
+    rawconfig.read(configfile)
+    config = wrapper.RootwrapConfig(rawconfig)
+    # exec_dirs taken from PATH are not baked into the cache
+    path_exec_dirs = not rawconfig.has_option("DEFAULT", "exec_dirs")
+    definitions = _read_filter_definitions(config.filters_path)
+    return config, _write_cache(cache_path, configfile, config,
+                                path_exec_dirs, definitions)
+
+
+def match_filter(filter_list, userargs, exec_dirs=[]):
+    """Checks user command and arguments through command filters.
+
+    Like wrapper.match_filter(), but only the candidates for the command
+    are tried when filter_list is a FilterList.
+    """
+    if isinstance(filter_list, FilterList):
+        filter_list = filter_list.candidates(userargs)
+    return wrapper.match_filter(filter_list, userargs, exec_dirs=exec_dirs)
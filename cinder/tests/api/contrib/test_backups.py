@@ -17,6 +17,7 @@
 Tests for Backup code.
 """
 
+import datetime
 import json
 from xml.dom import minidom
 
@@ -24,6 +25,7 @@ import webob
 
 # needed for stubs to work
 import cinder.backup
+import cinder.backup.rpcapi
 from cinder import context
 from cinder import db
 from cinder import exception
@@ -55,7 +57,8 @@ class BackupsAPITestCase(test.TestCase):
                        display_description='this is a test backup',
                        container='volumebackups',
                        status='creating',
-                       size=0, object_count=0):
+                       size=0, object_count=0, parent_id=None,
+                       created_at=None):
         """Create a backup object."""
         backup = {}
         backup['volume_id'] = volume_id
@@ -70,6 +73,9 @@ class BackupsAPITestCase(test.TestCase):
         backup['fail_reason'] = ''
         backup['size'] = size
         backup['object_count'] = object_count
+        backup['parent_id'] = parent_id
+        if created_at is not None:
+            backup['created_at'] = created_at
         return db.backup_create(context.get_admin_context(), backup)['id']
 
     @staticmethod
@@ -379,6 +385,113 @@ class BackupsAPITestCase(test.TestCase):
 
         db.volume_destroy(context.get_admin_context(), volume_id)
 
+    def test_create_incremental_backup_json(self):
+        self.stubs.Set(cinder.db, 'service_get_all_by_topic',
+                       self._stub_service_get_all_by_topic)
+        volume_id = self._create_volume(status='available', size=5)
+        parent_id = self._create_backup(volume_id, status='available')
+        body = {"backup": {"display_name": "nightly001",
+                           "volume_id": volume_id,
+                           "incremental": True,
+                           }
+                }
+        req = webob.Request.blank('/v2/fake/backups')
+        req.method = 'POST'
+        req.headers['Content-Type'] = 'application/json'
+        req.body = json.dumps(body)
+        res = req.get_response(fakes.wsgi_app())
+        res_dict = json.loads(res.body)
+
+        self.assertEqual(res.status_int, 202)
+        backup_id = res_dict['backup']['id']
+        self.assertEqual(self._get_backup_attrib(backup_id, 'parent_id'),
+                         parent_id)
+        self.assertEqual(self._get_backup_attrib(backup_id, 'container'),
+                         'volumebackups')
+
+        db.backup_destroy(context.get_admin_context(), backup_id)
+        db.backup_destroy(context.get_admin_context(), parent_id)
+        db.volume_destroy(context.get_admin_context(), volume_id)
+
+    def test_create_incremental_backup_newest_parent(self):
+        self.stubs.Set(cinder.db, 'service_get_all_by_topic',
+                       self._stub_service_get_all_by_topic)
+        volume_id = self._create_volume(status='available', size=5)
+        now = timeutils.utcnow()
+        newest_id = self._create_backup(volume_id, status='available',
+                                        created_at=now)
+        oldest_id = self._create_backup(volume_id, status='available',
+                                        created_at=now - datetime.timedelta(
+                                            days=1))
+        body = {"backup": {"display_name": "nightly001",
+                           "volume_id": volume_id,
+                           "incremental": True,
+                           }
+                }
+        req = webob.Request.blank('/v2/fake/backups')
+        req.method = 'POST'
+        req.headers['Content-Type'] = 'application/json'
+        req.body = json.dumps(body)
+        res = req.get_response(fakes.wsgi_app())
+        res_dict = json.loads(res.body)
+
+        self.assertEqual(res.status_int, 202)
+        backup_id = res_dict['backup']['id']
+        self.assertEqual(self._get_backup_attrib(backup_id, 'parent_id'),
+                         newest_id)
+
+        db.backup_destroy(context.get_admin_context(), backup_id)
+        db.backup_destroy(context.get_admin_context(), oldest_id)
+        db.backup_destroy(context.get_admin_context(), newest_id)
+        db.volume_destroy(context.get_admin_context(), volume_id)
+
+    def test_create_incremental_backup_other_container(self):
+        volume_id = self._create_volume(status='available', size=5)
+        parent_id = self._create_backup(volume_id, status='available')
+        body = {"backup": {"display_name": "nightly001",
+                           "volume_id": volume_id,
+                           "container": "othercontainer",
+                           "incremental": True,
+                           }
+                }
+        req = webob.Request.blank('/v2/fake/backups')
+        req.method = 'POST'
+        req.headers['Content-Type'] = 'application/json'
+        req.body = json.dumps(body)
+        res = req.get_response(fakes.wsgi_app())
+        res_dict = json.loads(res.body)
+
+        self.assertEqual(res.status_int, 400)
+        self.assertEqual(res_dict['badRequest']['code'], 400)
+        self.assertEqual(db.volume_get(context.get_admin_context(),
+                                       volume_id)['status'], 'available')
+
+        db.backup_destroy(context.get_admin_context(), parent_id)
+        db.volume_destroy(context.get_admin_context(), volume_id)
+
+    def test_create_incremental_backup_without_parent(self):
+        volume_id = self._create_volume(status='available', size=5)
+        body = {"backup": {"display_name": "nightly001",
+                           "volume_id": volume_id,
+                           "incremental": True,
+                           }
+                }
+        req = webob.Request.blank('/v2/fake/backups')
+        req.method = 'POST'
+        req.headers['Content-Type'] = 'application/json'
+        req.body = json.dumps(body)
+        res = req.get_response(fakes.wsgi_app())
+        res_dict = json.loads(res.body)
+
+        self.assertEqual(res.status_int, 400)
+        self.assertEqual(res_dict['badRequest']['message'],
+                         'Invalid backup: No backups available to do an '
+                         'incremental backup')
+        self.assertEqual(db.volume_get(context.get_admin_context(),
+                                       volume_id)['status'], 'available')
+
+        db.volume_destroy(context.get_admin_context(), volume_id)
+
     def test_create_backup_xml(self):
         self.stubs.Set(cinder.db, 'service_get_all_by_topic',
                        self._stub_service_get_all_by_topic)
@@ -629,6 +742,27 @@ class BackupsAPITestCase(test.TestCase):
 
         db.backup_destroy(context.get_admin_context(), backup_id)
 
+    def test_delete_backup_with_dependent_backups(self):
+        backup_id = self._create_backup(status='available')
+        child_id = self._create_backup(status='available',
+                                       parent_id=backup_id)
+        req = webob.Request.blank('/v2/fake/backups/%s' %
+                                  backup_id)
+        req.method = 'DELETE'
+        req.headers['Content-Type'] = 'application/json'
+        res = req.get_response(fakes.wsgi_app())
+        res_dict = json.loads(res.body)
+
+        self.assertEqual(res.status_int, 400)
+        self.assertEqual(res_dict['badRequest']['message'],
+                         'Invalid backup: Incremental backups exist for '
+                         'this backup')
+        self.assertEqual(self._get_backup_attrib(backup_id, 'status'),
+                         'available')
+
+        db.backup_destroy(context.get_admin_context(), child_id)
+        db.backup_destroy(context.get_admin_context(), backup_id)
+
     def test_restore_backup_volume_id_specified_json(self):
         backup_id = self._create_backup(status='available')
         # need to create the volume referenced below first
@@ -648,6 +782,94 @@ class BackupsAPITestCase(test.TestCase):
         self.assertEqual(res_dict['restore']['backup_id'], backup_id)
         self.assertEqual(res_dict['restore']['volume_id'], volume_id)
 
+    def _restore_range(self, body, content_type='application/json'):
+        restored = []
+
+        def fake_restore_backup(cls, context, host, backup_id, volume_id,
+                                offset=None, length=None):
+            restored.append((backup_id, volume_id, offset, length))
+
+        self.stubs.Set(cinder.backup.rpcapi.BackupAPI, 'restore_backup',
+                       fake_restore_backup)
+        backup_id = self._create_backup(status='available', size=1)
+        volume_id = self._create_volume(status='available', size=5)
+        req = webob.Request.blank('/v2/fake/backups/%s/restore' %
+                                  backup_id)
+        req.method = 'POST'
+        req.headers['Content-Type'] = content_type
+        req.body = body % {'volume_id': volume_id}
+        res = req.get_response(fakes.wsgi_app())
+        return res, restored, backup_id, volume_id
+
+    def test_restore_backup_range_json(self):
+        body = ('{"restore": {"volume_id": "%(volume_id)s", '
+                '"offset": 4096, "length": "8192"}}')
+        res, restored, backup_id, volume_id = self._restore_range(body)
+        self.assertEqual(res.status_int, 202)
+        self.assertEqual(restored, [(backup_id, volume_id, 4096, 8192)])
+
+    def test_restore_backup_range_xml(self):
+        body = '<restore volume_id="%(volume_id)s" offset="4096"/>'
+        res, restored, backup_id, volume_id = self._restore_range(
+            body, 'application/xml')
+        self.assertEqual(res.status_int, 202)
+        self.assertEqual(restored,
+                         [(backup_id, volume_id, 4096, 1024 ** 3 - 4096)])
+
+    def test_restore_backup_range_invalid(self):
+        for restore in ('"offset": "start"',
+                        '"offset": -1',
+                        '"length": 0',
+                        '"offset": 1073741824',
+                        '"offset": 4096, "length": 1073741824'):
+            body = ('{"restore": {"volume_id": "%(volume_id)s", ' +
+                    restore + '}}')
+            res, restored, backup_id, volume_id = self._restore_range(body)
+            self.assertEqual(res.status_int, 400)
+            self.assertEqual(restored, [])
+
+    def _verify(self, body, status='available',
+                content_type='application/json'):
+        verified = []
+
+        def fake_verify_backup(cls, context, host, backup_id, decompress):
+            verified.append((backup_id, decompress))
+
+        self.stubs.Set(cinder.backup.rpcapi.BackupAPI, 'verify_backup',
+                       fake_verify_backup)
+        backup_id = self._create_backup(status=status)
+        req = webob.Request.blank('/v2/fake/backups/%s/verify' % backup_id)
+        req.method = 'POST'
+        req.headers['Content-Type'] = content_type
+        req.body = body
+        res = req.get_response(fakes.wsgi_app())
+        return res, verified, backup_id
+
+    def test_verify_backup_json(self):
+        res, verified, backup_id = self._verify(
+            '{"verify": {"decompress": "true"}}')
+        self.assertEqual(res.status_int, 202)
+        self.assertEqual(verified, [(backup_id, True)])
+        self.assertEqual(self._get_backup_attrib(backup_id, 'status'),
+                         'verifying')
+
+    def test_verify_backup_xml(self):
+        res, verified, backup_id = self._verify(
+            '<verify/>', content_type='application/xml')
+        self.assertEqual(res.status_int, 202)
+        self.assertEqual(verified, [(backup_id, False)])
+
+    def test_verify_backup_with_invalid_backup(self):
+        res, verified, backup_id = self._verify('{"verify": {}}',
+                                                status='creating')
+        self.assertEqual(res.status_int, 400)
+        self.assertEqual(verified, [])
+
+    def test_verify_backup_with_bad_body(self):
+        res, verified, backup_id = self._verify('{"restore": {}}')
+        self.assertEqual(res.status_int, 400)
+        self.assertEqual(verified, [])
+
     def test_restore_backup_volume_id_specified_xml(self):
         backup_id = self._create_backup(status='available')
         volume_size = 2
@@ -740,7 +962,9 @@ class BackupsAPITestCase(test.TestCase):
 
         def fake_backup_api_restore_throwing_InvalidInput(cls, context,
                                                           backup_id,
-                                                          volume_id):
+                                                          volume_id,
+                                                          offset=None,
+                                                          length=None):
             msg = _("Invalid input")
             raise exception.InvalidInput(reason=msg)
 
@@ -856,7 +1080,7 @@ class BackupsAPITestCase(test.TestCase):
     def test_restore_backup_with_VolumeSizeExceedsAvailableQuota(self):
 
         def fake_backup_api_restore_throwing_VolumeSizeExceedsAvailableQuota(
-                cls, context, backup_id, volume_id):
+                cls, context, backup_id, volume_id, offset=None, length=None):
             raise exception.VolumeSizeExceedsAvailableQuota()
 
         self.stubs.Set(
@@ -890,7 +1114,9 @@ class BackupsAPITestCase(test.TestCase):
         def fake_backup_api_restore_throwing_VolumeLimitExceeded(cls,
                                                                  context,
                                                                  backup_id,
-                                                                 volume_id):
+                                                                 volume_id,
+                                                                 offset=None,
+                                                                 length=None):
             raise exception.VolumeLimitExceeded(allowed=1)
 
         self.stubs.Set(cinder.backup.API, 'restore',
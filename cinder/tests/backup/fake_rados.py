@@ -58,6 +58,24 @@ class mock_rbd(object):
         def resize(self, *args, **kwargs):
             pass
 
+        def size(self, *args, **kwargs):
+            return 0
+
+        def discard(self, *args, **kwargs):
+            pass
+
+        def diff_iterate(self, *args, **kwargs):
+            pass
+
+        def list_snaps(self, *args, **kwargs):
+            return []
+
+        def create_snap(self, *args, **kwargs):
+            pass
+
+        def remove_snap(self, *args, **kwargs):
+            pass
+
         def close(self, *args, **kwargs):
             pass
 
@@ -72,6 +90,9 @@ class mock_rbd(object):
         def remove(self, *args, **kwargs):
             pass
 
+        def list(self, *args, **kwargs):
+            return []
+
     class ImageNotFound(Exception):
         def __init__(self, *args, **kwargs):
             pass
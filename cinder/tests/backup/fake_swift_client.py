@@ -33,13 +33,27 @@ class FakeSwiftClient(object):
     @classmethod
     def Connection(self, *args, **kargs):
         LOG.debug("fake FakeSwiftClient Connection")
-        return FakeSwiftConnection()
+        return FakeSwiftConnection(*args, **kargs)
 
 
 class FakeSwiftConnection(object):
     """Logging calls instead of executing"""
     def __init__(self, *args, **kwargs):
-        pass
+        self.authurl = kwargs.get('authurl')
+        self.url = kwargs.get('preauthurl')
+        self.token = kwargs.get('preauthtoken')
+
+    def get_auth(self):
+        LOG.debug("fake get_auth(%s)" % self.authurl)
+        return 'http://fake-swift/v1/AUTH_fake', 'fake-token'
+
+    def _retry(self, reset_func, func, *args, **kwargs):
+        LOG.debug("fake _retry(%s)" % func.__name__)
+        return func(self.url, self.token, *args, **kwargs)
+
+    def head_account(self):
+        LOG.debug("fake head_account")
+        return {}
 
     def head_container(self, container):
         LOG.debug("fake head_container(%s)" % container)
@@ -21,11 +21,16 @@ import mox
 from cinder.brick.local_dev import lvm as brick
 from cinder.openstack.common import log as logging
 from cinder.openstack.common import processutils
+from cinder.openstack.common import timeutils
 from cinder import test
 from cinder.volume import configuration as conf
 
 LOG = logging.getLogger(__name__)
 
+INVENTORY_LVS = ("  fake-volumes fake-1 1.00g owi-a-----\n"
+                 "  fake-volumes fake-2 2,00g -wi-a-----\n"
+                 "  fake-volumes snap-1 1.00g swi-a-s--- fake-1\n")
+
 
 def create_configuration():
     configuration = mox.MockObject(conf.Configuration)
@@ -126,3 +131,107 @@ class BrickLvmTestCase(test.TestCase):
 
         self.stubs.Set(processutils, 'execute', self.fake_old_lvm_version)
         self.assertFalse(self.vg.supports_thin_provisioning())
+
+    def test_lv_has_snapshot(self):
+        self.stubs.Set(self.vg.inventory, '_execute',
+                       lambda *cmd, **kwargs: (INVENTORY_LVS
+                                               if cmd[0] == 'lvs' else "",
+                                               ""))
+        self.assertTrue(self.vg.lv_has_snapshot('fake-1'))
+        self.assertFalse(self.vg.lv_has_snapshot('fake-2'))
+        self.assertFalse(self.vg.lv_has_snapshot('fake-3'))
+
+
+class LVMInventoryTestCase(test.TestCase):
+    def setUp(self):
+        super(LVMInventoryTestCase, self).setUp()
+        self.executed = []
+        self.inventory = brick.LVMInventory('fake-volumes',
+                                            executor=self.fake_execute)
+
+    def tearDown(self):
+        timeutils.clear_time_override()
+        super(LVMInventoryTestCase, self).tearDown()
+
+    def fake_execute(self, *cmd, **kwargs):
+        self.executed.append(cmd)
+        if cmd[0] == 'lvs':
+            return (INVENTORY_LVS, "")
+        return ("  fake-volumes 10.00g 6.00g\n", "")
+
+    def test_load(self):
+        timeutils.set_time_override()
+        self.assertEqual(self.inventory.get_capacity(), (10.0, 6.0))
+        self.assertEqual(self.inventory.get_volume('fake-2'),
+                         {'vg': 'fake-volumes', 'name': 'fake-2',
+                          'size': '2,00g', 'attr': '-wi-a-----',
+                          'origin': ''})
+        self.assertEqual(self.inventory.get_volume('snap-1')['origin'],
+                         'fake-1')
+        self.assertTrue(self.inventory.volume_exists('fake-1'))
+        self.assertFalse(self.inventory.volume_exists('fake-3'))
+        self.assertEqual(len(self.inventory.get_volumes()), 3)
+        self.assertEqual([cmd[0] for cmd in self.executed], ['lvs', 'vgs'])
+        self.assertEqual(self.executed[0][-1], 'fake-volumes')
+
+        timeutils.advance_time_seconds(brick.DEFAULT_INVENTORY_TTL + 1)
+        self.inventory.volume_exists('fake-1')
+        self.assertEqual(len(self.executed), 4)
+
+    def test_no_ttl(self):
+        self.inventory.ttl = 0
+        self.inventory.volume_exists('fake-1')
+        self.inventory.volume_exists('fake-1')
+        self.assertEqual(len(self.executed), 4)
+
+    def test_add_and_remove(self):
+        self.inventory.refresh()
+        self.inventory.add_volume('fake-3', '1g')
+        self.inventory.add_volume('fake-4', '512M')
+        self.assertEqual(self.inventory.get_capacity(), (10.0, 4.5))
+        self.assertTrue(self.inventory.volume_exists('fake-3'))
+        self.assertTrue(self.inventory.volume_exists('fake-4'))
+        self.assertEqual(len(self.executed), 2)
+
+        self.inventory.add_volume('thin-1', '5g', thin=True)
+        self.assertEqual(self.inventory.get_capacity(), (10.0, 4.5))
+        self.inventory.remove_volume('fake-2')
+        self.assertEqual(self.inventory.get_capacity(), (10.0, 6.5))
+        self.assertFalse(self.inventory.volume_exists('fake-2'))
+        self.assertEqual(len(self.executed), 2)
+
+    def test_snapshots(self):
+        self.inventory.refresh()
+        self.inventory.add_snapshot('snap-2', 'fake-2')
+        self.assertEqual(self.inventory.get_capacity(), (10.0, 4.0))
+        self.assertTrue(self.inventory.lv_has_snapshot('fake-2'))
+        self.assertEqual(self.inventory.get_volume('snap-2')['size'],
+                         '2.00g')
+
+        self.inventory.remove_volume('snap-2')
+        self.assertFalse(self.inventory.lv_has_snapshot('fake-2'))
+        self.inventory.rename_volume('fake-1', 'wipe-fake-1')
+        self.assertEqual(self.inventory.get_volume('snap-1')['origin'],
+                         'wipe-fake-1')
+        self.assertTrue(self.inventory.lv_has_snapshot('wipe-fake-1'))
+        self.inventory.remove_volume('snap-1')
+        self.assertFalse(self.inventory.lv_has_snapshot('wipe-fake-1'))
+        self.assertEqual(len(self.executed), 2)
+
+    def test_remove_origin_invalidates(self):
+        self.inventory.refresh()
+        self.inventory.remove_volume('fake-1')
+        self.inventory.volume_exists('snap-1')
+        self.assertEqual(len(self.executed), 4)
+
+    def test_refresh_racing_update_is_not_trusted(self):
+        def racing_execute(*cmd, **kwargs):
+            self.inventory.add_volume('fake-3', '1g')
+            return self.fake_execute(*cmd, **kwargs)
+
+        self.inventory._execute = racing_execute
+        self.assertFalse(self.inventory.volume_exists('fake-3'))
+        self.inventory._execute = self.fake_execute
+        self.assertEqual(len(self.executed), 2)
+        self.inventory.volume_exists('fake-3')
+        self.assertEqual(len(self.executed), 4)
@@ -0,0 +1,154 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for streaming volumes as qcow2 images."""
+
+
+import StringIO
+import struct
+
+from cinder.image import qcow2
+from cinder import test
+
+
+CLUSTER_SIZE = qcow2.CLUSTER_SIZE
+OFFSET_MASK = (1 << 62) - 1
+
+
+class SparseVolume(object):
+    """Volume file with data only in a few clusters."""
+
+    def __init__(self, size, clusters):
+        self.size = size
+        self.clusters = clusters
+        self.offset = 0
+
+    def seek(self, offset):
+        self.offset = offset
+
+    def read(self, length):
+        data = []
+        end = min(self.offset + length, self.size)
+        while self.offset < end:
+            cluster, start = divmod(self.offset, CLUSTER_SIZE)
+            count = min(CLUSTER_SIZE - start, end - self.offset)
+            content = self.clusters.get(cluster, '\0' * CLUSTER_SIZE)
+            data.append(content[start:start + count])
+            self.offset += count
+        return ''.join(data)
+
+
+class Qcow2ImageTestCase(test.TestCase):
+
+    def _generate(self, image, volume):
+        data = ''.join(image.chunks(volume))
+        self.assertEqual(image.image_size, len(data))
+        return data
+
+    def _entry(self, data, offset):
+        return struct.unpack('>Q', data[offset:offset + 8])[0]
+
+    def _read_guest(self, data):
+        """Decode an image produced by Qcow2Image."""
+        header = struct.unpack(qcow2.HEADER_FORMAT,
+                               data[:struct.calcsize(qcow2.HEADER_FORMAT)])
+        (magic, version, backing_offset, backing_size, cluster_bits, size,
+         crypt, l1_size, l1_offset, refcount_offset, refcount_clusters,
+         snapshots, snapshots_offset) = header
+        self.assertEqual(qcow2.QCOW_MAGIC, magic)
+        self.assertEqual(2, version)
+        self.assertEqual(0, backing_offset)
+        self.assertEqual(qcow2.CLUSTER_BITS, cluster_bits)
+
+        guest = {}
+        used = set([0])
+        used.update(range(l1_offset / CLUSTER_SIZE,
+                          (l1_offset + l1_size * 8 + CLUSTER_SIZE - 1) /
+                          CLUSTER_SIZE))
+        for l1_index in xrange(l1_size):
+            l1_entry = self._entry(data, l1_offset + l1_index * 8)
+            if not l1_entry:
+                continue
+            self.assertTrue(l1_entry & qcow2.QCOW_OFLAG_COPIED)
+            l2_offset = l1_entry & OFFSET_MASK
+            used.add(l2_offset / CLUSTER_SIZE)
+            for l2_index in xrange(qcow2.L2_ENTRIES):
+                l2_entry = self._entry(data, l2_offset + l2_index * 8)
+                if not l2_entry:
+                    continue
+                self.assertTrue(l2_entry & qcow2.QCOW_OFLAG_COPIED)
+                host = l2_entry & OFFSET_MASK
+                used.add(host / CLUSTER_SIZE)
+                guest[l1_index * qcow2.L2_ENTRIES + l2_index] = \
+                    data[host:host + CLUSTER_SIZE]
+
+        refcounts = {}
+        for block in xrange(refcount_clusters * CLUSTER_SIZE / 8):
+            block_offset = self._entry(data, refcount_offset + block * 8)
+            if not block_offset:
+                continue
+            used.add(block_offset / CLUSTER_SIZE)
+            for index in xrange(qcow2.REFCOUNTS_PER_BLOCK):
+                offset = block_offset + index * 2
+                count = struct.unpack('>H', data[offset:offset + 2])[0]
+                if count:
+                    cluster = block * qcow2.REFCOUNTS_PER_BLOCK + index
+                    refcounts[cluster] = count
+        used.update(range(refcount_offset / CLUSTER_SIZE,
+                          refcount_offset / CLUSTER_SIZE + refcount_clusters))
+
+        self.assertEqual(set(range(len(data) / CLUSTER_SIZE)), used)
+        self.assertEqual(dict((cluster, 1) for cluster in used), refcounts)
+        return size, guest
+
+    def test_round_trip(self):
+        size = 600 * 1024 * 1024 + 4096
+        last = size / CLUSTER_SIZE
+        clusters = {0: 'a' * CLUSTER_SIZE,
+                    1: 'b' * CLUSTER_SIZE,
+                    9000: 'c' * CLUSTER_SIZE,
+                    last: 'd' * 4096}
+        allocated = bytearray(last + 1)
+        for cluster in clusters:
+            allocated[cluster] = 1
+        volume = SparseVolume(size, clusters)
+
+        image = qcow2.Qcow2Image(size, allocated)
+        self.assertEqual(4, image.data_clusters)
+        self.assertEqual([0, 1], image.l2_tables)
+        guest_size, guest = self._read_guest(self._generate(image, volume))
+
+        self.assertEqual(size, guest_size)
+        self.assertEqual(sorted(clusters), sorted(guest))
+        for cluster, content in clusters.items():
+            self.assertEqual(content.ljust(CLUSTER_SIZE, '\0'),
+                             guest[cluster])
+
+    def test_from_volume_skips_zero_clusters(self):
+        volume = StringIO.StringIO('\0' * CLUSTER_SIZE + 'x' +
+                                   '\0' * (2 * CLUSTER_SIZE - 1))
+        image = qcow2.Qcow2Image.from_volume(volume, 3 * CLUSTER_SIZE)
+        self.assertEqual(bytearray('\0\x01\0'), image.allocated)
+
+        guest_size, guest = self._read_guest(self._generate(image, volume))
+        self.assertEqual(3 * CLUSTER_SIZE, guest_size)
+        self.assertEqual([1], guest.keys())
+        self.assertEqual('x', guest[1].rstrip('\0'))
+
+    def test_empty_volume(self):
+        volume = StringIO.StringIO('\0' * CLUSTER_SIZE)
+        image = qcow2.Qcow2Image.from_volume(volume, CLUSTER_SIZE)
+        guest_size, guest = self._read_guest(self._generate(image, volume))
+        self.assertEqual(CLUSTER_SIZE, guest_size)
+        self.assertEqual({}, guest)
@@ -149,6 +149,26 @@ class BackupTestCase(test.TestCase):
                           self.ctxt,
                           backup_id)
 
+    def test_create_backup_with_parent_from_other_service(self):
+        """Test error handling when creating an incremental backup whose
+        parent was made by another backup service
+        """
+        vol_id = self._create_volume_db_entry(size=1)
+        parent_id = self._create_backup_db_entry(status='available',
+                                                 volume_id=vol_id)
+        db.backup_update(self.ctxt, parent_id,
+                         {'service': 'cinder.backup.drivers.ceph'})
+        backup_id = self._create_backup_db_entry(volume_id=vol_id)
+        db.backup_update(self.ctxt, backup_id, {'parent_id': parent_id})
+        self.assertRaises(exception.InvalidBackup,
+                          self.backup_mgr.create_backup,
+                          self.ctxt,
+                          backup_id)
+        vol = db.volume_get(self.ctxt, vol_id)
+        self.assertEquals(vol['status'], 'available')
+        backup = db.backup_get(self.ctxt, backup_id)
+        self.assertEquals(backup['status'], 'error')
+
     def test_create_backup_with_error(self):
         """Test error handling when an error occurs during backup creation"""
         vol_id = self._create_volume_db_entry(size=1)
@@ -188,6 +208,29 @@ class BackupTestCase(test.TestCase):
         self.assertEquals(backup['status'], 'available')
         self.assertEqual(backup['size'], vol_size)
 
+    def test_create_backup_throttled(self):
+        """Test backups are run as throttled jobs"""
+        self.flags(backup_bandwidth_limit=1024 * 1024)
+        backup_mgr = importutils.import_object(CONF.backup_manager)
+        vol_id = self._create_volume_db_entry(size=1)
+        backup_id = self._create_backup_db_entry(volume_id=vol_id)
+        running = []
+
+        def fake_backup_volume(context, backup, backup_service):
+            running.append(backup_mgr.jobs.running)
+            self.assertTrue(isinstance(
+                backup_service,
+                importutils.import_class(
+                    'cinder.backup.jobs.ThrottledBackupDriver')))
+
+        self.stubs.Set(backup_mgr.driver, 'backup_volume',
+                       fake_backup_volume)
+
+        backup_mgr.create_backup(self.ctxt, backup_id)
+        self.assertEquals(running, [1])
+        self.assertEquals(backup_mgr.jobs.running, 0)
+        self.assertEquals(backup_mgr.bandwidth.rate, 1024 * 1024)
+
     def test_restore_backup_with_bad_volume_status(self):
         """Test error handling when restoring a backup to a volume
         with a bad status
@@ -290,6 +333,97 @@ class BackupTestCase(test.TestCase):
         backup = db.backup_get(self.ctxt, backup_id)
         self.assertEquals(backup['status'], 'available')
 
+    def _restore_backup_range(self, backup_driver):
+        vol_id = self._create_volume_db_entry(status='restoring-backup',
+                                              size=1)
+        backup_id = self._create_backup_db_entry(status='restoring',
+                                                 volume_id=vol_id)
+
+        def fake_restore_backup(context, backup, volume, backup_service):
+            backup_service.restore(backup, volume['id'], 'volume-file')
+
+        self.stubs.Set(self.backup_mgr.driver, 'restore_backup',
+                       fake_restore_backup)
+        self.stubs.Set(self.backup_mgr.service, 'get_backup_driver',
+                       lambda context: backup_driver)
+        return vol_id, backup_id
+
+    def test_restore_backup_range(self):
+        """Test restoring part of a backup"""
+        restored = []
+
+        class FakeBackupDriver(object):
+            def restore_range(self, backup, volume_id, volume_file, offset,
+                              length):
+                restored.append((volume_id, offset, length))
+
+        vol_id, backup_id = self._restore_backup_range(FakeBackupDriver())
+        self.backup_mgr.restore_backup(self.ctxt, backup_id, vol_id,
+                                       offset=4096, length=8192)
+        self.assertEquals(restored, [(vol_id, 4096, 8192)])
+        vol = db.volume_get(self.ctxt, vol_id)
+        self.assertEquals(vol['status'], 'available')
+        backup = db.backup_get(self.ctxt, backup_id)
+        self.assertEquals(backup['status'], 'available')
+
+    def test_restore_backup_range_unsupported(self):
+        """Test restoring part of a backup with a driver without support"""
+        backup_driver = importutils.import_object(
+            'cinder.backup.driver.BackupDriver')
+        vol_id, backup_id = self._restore_backup_range(backup_driver)
+        self.assertRaises(exception.InvalidBackup,
+                          self.backup_mgr.restore_backup,
+                          self.ctxt, backup_id, vol_id,
+                          offset=4096, length=8192)
+        vol = db.volume_get(self.ctxt, vol_id)
+        self.assertEquals(vol['status'], 'available')
+        backup = db.backup_get(self.ctxt, backup_id)
+        self.assertEquals(backup['status'], 'available')
+
+    def _verify_backup(self, backup_driver, decompress=False):
+        vol_id = self._create_volume_db_entry(status='available', size=1)
+        backup_id = self._create_backup_db_entry(status='verifying',
+                                                 volume_id=vol_id)
+        self.stubs.Set(self.backup_mgr.service, 'get_backup_driver',
+                       lambda context: backup_driver)
+        self.backup_mgr.verify_backup(self.ctxt, backup_id, decompress)
+        return db.backup_get(self.ctxt, backup_id)
+
+    def test_verify_backup(self):
+        """Test verifying an intact backup"""
+        verified = []
+
+        class FakeBackupDriver(object):
+            def verify(self, backup, decompress=False):
+                verified.append(decompress)
+                return {'missing': [], 'corrupt': {}}
+
+        backup = self._verify_backup(FakeBackupDriver(), decompress=True)
+        self.assertEquals(verified, [True])
+        self.assertEquals(backup['status'], 'available')
+
+    def test_verify_backup_damaged(self):
+        """Test verifying a backup with missing and corrupt objects"""
+        class FakeBackupDriver(object):
+            def verify(self, backup, decompress=False):
+                return {'missing': ['object-1'],
+                        'corrupt': {'object-2': 'bad MD5',
+                                    'object-3': 'bad MD5'}}
+
+        backup = self._verify_backup(FakeBackupDriver())
+        self.assertEquals(backup['status'], 'error')
+        self.assertEquals(backup['fail_reason'],
+                          'verify found 1 missing and 2 corrupt objects')
+
+    def test_verify_backup_unsupported(self):
+        """Test verifying a backup with a driver without support"""
+        backup_driver = importutils.import_object(
+            'cinder.backup.driver.BackupDriver')
+        self.assertRaises(exception.InvalidBackup,
+                          self._verify_backup, backup_driver)
+        backups = db.backup_get_all(self.ctxt)
+        self.assertEquals(backups[0]['status'], 'available')
+
     def test_delete_backup_with_bad_backup_status(self):
         """Test error handling when deleting a backup with a backup
         with a bad status
@@ -29,10 +29,28 @@ from cinder import db
 from cinder import exception
 from cinder.openstack.common import log as logging
 from cinder import test
+from cinder.volume.drivers import rbd as rbddriver
 
 LOG = logging.getLogger(__name__)
 
 
+class FakeRBDSource(object):
+    """A stand-in for the RBDVolumeProxy of a volume being backed up."""
+
+    def __init__(self, snaps=None):
+        self.ioctx = 'source-ioctx'
+        self.snaps = list(snaps or [])
+
+    def list_snaps(self):
+        return [{'name': snap} for snap in self.snaps]
+
+    def create_snap(self, name):
+        self.snaps.append(name)
+
+    def remove_snap(self, name):
+        self.snaps.remove(name)
+
+
 class BackupCephTestCase(test.TestCase):
     """Test Case for backup to Ceph object store"""
 
@@ -134,6 +152,117 @@ class BackupCephTestCase(test.TestCase):
             # Ensure the files are equal
             self.assertEquals(checksum.digest(), self.checksum.digest())
 
+    def _stub_aio(self, service):
+        """Give the fake rbd image asynchronous I/O.
+
+        Returns a list recording the requests and the highest number of
+        requests that were in flight at once.
+        """
+        calls = {'requests': [], 'in_flight': [], 'max_in_flight': 0}
+
+        class FakeCompletion(object):
+            def __init__(self, cb, *args):
+                self.cb = cb
+                self.args = args
+                self.polls = 0
+                calls['in_flight'].append(self)
+                calls['max_in_flight'] = max(calls['max_in_flight'],
+                                             len(calls['in_flight']))
+
+            def is_complete(self):
+                # Complete on the second poll so the wait has to yield
+                self.polls += 1
+                return self.polls > 1
+
+            def wait_for_complete_and_cb(self):
+                if self in calls['in_flight']:
+                    calls['in_flight'].remove(self)
+                    self.cb(self, *self.args)
+
+            def get_return_value(self):
+                return 0
+
+        def aio_write(inst, data, offset, cb):
+            calls['requests'].append(('write', offset, data))
+            return FakeCompletion(cb)
+
+        def aio_read(inst, offset, length, cb):
+            calls['requests'].append(('read', offset, length))
+            self.volume_file.seek(offset)
+            return FakeCompletion(cb, self.volume_file.read(length))
+
+        # The fake image has no asynchronous I/O by default
+        for name, func in (('aio_write', aio_write), ('aio_read', aio_read)):
+            setattr(service.rbd.Image, name, func)
+            self.addCleanup(delattr, service.rbd.Image, name)
+        self.stubs.Set(service, 'AIO_POLL_INTERVAL', 0)
+        service.chunk_size = self.chunk_size
+        service.queue_depth = 3
+        return calls
+
+    def test_transfer_data_to_rbd_aio(self):
+        service = CephBackupDriver(self.ctxt)
+        calls = self._stub_aio(service)
+
+        service._transfer_data(self.volume_file, service.rbd.Image(), 'foo',
+                               self.length, dest_is_rbd=True)
+
+        checksum = hashlib.sha256()
+        for op, offset, data in calls['requests']:
+            checksum.update(data)
+        self.assertEquals(checksum.digest(), self.checksum.digest())
+        self.assertEquals([offset for op, offset, data in calls['requests']],
+                          range(0, self.length, self.chunk_size))
+        self.assertEquals(calls['max_in_flight'], 3)
+        self.assertEquals(calls['in_flight'], [])
+
+    def test_transfer_data_to_rbd_skips_zero_chunks(self):
+        service = CephBackupDriver(self.ctxt)
+        calls = self._stub_aio(service)
+
+        with tempfile.NamedTemporaryFile() as test_file:
+            test_file.write('\0' * self.chunk_size)
+            test_file.write('\1' * self.chunk_size)
+            test_file.write('\0' * (self.chunk_size / 2))
+            test_file.seek(0)
+            service._transfer_data(test_file, service.rbd.Image(), 'foo',
+                                   self.chunk_size * 5 / 2, dest_is_rbd=True)
+
+        self.assertEquals(calls['requests'],
+                          [('write', self.chunk_size, '\1' * self.chunk_size)])
+
+    def test_transfer_data_from_rbd_aio(self):
+        service = CephBackupDriver(self.ctxt)
+        calls = self._stub_aio(service)
+
+        with tempfile.NamedTemporaryFile() as test_file:
+            service._transfer_data(service.rbd.Image(), test_file, 'foo',
+                                   self.length)
+
+            checksum = hashlib.sha256()
+            test_file.seek(0)
+            checksum.update(test_file.read())
+            self.assertEquals(checksum.digest(), self.checksum.digest())
+
+        self.assertEquals(len(calls['requests']), self.num_chunks)
+        self.assertEquals(calls['max_in_flight'], 3)
+
+    def test_transfer_data_aio_error(self):
+        service = CephBackupDriver(self.ctxt)
+        calls = self._stub_aio(service)
+        self.stubs.Set(service, '_wait_for_aio', self._raise_aio_error)
+
+        self.assertRaises(exception.BackupDriverException,
+                          service._transfer_data, self.volume_file,
+                          service.rbd.Image(), 'foo', self.length,
+                          dest_is_rbd=True)
+        # Requests still in flight are waited for before giving up
+        self.assertEquals(calls['in_flight'], [])
+
+    def _raise_aio_error(self, completion):
+        completion.wait_for_complete_and_cb()
+        raise exception.BackupDriverException(reason='fake')
+
     def test_backup_volume_from_file(self):
         service = CephBackupDriver(self.ctxt)
 
@@ -152,6 +281,126 @@ class BackupCephTestCase(test.TestCase):
             # Ensure the files are equal
             self.assertEquals(checksum.digest(), self.checksum.digest())
 
+    def _stub_base_image(self, snaps):
+        """Make the base image exist with the given snapshots.
+
+        Returns a dict recording what happens to the fake rbd images.
+        """
+        base_name = 'volume-%s.backup.base' % (self.vol_id)
+        calls = {'open': [], 'write': [], 'discard': [], 'diff': [],
+                 'snaps': list(snaps), 'removed': []}
+
+        def fake_list(inst, ioctx):
+            return [base_name]
+
+        def fake_init(inst, ioctx, name, snapshot=None, read_only=False):
+            inst.name = name
+            calls['open'].append((ioctx, name, snapshot))
+
+        def fake_list_snaps(inst):
+            return [{'name': snap} for snap in calls['snaps']]
+
+        def fake_create_snap(inst, name):
+            calls['snaps'].append(name)
+
+        def fake_remove_snap(inst, name):
+            calls['snaps'].remove(name)
+
+        def fake_remove(inst, ioctx, name):
+            calls['removed'].append(name)
+
+        def fake_write(inst, data, offset):
+            calls['write'].append((offset, len(data)))
+
+        def fake_discard(inst, offset, length):
+            calls['discard'].append((offset, length))
+
+        def fake_diff_iterate(inst, offset, length, from_snap, cb):
+            calls['diff'].append(from_snap)
+            cb(0, 2048, True)
+            cb(4096, 1024, False)
+
+        self.stubs.Set(mock_rbd.RBD, 'list', fake_list)
+        self.stubs.Set(mock_rbd.RBD, 'remove', fake_remove)
+        self.stubs.Set(mock_rbd.Image, '__init__', fake_init)
+        self.stubs.Set(mock_rbd.Image, 'list_snaps', fake_list_snaps)
+        self.stubs.Set(mock_rbd.Image, 'create_snap', fake_create_snap)
+        self.stubs.Set(mock_rbd.Image, 'remove_snap', fake_remove_snap)
+        self.stubs.Set(mock_rbd.Image, 'size', lambda inst: self.length)
+        self.stubs.Set(mock_rbd.Image, 'read',
+                       lambda inst, offset, length: '\1' * length)
+        self.stubs.Set(mock_rbd.Image, 'write', fake_write)
+        self.stubs.Set(mock_rbd.Image, 'discard', fake_discard)
+        self.stubs.Set(mock_rbd.Image, 'diff_iterate', fake_diff_iterate)
+        return calls
+
+    def test_backup_rbd_differential(self):
+        service = CephBackupDriver(self.ctxt)
+        backup = db.backup_get(self.ctxt, self.backup_id)
+        self._create_volume_db_entry(self.vol_id, 1)
+        old_snap = 'backup.old.snap.1381000000.0'
+        calls = self._stub_base_image([old_snap])
+        source = FakeRBDSource([old_snap])
+
+        service.backup(backup, rbddriver.RBDImageIOWrapper(source))
+
+        self.assertEquals(calls['diff'], [old_snap])
+        self.assertEquals(calls['write'], [(0, 2048)])
+        self.assertEquals(calls['discard'], [(4096, 1024)])
+        self.assertEquals(len(source.snaps), 1)
+        new_snap = source.snaps[0]
+        self.assertTrue(new_snap.startswith('backup.%s.snap.' %
+                                            self.backup_id))
+        self.assertEquals(calls['snaps'], [old_snap, new_snap])
+        self.assertTrue(('source-ioctx', 'volume-%s' % self.vol_id,
+                         new_snap) in calls['open'])
+
+    def test_backup_rbd_no_common_snapshot(self):
+        service = CephBackupDriver(self.ctxt)
+        backup = db.backup_get(self.ctxt, self.backup_id)
+        self._create_volume_db_entry(self.vol_id, 1)
+        calls = self._stub_base_image(['backup.old.snap.1381000000.0'])
+        source = FakeRBDSource()
+
+        service.backup(backup, rbddriver.RBDImageIOWrapper(source))
+
+        # The whole base image is cleared then every extent copied
+        self.assertEquals(calls['diff'], [None])
+        self.assertEquals(calls['discard'], [(0, self.length),
+                                             (4096, 1024)])
+        self.assertEquals(len(calls['snaps']), 2)
+
+    def test_restore_differential(self):
+        service = CephBackupDriver(self.ctxt)
+        self._create_volume_db_entry(self.vol_id, 1)
+        backup = db.backup_get(self.ctxt, self.backup_id)
+        snap = 'backup.%s.snap.1381000000.0' % (self.backup_id)
+        calls = self._stub_base_image([snap])
+
+        with tempfile.NamedTemporaryFile() as test_file:
+            service.restore(backup, self.vol_id, test_file)
+
+        self.assertEquals(calls['open'][-1][1:],
+                          ('volume-%s.backup.base' % (self.vol_id), snap))
+
+    def test_delete_differential(self):
+        service = CephBackupDriver(self.ctxt)
+        self._create_volume_db_entry(self.vol_id, 1)
+        backup = db.backup_get(self.ctxt, self.backup_id)
+        snap = 'backup.%s.snap.1381000000.0' % (self.backup_id)
+        other = 'backup.other.snap.1381000001.0'
+        calls = self._stub_base_image([snap, other])
+
+        service.delete(backup)
+        self.assertEquals(calls['snaps'], [other])
+        self.assertEquals(calls['removed'], [])
+
+        calls['snaps'].remove(other)
+        calls['snaps'].append(snap)
+        service.delete(backup)
+        self.assertEquals(calls['removed'],
+                          ['volume-%s.backup.base' % (self.vol_id)])
+
     def tearDown(self):
         self.volume_file.close()
         super(BackupCephTestCase, self).tearDown()
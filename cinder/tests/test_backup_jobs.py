@@ -0,0 +1,147 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for the scheduling and throttling of backup jobs.
+
+"""
+
+import StringIO
+
+import eventlet
+
+from cinder.backup import jobs
+from cinder import test
+
+
+class FakeBucket(object):
+    def __init__(self):
+        self.consumed = []
+
+    def consume(self, amount):
+        self.consumed.append(amount)
+
+
+class FakeBackupDriver(object):
+    def __init__(self):
+        self.marker = 'fake'
+
+    def backup(self, backup, volume_file):
+        while volume_file.read(4):
+            pass
+
+    def restore(self, backup, volume_id, volume_file):
+        volume_file.write('restored')
+
+
+class JobQueueTestCase(test.TestCase):
+    """Test Case for the backup job queue."""
+
+    def test_unlimited(self):
+        queue = jobs.JobQueue()
+        for i in xrange(10):
+            self.assertEquals(queue.acquire(jobs.PRIORITY_BACKUP), 0)
+        self.assertEquals(queue.running, 10)
+        self.assertEquals(queue.depth, 0)
+
+    def test_restores_before_backups(self):
+        queue = jobs.JobQueue(1)
+        started = []
+
+        def run(name, priority):
+            with queue.job(name, priority):
+                started.append(name)
+                eventlet.sleep(0)
+
+        queue.acquire(jobs.PRIORITY_BACKUP)
+        pool = eventlet.GreenPool()
+        pool.spawn(run, 'backup1', jobs.PRIORITY_BACKUP)
+        pool.spawn(run, 'backup2', jobs.PRIORITY_BACKUP)
+        pool.spawn(run, 'restore', jobs.PRIORITY_RESTORE)
+        eventlet.sleep(0)
+        self.assertEquals(queue.depth, 3)
+        self.assertEquals(started, [])
+
+        queue.release()
+        pool.waitall()
+        self.assertEquals(started, ['restore', 'backup1', 'backup2'])
+        self.assertEquals(queue.running, 0)
+
+    def test_release_on_error(self):
+        queue = jobs.JobQueue(1)
+
+        def fail():
+            with queue.job('job', jobs.PRIORITY_BACKUP):
+                raise ValueError()
+
+        self.assertRaises(ValueError, fail)
+        self.assertEquals(queue.running, 0)
+
+    def test_killed_waiter(self):
+        queue = jobs.JobQueue(1)
+        started = []
+
+        def run(name):
+            with queue.job(name, jobs.PRIORITY_BACKUP):
+                started.append(name)
+
+        queue.acquire(jobs.PRIORITY_BACKUP)
+        killed = eventlet.spawn(run, 'killed')
+        waiter = eventlet.spawn(run, 'waiter')
+        eventlet.sleep(0)
+        self.assertEquals(queue.depth, 2)
+
+        killed.kill()
+        self.assertEquals(queue.depth, 1)
+        queue.release()
+        waiter.wait()
+        self.assertEquals(started, ['waiter'])
+        self.assertEquals(queue.running, 0)
+
+    def test_waiter_killed_after_wakeup(self):
+        queue = jobs.JobQueue(1)
+        started = []
+
+        def run(name):
+            with queue.job(name, jobs.PRIORITY_BACKUP):
+                started.append(name)
+
+        queue.acquire(jobs.PRIORITY_BACKUP)
+        killed = eventlet.spawn(run, 'killed')
+        eventlet.sleep(0)
+        queue.release()
+        self.assertEquals(queue.running, 1)
+
+        killed.kill()
+        self.assertEquals(started, [])
+        self.assertEquals(queue.running, 0)
+        self.assertEquals(queue.depth, 0)
+
+
+class ThrottledBackupDriverTestCase(test.TestCase):
+    """Test Case for the throttled backup driver wrapper."""
+
+    def test_backup(self):
+        bucket = FakeBucket()
+        driver = jobs.ThrottledBackupDriver(FakeBackupDriver(), bucket)
+        driver.backup({}, StringIO.StringIO('0123456789'))
+        self.assertEquals(driver.bytes_transferred, 10)
+        self.assertEquals(bucket.consumed, [4, 4, 2])
+        self.assertEquals(driver.marker, 'fake')
+
+    def test_restore(self):
+        driver = jobs.ThrottledBackupDriver(FakeBackupDriver())
+        volume_file = StringIO.StringIO()
+        driver.restore({}, 'volume', volume_file)
+        self.assertEquals(driver.bytes_transferred, 8)
+        self.assertEquals(volume_file.getvalue(), 'restored')
@@ -0,0 +1,250 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for Backup posix code.
+
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+from cinder.backup import chunkeddriver
+from cinder.backup.drivers.posix import PosixBackupDriver
+from cinder.backup.drivers.posix import PosixObjectStore
+from cinder import context
+from cinder import db
+from cinder import exception
+from cinder.openstack.common import log as logging
+from cinder import test
+
+
+LOG = logging.getLogger(__name__)
+
+
+class BackupPosixTestCase(test.TestCase):
+    """Test Case for posix."""
+
+    def _create_volume_db_entry(self):
+        vol = {'id': '1234-5678-1234-8888',
+               'size': 1,
+               'status': 'available'}
+        return db.volume_create(self.ctxt, vol)['id']
+
+    def _create_backup_db_entry(self, container='test-container',
+                                backup_id=123):
+        backup = {'id': backup_id,
+                  'size': 1,
+                  'container': container,
+                  'volume_id': '1234-5678-1234-8888'}
+        return db.backup_create(self.ctxt, backup)['id']
+
+    def setUp(self):
+        super(BackupPosixTestCase, self).setUp()
+        self.ctxt = context.get_admin_context()
+        self.backup_path = tempfile.mkdtemp()
+        self.flags(backup_posix_path=self.backup_path)
+        self.flags(backup_posix_object_size=8 * 1024)
+
+        self._create_volume_db_entry()
+        self.volume_file = tempfile.NamedTemporaryFile()
+        for i in xrange(0, 16):
+            self.volume_file.write(os.urandom(1024))
+        self.volume_file.write('\0' * 16 * 1024)
+        for i in xrange(0, 4):
+            self.volume_file.write('compressible' * 1024)
+        self.volume_file.flush()
+
+    def tearDown(self):
+        self.volume_file.close()
+        shutil.rmtree(self.backup_path)
+        super(BackupPosixTestCase, self).tearDown()
+
+    def _backup(self, container='test-container'):
+        self._create_backup_db_entry(container=container)
+        service = PosixBackupDriver(self.ctxt)
+        self.volume_file.seek(0)
+        service.backup(db.backup_get(self.ctxt, 123), self.volume_file)
+        return service, db.backup_get(self.ctxt, 123)
+
+    def _backup_files(self):
+        return sorted(os.path.join(root, filename)[len(self.backup_path):]
+                      for root, dirs, files in os.walk(self.backup_path)
+                      for filename in files)
+
+    def _restore(self, service, backup):
+        with tempfile.NamedTemporaryFile() as restored:
+            service.restore(backup, '1234-5678-1234-8888', restored)
+            restored.seek(0)
+            return restored.read()
+
+    def test_backup_restore(self):
+        service, backup = self._backup()
+        files = self._backup_files()
+        # 8 data objects and the metadata, the 2 holes have no object
+        self.assertEquals(len(files), 9)
+        for path in files:
+            parts = path.split('/')
+            self.assertEquals(parts[1], 'test-container')
+            self.assertEquals(len(parts[2]), 2)
+            self.assertEquals(len(parts[3]), 2)
+            self.assertEquals(parts[4], 'volume_1234-5678-1234-8888')
+
+        self.volume_file.seek(0)
+        self.assertEquals(self._restore(service, backup),
+                          self.volume_file.read())
+
+    def test_backup_restore_uncompressed(self):
+        self.flags(backup_compression_algorithm='none')
+        self.flags(backup_posix_restore_depth=4)
+        service, backup = self._backup()
+        metadata = json.loads(service.conn.get_object(
+            'test-container', backup['service_metadata'] + '_metadata')[1])
+        self.assertEquals(set(obj.values()[0]['compression']
+                              for obj in metadata['objects']), set(['none']))
+        self.volume_file.seek(0)
+        self.assertEquals(self._restore(service, backup),
+                          self.volume_file.read())
+
+    def test_uncompressed_objects_are_streamed(self):
+        self.flags(backup_compression_algorithm='none')
+        self.flags(backup_posix_sparse=False)
+        block_size = chunkeddriver.WRITE_BLOCK_SIZE
+        self.stubs.Set(chunkeddriver, 'WRITE_BLOCK_SIZE', 1024)
+        copy_lengths = []
+        copyfileobj = shutil.copyfileobj
+
+        def fake_copyfileobj(fsrc, fdst, length):
+            copy_lengths.append(length)
+            copyfileobj(fsrc, fdst, length)
+
+        self.stubs.Set(shutil, 'copyfileobj', fake_copyfileobj)
+        service, backup = self._backup()
+        self.assertEquals(set(copy_lengths), set([block_size]))
+
+        get_object = PosixObjectStore.get_object
+
+        def fake_get_object(store, container, name):
+            self.assertTrue(name.endswith('_metadata'))
+            return get_object(store, container, name)
+
+        self.stubs.Set(PosixObjectStore, 'get_object', fake_get_object)
+        write_sizes = []
+        with tempfile.NamedTemporaryFile() as restored:
+            write = restored.write
+
+            def fake_write(data):
+                write_sizes.append(len(data))
+                write(data)
+
+            restored.write = fake_write
+            service.restore(backup, '1234-5678-1234-8888', restored)
+            restored.seek(0)
+            data = restored.read()
+        self.volume_file.seek(0)
+        self.assertEquals(data, self.volume_file.read())
+        self.assertEquals(set(write_sizes), set([1024]))
+
+    def test_restore_range(self):
+        self.flags(backup_posix_restore_depth=2)
+        service, backup = self._backup()
+        self.volume_file.seek(0)
+        original = self.volume_file.read()
+        # From the middle of the random data, across the holes, into the
+        # compressible data.
+        offset, length = 5000, 40000
+        with tempfile.NamedTemporaryFile() as restored:
+            restored.write('\xff' * len(original))
+            restored.flush()
+            service.restore_range(backup, '1234-5678-1234-8888', restored,
+                                  offset, length)
+            restored.seek(0)
+            data = restored.read()
+        self.assertEquals(len(data), len(original))
+        self.assertEquals(data[:offset], '\xff' * offset)
+        self.assertEquals(data[offset:offset + length],
+                          original[offset:offset + length])
+        self.assertEquals(data[offset + length:],
+                          '\xff' * (len(original) - offset - length))
+
+    def test_backup_default_container(self):
+        service, backup = self._backup(container=None)
+        self.assertEquals(backup['container'], 'backups')
+        self.assertTrue(os.path.isdir(os.path.join(self.backup_path,
+                                                   'backups')))
+
+    def test_backup_container_traversal(self):
+        outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside)
+        os.symlink(outside, os.path.join(self.backup_path, 'link'))
+        for container in ['', '.', '..', '../escape', 'a/b', outside,
+                          'link']:
+            self.assertRaises(exception.InvalidBackup,
+                              PosixObjectStore(self.backup_path).put_container,
+                              container)
+        self.assertEquals(sorted(os.listdir(self.backup_path)), ['link'])
+        self.assertEquals(os.listdir(outside), [])
+        self.assertFalse(os.path.exists(os.path.join(
+            os.path.dirname(self.backup_path), 'escape')))
+
+    def test_restore_missing_object(self):
+        service, backup = self._backup()
+        os.unlink(os.path.join(self.backup_path,
+                               self._backup_files()[0].lstrip('/')))
+        with tempfile.NamedTemporaryFile() as restored:
+            self.assertRaises(exception.InvalidBackup,
+                              service.restore,
+                              backup, '1234-5678-1234-8888', restored)
+
+    def test_delete(self):
+        service, backup = self._backup()
+        service.delete(backup)
+        self.assertEquals(self._backup_files(), [])
+        self.assertEquals(os.listdir(self.backup_path), ['test-container'])
+
+    def test_object_size_aligned(self):
+        self.flags(backup_posix_object_size=5000)
+        service = PosixBackupDriver(self.ctxt)
+        self.assertEquals(service.data_block_size_bytes % 4096, 0)
+        self.assertTrue(service.data_block_size_bytes >= 5000)
+
+    def _object_path(self):
+        return os.path.join(self.backup_path,
+                            [path for path in self._backup_files()
+                             if not path.endswith('_metadata')][0][1:])
+
+    def test_verify(self):
+        self.flags(backup_posix_restore_depth=3)
+        service, backup = self._backup()
+        self.assertEquals(service.verify(backup, decompress=True),
+                          {'missing': [], 'corrupt': {}})
+
+    def test_verify_corrupt_object(self):
+        service, backup = self._backup()
+        path = self._object_path()
+        with open(path, 'r+b') as f:
+            f.write('corrupt')
+        result = service.verify(backup)
+        self.assertEquals(result['missing'], [])
+        self.assertEquals(result['corrupt'].keys(),
+                          [path[path.index('volume_'):]])
+
+    def test_verify_missing_object(self):
+        service, backup = self._backup()
+        path = self._object_path()
+        os.unlink(path)
+        result = service.verify(backup, decompress=True)
+        self.assertEquals(result['missing'], [path[path.index('volume_'):]])
+        self.assertEquals(result['corrupt'], {})
@@ -19,12 +19,19 @@ Tests for Backup swift code.
 
 import bz2
 import hashlib
+import itertools
+import json
 import os
+import socket
 import tempfile
+import time
+import urlparse
 import zlib
 
+import eventlet
 from swiftclient import client as swift
 
+from cinder.backup.drivers import swift as swift_driver
 from cinder.backup.drivers.swift import SwiftBackupDriver
 from cinder import context
 from cinder import db
@@ -32,6 +39,7 @@ from cinder import exception
 from cinder.openstack.common import log as logging
 from cinder import test
 from cinder.tests.backup.fake_swift_client import FakeSwiftClient
+from cinder.tests.backup.fake_swift_client import FakeSwiftConnection
 
 
 LOG = logging.getLogger(__name__)
@@ -55,11 +63,13 @@ class BackupSwiftTestCase(test.TestCase):
                'status': 'available'}
         return db.volume_create(self.ctxt, vol)['id']
 
-    def _create_backup_db_entry(self, container='test-container'):
-        backup = {'id': 123,
+    def _create_backup_db_entry(self, container='test-container',
+                                backup_id=123, parent_id=None):
+        backup = {'id': backup_id,
                   'size': 1,
                   'container': container,
-                  'volume_id': '1234-5678-1234-8888'}
+                  'volume_id': '1234-5678-1234-8888',
+                  'parent_id': parent_id}
         return db.backup_create(self.ctxt, backup)['id']
 
     def setUp(self):
@@ -68,6 +78,9 @@ class BackupSwiftTestCase(test.TestCase):
 
         self.stubs.Set(swift, 'Connection', FakeSwiftClient.Connection)
         self.stubs.Set(hashlib, 'md5', fake_md5)
+        self.stubs.Set(swift_driver, '_POOL', None)
+        self.stubs.Set(swift_driver, '_get_capabilities', lambda url: {})
+        self.stubs.Set(SwiftBackupDriver, 'DELETE_RETRY_BACKOFF', 0)
 
         self._create_volume_db_entry()
         self.volume_file = tempfile.NamedTemporaryFile()
@@ -121,6 +134,279 @@ class BackupSwiftTestCase(test.TestCase):
         backup = db.backup_get(self.ctxt, 123)
         self.assertEquals(backup['container'], container_name)
 
+    def test_backup_pipelined(self):
+        self._create_backup_db_entry()
+        self.flags(backup_swift_object_size=8 * 1024)
+        self.flags(backup_swift_pipeline_depth=4)
+        service = SwiftBackupDriver(self.ctxt)
+
+        # Finish uploads out of order and track how many are in flight.
+        delays = itertools.cycle([0.03, 0.01, 0.02, 0])
+        in_flight = {'now': 0, 'max': 0}
+        real_put_object = FakeSwiftConnection.put_object
+
+        def slow_put_object(conn, container, name, reader, **kwargs):
+            in_flight['now'] += 1
+            in_flight['max'] = max(in_flight['max'], in_flight['now'])
+            eventlet.sleep(delays.next())
+            in_flight['now'] -= 1
+            return real_put_object(conn, container, name, reader, **kwargs)
+
+        written = []
+
+        def fake_write_metadata(backup, volume_id, container, object_list):
+            written.extend(object_list)
+
+        self.stubs.Set(FakeSwiftConnection, 'put_object', slow_put_object)
+        self.stubs.Set(service, '_write_metadata', fake_write_metadata)
+        self.volume_file.seek(0)
+        backup = db.backup_get(self.ctxt, 123)
+        service.backup(backup, self.volume_file)
+
+        self.assertEquals(in_flight['max'], 4)
+        names = [obj.keys()[0] for obj in written]
+        self.assertEquals(names, sorted(names))
+        offsets = [obj.values()[0]['offset'] for obj in written]
+        self.assertEquals(offsets, range(0, 128 * 1024, 8 * 1024))
+        backup = db.backup_get(self.ctxt, 123)
+        self.assertEquals(backup['object_count'], 17)
+
+    def test_backup_pipelined_wraps_socket_error(self):
+        self._create_backup_db_entry(container='socket_error_on_put')
+        self.flags(backup_swift_object_size=8 * 1024)
+        self.flags(backup_swift_pipeline_depth=4)
+        service = SwiftBackupDriver(self.ctxt)
+        self.volume_file.seek(0)
+        backup = db.backup_get(self.ctxt, 123)
+        self.assertRaises(exception.SwiftConnectionFailed,
+                          service.backup,
+                          backup, self.volume_file)
+
+    def test_backup_sparse(self):
+        self._create_backup_db_entry()
+        self.flags(backup_swift_object_size=8 * 1024)
+        service = SwiftBackupDriver(self.ctxt)
+        written = []
+
+        def fake_write_metadata(backup, volume_id, container, object_list):
+            written.extend(object_list)
+
+        uploaded = []
+        real_put_object = FakeSwiftConnection.put_object
+
+        def fake_put_object(conn, container, name, reader, **kwargs):
+            uploaded.append(name)
+            return real_put_object(conn, container, name, reader, **kwargs)
+
+        self.stubs.Set(FakeSwiftConnection, 'put_object', fake_put_object)
+        self.stubs.Set(service, '_write_metadata', fake_write_metadata)
+        self.volume_file.seek(16 * 1024)
+        self.volume_file.write('\0' * 32 * 1024)
+        self.volume_file.seek(0)
+        backup = db.backup_get(self.ctxt, 123)
+        service.backup(backup, self.volume_file)
+
+        holes = [obj.keys()[0] for obj in written
+                 if obj.values()[0].get('sparse')]
+        self.assertEquals(len(written), 16)
+        self.assertEquals(len(holes), 4)
+        self.assertEquals(len(uploaded), 12)
+        self.assertFalse(set(holes) & set(uploaded))
+
+    def _backup_compression(self):
+        """Back up random data followed by text, returning the metadata."""
+        self._create_backup_db_entry()
+        self.flags(backup_swift_object_size=8 * 1024)
+        service = SwiftBackupDriver(self.ctxt)
+        written = []
+
+        def fake_write_metadata(backup, volume_id, container, object_list):
+            written.extend(object_list)
+
+        self.stubs.Set(service, '_write_metadata', fake_write_metadata)
+        self.volume_file.seek(64 * 1024)
+        self.volume_file.write(('compressible ' * 5042)[:64 * 1024])
+        self.volume_file.seek(0)
+        backup = db.backup_get(self.ctxt, 123)
+        service.backup(backup, self.volume_file)
+        return [obj.values()[0]['compression'] for obj in written]
+
+    def test_backup_adaptive_compression(self):
+        self.flags(backup_compression_adaptive=True)
+        compression = self._backup_compression()
+        self.assertEquals(compression, ['none'] * 8 + ['zlib'] * 8)
+
+    def test_backup_adaptive_compression_cpu_budget(self):
+        self.flags(backup_compression_adaptive=True)
+        self.flags(backup_compression_cpu_budget=1e-9)
+        self.volume_file.seek(0)
+        self.volume_file.write(('compressible ' * 5042)[:64 * 1024])
+        compression = self._backup_compression()
+        self.assertEquals(compression, ['zlib'] + ['none'] * 15)
+
+    def test_backup_compression_level(self):
+        self.flags(backup_compression_level=1)
+        levels = []
+        real_compress = zlib.compress
+
+        def fake_compress(data, *args):
+            levels.extend(args)
+            return real_compress(data, *args)
+
+        self.stubs.Set(zlib, 'compress', fake_compress)
+        compression = self._backup_compression()
+        self.assertEquals(compression, ['zlib'] * 16)
+        self.assertEquals(levels, [1] * 16)
+
+    def test_restore_sparse(self):
+        self._create_backup_db_entry()
+        service = SwiftBackupDriver(self.ctxt)
+        metadata = {'version': '1.1.0',
+                    'objects': [{'backup_001': {'compression': 'zlib',
+                                                'length': 1024 * 1024}},
+                                {'backup_002': {'compression': 'none',
+                                                'length': 4096,
+                                                'sparse': True}}]}
+        self.stubs.Set(service, '_read_metadata', lambda backup: metadata)
+        self.stubs.Set(service, '_generate_object_names',
+                       lambda backup: ['backup_001'])
+
+        with tempfile.NamedTemporaryFile() as volume_file:
+            volume_file.write('\1' * (1024 * 1024 + 4096))
+            volume_file.seek(0)
+            backup = db.backup_get(self.ctxt, 123)
+            service.restore(backup, '1234-5678-1234-8888', volume_file)
+            volume_file.seek(1024 * 1024)
+            self.assertEquals(volume_file.read(), '\0' * 4096)
+
+    def test_backup_incremental(self):
+        self._create_backup_db_entry()
+        self._create_backup_db_entry(backup_id=124, parent_id=123)
+        self.flags(backup_swift_object_size=8 * 1024)
+        service = SwiftBackupDriver(self.ctxt)
+        written = {}
+
+        def fake_write_metadata(backup, volume_id, container, object_list):
+            written[backup['id']] = {'version': '1.2.0',
+                                     'objects': object_list}
+
+        uploaded = []
+        real_put_object = FakeSwiftConnection.put_object
+
+        def fake_put_object(conn, container, name, reader, **kwargs):
+            uploaded.append(name)
+            return real_put_object(conn, container, name, reader, **kwargs)
+
+        self.stubs.Set(FakeSwiftConnection, 'put_object', fake_put_object)
+        self.stubs.Set(service, '_write_metadata', fake_write_metadata)
+        self.stubs.Set(service, '_read_metadata',
+                       lambda backup: written[backup['id']])
+        self.volume_file.seek(0)
+        parent = db.backup_get(self.ctxt, 123)
+        service.backup(parent, self.volume_file)
+        self.assertEquals(len(uploaded), 16)
+
+        del uploaded[:]
+        self.volume_file.seek(24 * 1024)
+        self.volume_file.write(os.urandom(1024))
+        self.volume_file.seek(0)
+        backup = db.backup_get(self.ctxt, 124)
+        service.backup(backup, self.volume_file)
+
+        objects = written[backup['id']]['objects']
+        self.assertEquals(len(objects), 16)
+        self.assertEquals(len(uploaded), 1)
+        changed = objects[3].keys()[0]
+        self.assertEquals(uploaded, [changed])
+        self.assertTrue(changed.startswith(backup['service_metadata']))
+        for obj in objects[:3] + objects[4:]:
+            self.assertEquals(obj.values()[0]['backup_id'], parent['id'])
+            self.assertTrue(obj.keys()[0].startswith(
+                parent['service_metadata']))
+
+    def test_restore_incremental(self):
+        self._create_backup_db_entry()
+        service = SwiftBackupDriver(self.ctxt)
+        metadata = {'version': '1.2.0',
+                    'objects': [{'backup_001': {'compression': 'zlib',
+                                                'length': 1024 * 1024}},
+                                {'parent_001': {'compression': 'zlib',
+                                                'length': 1024 * 1024,
+                                                'backup_id': 122}}]}
+        fetched = []
+        real_get_object = FakeSwiftConnection.get_object
+
+        def fake_get_object(conn, container, name):
+            fetched.append(name)
+            return real_get_object(conn, container, name)
+
+        self.stubs.Set(FakeSwiftConnection, 'get_object', fake_get_object)
+        self.stubs.Set(service, '_read_metadata', lambda backup: metadata)
+        self.stubs.Set(service, '_generate_object_names',
+                       lambda backup: ['backup_001'])
+
+        with tempfile.NamedTemporaryFile() as volume_file:
+            backup = db.backup_get(self.ctxt, 123)
+            service.restore(backup, '1234-5678-1234-8888', volume_file)
+            self.assertEquals(os.fstat(volume_file.fileno()).st_size,
+                              2 * 1024 * 1024)
+        self.assertEquals(fetched, ['backup_001', 'parent_001'])
+
+    def test_restore_prefetched(self):
+        self._create_backup_db_entry()
+        self.flags(backup_swift_restore_depth=4)
+        service = SwiftBackupDriver(self.ctxt)
+        names = ['backup_%03d' % i for i in xrange(8)]
+        objects = [{name: {'compression': 'zlib', 'length': 1024}}
+                   for name in names]
+        objects.insert(3, {'hole': {'compression': 'none', 'length': 1024,
+                                    'sparse': True}})
+        metadata = {'version': '1.2.0', 'objects': objects}
+
+        # Finish downloads out of order and track how many are in flight.
+        delays = itertools.cycle([0.03, 0.01, 0.02, 0])
+        in_flight = {'now': 0, 'max': 0}
+
+        def slow_get_object(conn, container, name):
+            in_flight['now'] += 1
+            in_flight['max'] = max(in_flight['max'], in_flight['now'])
+            eventlet.sleep(delays.next())
+            in_flight['now'] -= 1
+            return None, zlib.compress(name[-1] * 1024)
+
+        self.stubs.Set(FakeSwiftConnection, 'get_object', slow_get_object)
+        self.stubs.Set(service, '_read_metadata', lambda backup: metadata)
+        self.stubs.Set(service, '_generate_object_names',
+                       lambda backup: names)
+
+        with tempfile.NamedTemporaryFile() as volume_file:
+            backup = db.backup_get(self.ctxt, 123)
+            service.restore(backup, '1234-5678-1234-8888', volume_file)
+            volume_file.seek(0)
+            restored = volume_file.read()
+        self.assertEquals(in_flight['max'], 4)
+        self.assertEquals(restored, '0' * 1024 + '1' * 1024 + '2' * 1024 +
+                          '\0' * 1024 +
+                          ''.join(str(i) * 1024 for i in xrange(3, 8)))
+
+    def test_restore_prefetched_wraps_socket_error(self):
+        self._create_backup_db_entry(container='socket_error_on_get')
+        self.flags(backup_swift_restore_depth=4)
+        service = SwiftBackupDriver(self.ctxt)
+        metadata = {'version': '1.2.0',
+                    'objects': [{'backup_%03d' % i: {'compression': 'zlib',
+                                                     'length': 1024}}
+                                for i in xrange(8)]}
+        self.stubs.Set(service, '_read_metadata', lambda backup: metadata)
+        self.stubs.Set(service, '_generate_object_names',
+                       lambda backup: ['backup_%03d' % i for i in xrange(8)])
+
+        with tempfile.NamedTemporaryFile() as volume_file:
+            backup = db.backup_get(self.ctxt, 123)
+            self.assertRaises(exception.SwiftConnectionFailed,
+                              service.restore,
+                              backup, '1234-5678-1234-8888', volume_file)
+
     def test_create_backup_container_check_wraps_socket_error(self):
         container_name = 'socket_error_on_head'
         self._create_backup_db_entry(container=container_name)
@@ -186,6 +472,123 @@ class BackupSwiftTestCase(test.TestCase):
                           service.delete,
                           backup)
 
+    def _track_deletes(self, fail_first=False):
+        deleted = []
+        failed = set()
+        in_flight = [0, 0]
+
+        def fake_delete_object(conn, container, name):
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+            eventlet.sleep(0.01)
+            in_flight[0] -= 1
+            if fail_first and name not in failed:
+                failed.add(name)
+                raise socket.error(104, 'ECONNRESET')
+            deleted.append(name)
+
+        self.stubs.Set(FakeSwiftConnection, 'delete_object',
+                       fake_delete_object)
+        return deleted, in_flight
+
+    def test_delete_concurrent(self):
+        self.flags(backup_swift_delete_depth=2)
+        deleted, in_flight = self._track_deletes()
+        self._create_backup_db_entry()
+        service = SwiftBackupDriver(self.ctxt)
+        service.delete(db.backup_get(self.ctxt, 123))
+        self.assertEquals(sorted(deleted),
+                          ['backup_001', 'backup_002', 'backup_003'])
+        self.assertEquals(in_flight[1], 2)
+
+    def test_delete_retries_failed_objects(self):
+        deleted, in_flight = self._track_deletes(fail_first=True)
+        self._create_backup_db_entry()
+        service = SwiftBackupDriver(self.ctxt)
+        service.delete(db.backup_get(self.ctxt, 123))
+        self.assertEquals(sorted(deleted),
+                          ['backup_001', 'backup_002', 'backup_003'])
+
+    def test_delete_retries_exhausted(self):
+        self.flags(backup_object_delete_retries=0)
+        deleted, in_flight = self._track_deletes(fail_first=True)
+        self._create_backup_db_entry()
+        service = SwiftBackupDriver(self.ctxt)
+        self.assertRaises(exception.SwiftConnectionFailed,
+                          service.delete, db.backup_get(self.ctxt, 123))
+        self.assertEquals(deleted, [])
+
+    def _bulk_delete(self, fake_bulk_delete):
+        self.stubs.Set(swift_driver, '_get_capabilities',
+                       lambda url: {'bulk_delete':
+                                    {'max_deletes_per_request': 2}})
+        self.stubs.Set(swift_driver, '_bulk_delete', fake_bulk_delete)
+        deleted, in_flight = self._track_deletes()
+        self._create_backup_db_entry()
+        service = SwiftBackupDriver(self.ctxt)
+        service.delete(db.backup_get(self.ctxt, 123))
+        return deleted
+
+    def test_bulk_delete(self):
+        batches = []
+
+        def fake_bulk_delete(url, token, container, object_names):
+            batches.append(object_names)
+            return []
+
+        self.assertEquals(self._bulk_delete(fake_bulk_delete), [])
+        self.assertEquals(batches, [['backup_001', 'backup_002'],
+                                    ['backup_003']])
+
+    def test_bulk_delete_fallback(self):
+        batches = []
+
+        def fake_bulk_delete(url, token, container, object_names):
+            batches.append(object_names)
+            if 'backup_003' in object_names:
+                raise swift.ClientException('fake exception',
+                                            http_status=400)
+            # Objects the bulk delete failed to delete are retried.
+            if len(batches) == 1:
+                return object_names[:1]
+            return []
+
+        self.assertEquals(self._bulk_delete(fake_bulk_delete), ['backup_003'])
+        self.assertEquals(batches, [['backup_001', 'backup_002'],
+                                    ['backup_003'],
+                                    ['backup_001']])
+
+    def test_bulk_delete_request(self):
+        class FakeResponse(object):
+            status = 200
+            reason = 'OK'
+
+            def read(self):
+                return json.dumps({'Response Status': '502 Bad Gateway',
+                                   'Number Deleted': 1,
+                                   'Errors': [['/c/volume%201/obj_2',
+                                               '409 Conflict']]})
+
+        class FakeHTTPConnection(object):
+            def request(self, method, path, body, headers):
+                self.requested = (method, path, body.split('\n'),
+                                  headers['X-Auth-Token'])
+
+            def getresponse(self):
+                return FakeResponse()
+
+        http_conn = FakeHTTPConnection()
+        parsed = urlparse.urlparse('http://fake-swift/v1/AUTH_fake')
+        failed = swift_driver._bulk_delete(
+            'http://fake-swift/v1/AUTH_fake', 'fake-token', 'c',
+            ['volume 1/obj_1', 'volume 1/obj_2'],
+            http_conn=(parsed, http_conn))
+        self.assertEquals(failed, ['volume 1/obj_2'])
+        self.assertEquals(http_conn.requested,
+                          ('POST', '/v1/AUTH_fake?bulk-delete',
+                           ['/c/volume%201/obj_1', '/c/volume%201/obj_2'],
+                           'fake-token'))
+
     def test_get_compressor(self):
         service = SwiftBackupDriver(self.ctxt)
         compressor = service._get_compressor('None')
@@ -205,3 +608,97 @@ class BackupSwiftTestCase(test.TestCase):
         self.assertRaises(swift.ClientException,
                           service._check_container_exists,
                           'unauthorized_container')
+
+    def _count_connections(self):
+        created = []
+
+        def fake_connection(*args, **kwargs):
+            created.append(kwargs)
+            return FakeSwiftConnection(*args, **kwargs)
+
+        self.stubs.Set(swift, 'Connection', fake_connection)
+        return created
+
+    def test_connections_reused(self):
+        created = self._count_connections()
+        self._create_backup_db_entry()
+        for i in range(2):
+            service = SwiftBackupDriver(self.ctxt)
+            self.volume_file.seek(0)
+            service.backup(db.backup_get(self.ctxt, 123), self.volume_file)
+            service.delete(db.backup_get(self.ctxt, 123))
+        self.assertEquals(len(created), 1)
+
+    def test_connections_per_token(self):
+        created = self._count_connections()
+        for token in ('token-1', 'token-2', 'token-1'):
+            ctxt = context.RequestContext('fake', 'fake', auth_token=token)
+            SwiftBackupDriver(ctxt).conn.head_container('fake_container')
+        self.assertEquals([kwargs['preauthtoken'] for kwargs in created],
+                          ['token-1', 'token-2'])
+
+    def test_connections_unpooled(self):
+        self.flags(backup_swift_pool_size=0)
+        created = self._count_connections()
+        service = SwiftBackupDriver(self.ctxt)
+        service.conn.head_container('fake_container')
+        service.conn.head_container('fake_container')
+        self.assertEquals(len(created), 2)
+
+    def test_single_user_token_shared(self):
+        self.flags(backup_swift_auth='single_user')
+        self.flags(backup_swift_user='swift-user')
+        self.flags(backup_swift_token_ttl=600)
+        now = [1000.0]
+        self.stubs.Set(time, 'time', lambda: now[0])
+        tokens = itertools.count()
+
+        def fake_get_auth(conn):
+            return 'http://fake-swift/v1/AUTH_fake', 'token-%d' % tokens.next()
+
+        self.stubs.Set(FakeSwiftConnection, 'get_auth', fake_get_auth)
+        conn = SwiftBackupDriver(self.ctxt).conn
+        with conn.item() as conn1:
+            with conn.item() as conn2:
+                self.assertNotEqual(conn1, conn2)
+                self.assertEquals(conn1.token, 'token-0')
+                self.assertEquals(conn2.token, 'token-0')
+
+        # The token is refreshed once it is older than the TTL.
+        now[0] += 601
+        with conn.item() as conn3:
+            self.assertEquals(conn3.token, 'token-1')
+            # A token a connection obtained itself after a 401 is shared.
+            conn3.token = 'token-2'
+        with conn.item() as conn4:
+            with conn.item() as conn5:
+                self.assertEquals(conn4.token, 'token-2')
+                self.assertEquals(conn5.token, 'token-2')
+
+    def test_idle_connection_checked(self):
+        self.flags(backup_swift_pool_check_interval=30)
+        now = [1000.0]
+        self.stubs.Set(time, 'time', lambda: now[0])
+        conn = SwiftBackupDriver(self.ctxt).conn
+        with conn.item() as conn1:
+            pass
+        now[0] += 10
+        with conn.item() as conn2:
+            self.assertEquals(conn1, conn2)
+
+        def fake_head_account(conn):
+            raise socket.error(111, 'ECONNREFUSED')
+
+        self.stubs.Set(FakeSwiftConnection, 'head_account',
+                       fake_head_account)
+        now[0] += 60
+        with conn.item() as conn3:
+            self.assertNotEqual(conn1, conn3)
+
+    def test_failed_connection_dropped(self):
+        conn = SwiftBackupDriver(self.ctxt).conn
+        self.assertRaises(socket.error, conn.get_object,
+                          'socket_error_on_get', 'backup_001')
+        self.assertRaises(swift.ClientException, conn.head_container,
+                          'missing_container')
+        self.assertEquals(len(swift_driver._POOL._idle.values()[0]), 1)
@@ -138,7 +138,8 @@ class TestBlockDeviceDriver(cinder.test.TestCase):
         self.drv.local_path(TEST_SRC).AndReturn('/dev/loop1')
         self.drv._get_device_size('/dev/loop2').AndReturn(1)
         volutils.copy_volume('/dev/loop1', dev, 2048,
-                             execute=self.drv._execute)
+                             execute=self.drv._execute,
+                             progress_callback=mox.IgnoreArg())
         self.mox.ReplayAll()
         self.assertEquals(self.drv.create_cloned_volume(TEST_VOLUME, TEST_SRC),
                           {'provider_location': 'None:3260,'
@@ -666,7 +666,8 @@ class DBAPIBackupTestCase(BaseTest):
             'service_metadata': 'metadata',
             'service': 'service',
             'size': 1000,
-            'object_count': 100}
+            'object_count': 100,
+            'parent_id': 'parent'}
         if one:
             return base_values
 
@@ -703,6 +704,11 @@ class DBAPIBackupTestCase(BaseTest):
                                               self.created[1]['project_id'])
         self._assertEqualObjects(self.created[1], byproj[0])
 
+    def test_backup_get_all_by_volume(self):
+        byvol = db.backup_get_all_by_volume(self.ctxt,
+                                            self.created[1]['volume_id'])
+        self._assertEqualListsOfObjects([self.created[1]], byvol)
+
     def test_backup_update(self):
         updated_values = self._get_values(one=True)
         update_id = self.created[1]['id']
@@ -719,3 +725,53 @@ class DBAPIBackupTestCase(BaseTest):
     def test_backup_not_found(self):
         self.assertRaises(exception.BackupNotFound, db.backup_get, self.ctxt,
                           'notinbase')
+
+
+class DBAPIImageVolumeCacheTestCase(BaseTest):
+
+    """Tests for db.api.image_volume_cache_* methods."""
+
+    def setUp(self):
+        super(DBAPIImageVolumeCacheTestCase, self).setUp()
+        now = datetime.datetime.utcnow()
+        self.created = [
+            db.image_volume_cache_create(
+                self.ctxt,
+                {'host': 'host',
+                 'image_id': 'image%d' % i,
+                 'image_checksum': 'checksum%d' % i,
+                 'size': i,
+                 'status': 'available',
+                 'last_used': now - datetime.timedelta(minutes=i)})
+            for i in range(1, 4)]
+
+    def test_image_volume_cache_get_by_image(self):
+        entry = db.image_volume_cache_get_by_image(self.ctxt, 'host',
+                                                   'image2')
+        self._assertEqualObjects(self.created[1], entry)
+        self.assertEqual(None,
+                         db.image_volume_cache_get_by_image(self.ctxt,
+                                                            'other',
+                                                            'image2'))
+
+    def test_image_volume_cache_get_all_for_host(self):
+        entries = db.image_volume_cache_get_all_for_host(self.ctxt, 'host')
+        self.assertEqual(['image3', 'image2', 'image1'],
+                         [entry['image_id'] for entry in entries])
+        self.assertFalse(db.image_volume_cache_get_all_for_host(self.ctxt,
+                                                                'other'))
+
+    def test_image_volume_cache_update(self):
+        entry = db.image_volume_cache_update(self.ctxt,
+                                             self.created[0]['id'],
+                                             {'status': 'creating'})
+        self.assertEqual('creating', entry['status'])
+        self.assertRaises(exception.ImageVolumeCacheEntryNotFound,
+                          db.image_volume_cache_update, self.ctxt,
+                          'notinbase', {})
+
+    def test_image_volume_cache_destroy(self):
+        for entry in self.created:
+            db.image_volume_cache_destroy(self.ctxt, entry['id'])
+        self.assertFalse(db.image_volume_cache_get_all_for_host(self.ctxt,
+                                                                'host'))
@@ -17,10 +17,16 @@
 """Unit tests for image utils."""
 
 import contextlib
+import hashlib
 import mox
+import os
+import shutil
+import tempfile
 import textwrap
 
+from cinder import exception
 from cinder.image import image_utils
+from cinder.image import qcow2
 from cinder import test
 from cinder import utils
 
@@ -262,3 +268,240 @@ class TestXenServerImageToCoalescedVhd(test.TestCase):
         mox.ReplayAll()
         image_utils.replace_xenserver_image_with_coalesced_vhd('image')
         mox.VerifyAll()
+
+
+class FakeImageService(object):
+    def __init__(self, checksum='abc', disk_format='qcow2', data=None):
+        self.checksum = checksum
+        self.disk_format = disk_format
+        self.data = data or []
+
+    def show(self, context, image_id):
+        return {'id': image_id, 'checksum': self.checksum,
+                'disk_format': self.disk_format, 'container_format': 'bare'}
+
+    def download(self, context, image_id, data):
+        for chunk in self.data:
+            data.write(chunk)
+
+
+class RecordingFile(object):
+    def __init__(self, f):
+        self.f = f
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append((self.f.tell(), data))
+        self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+class FakeQemuImgInfo(object):
+    def __init__(self, file_format='raw', backing_file=None):
+        self.file_format = file_format
+        self.backing_file = backing_file
+
+
+class TestImageCache(test.TestCase):
+    def setUp(self):
+        super(TestImageCache, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.flags(image_conversion_dir=self.tempdir,
+                   image_conversion_cache_size_gb=1)
+        self.cache_dir = os.path.join(self.tempdir,
+                                      image_utils.IMAGE_CACHE_DIR)
+        self.fetches = []
+
+        def fake_fetch_and_convert(context, image_service, image_id,
+                                   image_meta, dest, user_id, project_id):
+            self.fetches.append(image_id)
+            with open(dest, 'wb') as f:
+                f.write('%s-data' % image_id)
+
+        def fake_convert_image(source, dest, out_format, in_format=None):
+            self.assertEqual('raw', in_format)
+            shutil.copyfile(source, dest)
+
+        self.stubs.Set(image_utils, '_fetch_and_convert',
+                       fake_fetch_and_convert)
+        self.stubs.Set(image_utils, 'convert_image', fake_convert_image)
+        self.stubs.Set(image_utils, '_verify_raw', lambda x, y: None)
+
+    def _fetch(self, image_id, image_service=None):
+        dest = os.path.join(self.tempdir, 'dest')
+        image_utils.fetch_to_raw(None, image_service or FakeImageService(),
+                                 image_id, dest)
+        with open(dest) as f:
+            return f.read()
+
+    def _cached(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_fetch_is_cached(self):
+        self.assertEqual('image1-data', self._fetch('image1'))
+        self.assertEqual('image1-data', self._fetch('image1'))
+        self.assertEqual(['image1'], self.fetches)
+        self.assertEqual(['image1-abc.raw'], self._cached())
+
+    def test_changed_checksum_fetches_again(self):
+        self._fetch('image1')
+        self._fetch('image1', FakeImageService('def'))
+        self.assertEqual(['image1', 'image1'], self.fetches)
+
+    def test_cache_disabled(self):
+        self.flags(image_conversion_cache_size_gb=0)
+        self.assertEqual('image1-data', self._fetch('image1'))
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_prune_evicts_least_recently_used(self):
+        self.stubs.Set(image_utils.units, 'GiB', 2 * 4096)
+        for image_id in ('image1', 'image2'):
+            self._fetch(image_id)
+            path = os.path.join(self.cache_dir, '%s-abc.raw' % image_id)
+            with open(path, 'wb') as f:
+                f.write('x' * 4096)
+        os.utime(os.path.join(self.cache_dir, 'image1-abc.raw'),
+                 (1, 1))
+
+        self._fetch('image3')
+        self.assertEqual(['image2-abc.raw', 'image3-abc.raw'],
+                         self._cached())
+
+    def test_cleanup_removes_stale_downloads(self):
+        os.makedirs(self.cache_dir)
+        stale = os.path.join(self.cache_dir, 'image1-abc123.part')
+        fresh = os.path.join(self.cache_dir, 'image2-abc456.part')
+        for path in (stale, fresh):
+            open(path, 'w').close()
+        os.utime(stale, (1, 1))
+
+        image_utils.cleanup_image_cache()
+        self.assertEqual(['image2-abc456.part'], self._cached())
+
+
+class TestStreamRawImage(test.TestCase):
+    def setUp(self):
+        super(TestStreamRawImage, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.flags(image_conversion_dir=self.tempdir)
+        self.dest = os.path.join(self.tempdir, 'dest')
+        self.probes = []
+
+        def fake_qemu_img_info(path):
+            with open(path) as f:
+                self.probes.append(f.read())
+            return FakeQemuImgInfo()
+
+        self.stubs.Set(image_utils, 'qemu_img_info', fake_qemu_img_info)
+        self.stubs.Set(image_utils, 'RAW_STREAM_BLOCKSIZE', 4)
+        self.stubs.Set(image_utils, 'convert_image', self.fail)
+
+    def _image_service(self, data, checksum=None):
+        if checksum is None:
+            checksum = hashlib.md5(''.join(data)).hexdigest()
+        return FakeImageService(checksum=checksum, disk_format='raw',
+                                data=data)
+
+    def test_stream_raw_image(self):
+        data = ['ab', 'cd\0\0', '\0\0efg', 'h']
+        image_utils.fetch_to_raw(None, self._image_service(data), 'image',
+                                 self.dest)
+        with open(self.dest) as f:
+            self.assertEqual(''.join(data), f.read())
+        self.assertEqual(['abcd'], self.probes)
+
+    def _write_image(self, data, sparse):
+        with open(self.dest, 'wb') as f:
+            dest_file = RecordingFile(f)
+            writer = image_utils._RawImageWriter('image', dest_file, sparse)
+            for chunk in data:
+                writer.write(chunk)
+            writer.finish()
+        with open(self.dest) as f:
+            self.assertEqual(''.join(data), f.read())
+        return dest_file.writes
+
+    def test_raw_image_writer_skips_zero_blocks(self):
+        writes = self._write_image(['\0\0\0\0ab', 'cd\0\0\0\0'], True)
+        self.assertEqual([(4, 'abcd')], writes)
+
+    def test_raw_image_writer_writes_zero_blocks_to_devices(self):
+        writes = self._write_image(['\0\0\0\0ab', 'cd'], False)
+        self.assertEqual([(0, '\0\0\0\0'), (4, 'abcd')], writes)
+
+    def test_stream_raw_image_rejects_other_formats(self):
+        self.stubs.Set(image_utils, 'qemu_img_info',
+                       lambda path: FakeQemuImgInfo('qcow2'))
+        self.assertRaises(exception.ImageUnacceptable,
+                          image_utils.fetch_to_raw, None,
+                          self._image_service(['QFI\xfb', '0000']),
+                          'image', self.dest)
+        self.assertEqual(0, os.path.getsize(self.dest))
+
+    def test_stream_raw_image_checksum_mismatch(self):
+        self.assertRaises(exception.ImageUnacceptable,
+                          image_utils.fetch_to_raw, None,
+                          self._image_service(['abcd'], checksum='bad'),
+                          'image', self.dest)
+
+
+class TestUploadVolume(test.TestCase):
+    def setUp(self):
+        super(TestUploadVolume, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.volume_path = os.path.join(self.tempdir, 'volume')
+        with open(self.volume_path, 'wb') as f:
+            f.write('a' * 100)
+            f.truncate(4 * qcow2.CLUSTER_SIZE)
+        self.uploaded = []
+
+        def fake_update(context, image_id, image_meta, data):
+            while True:
+                chunk = data.read(1000)
+                if not chunk:
+                    break
+                self.uploaded.append(chunk)
+
+        self.image_service = FakeImageService()
+        self.image_service.update = fake_update
+        self.stubs.Set(image_utils, 'convert_image', self.fail)
+
+    def test_pipelined_reader(self):
+        reader = image_utils._PipelinedReader(iter(['abc', '', 'defg', 'h']),
+                                              depth=1)
+        self.assertEqual('ab', reader.read(2))
+        self.assertEqual('cdef', reader.read(4))
+        self.assertEqual('gh', reader.read())
+        self.assertEqual('', reader.read(1))
+
+    def test_pipelined_reader_error(self):
+        def chunks():
+            yield 'abc'
+            raise test.TestingException()
+
+        reader = image_utils._PipelinedReader(chunks())
+        self.assertEqual('abc', reader.read(3))
+        self.assertRaises(test.TestingException, reader.read, 1)
+
+    def test_upload_raw(self):
+        image_utils.upload_volume(None, self.image_service,
+                                  {'id': 'image', 'disk_format': 'raw'},
+                                  self.volume_path)
+        with open(self.volume_path) as f:
+            self.assertEqual(f.read(), ''.join(self.uploaded))
+
+    def test_upload_qcow2_is_streamed(self):
+        image_utils.upload_volume(None, self.image_service,
+                                  {'id': 'image', 'disk_format': 'qcow2'},
+                                  self.volume_path)
+        data = ''.join(self.uploaded)
+        with open(self.volume_path) as f:
+            image = qcow2.Qcow2Image.from_volume(f, 4 * qcow2.CLUSTER_SIZE)
+            self.assertEqual(''.join(image.chunks(f)), data)
+        self.assertEqual(1, image.data_clusters)
+        self.assertTrue(data.startswith('QFI\xfb'))
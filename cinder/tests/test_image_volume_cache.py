@@ -0,0 +1,198 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the image volume cache."""
+
+import eventlet
+
+from cinder import context
+from cinder import db
+from cinder import test
+from cinder import units
+from cinder.volume import image_cache
+
+
+class FakeDriver(object):
+    def __init__(self):
+        self.clones = []
+        self.copies = []
+        self.deleted = []
+
+    def create_volume(self, volume):
+        return {'provider_location': 'location-%s' % volume['id']}
+
+    def copy_image_to_volume(self, context, volume, image_service, image_id):
+        self.copies.append((volume['id'], volume['size'], image_id))
+
+    def create_cloned_volume(self, volume, src_vref):
+        self.clones.append((volume['id'], src_vref['id']))
+        return {'provider_location': 'location-%s' % volume['id']}
+
+    def delete_volume(self, volume):
+        self.deleted.append(volume['id'])
+        # Let other green threads run, as deleting a real volume would
+        eventlet.sleep(0)
+
+
+class ImageVolumeCacheTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ImageVolumeCacheTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.driver = FakeDriver()
+        self.cache = image_cache.ImageVolumeCache(db, self.driver, 'host')
+
+    def _volume(self, volume_id, size=1):
+        return {'id': volume_id, 'name': 'volume-%s' % volume_id,
+                'size': size}
+
+    def _add(self, volume_id, image_id, image_meta, size=1):
+        self.cache.add(self.context, self._volume(volume_id, size=size),
+                       image_id, image_meta, 'image_service')
+
+    def _entries(self):
+        return db.image_volume_cache_get_all_for_host(self.context, 'host')
+
+    def test_add_and_clone(self):
+        meta = {'checksum': 'abc'}
+        self._add('vol1', 'image', meta)
+        entry = db.image_volume_cache_get_by_image(self.context, 'host',
+                                                   'image')
+        self.assertEqual('available', entry['status'])
+        self.assertEqual('location-%s' % entry['id'],
+                         entry['provider_location'])
+        self.assertEqual([(entry['id'], 1, 'image')], self.driver.copies)
+        self.assertFalse(self.driver.clones)
+
+        model_update, cloned = self.cache.clone(self.context,
+                                                self._volume('vol2'),
+                                                'image', meta)
+        self.assertTrue(cloned)
+        self.assertEqual({'provider_location': 'location-vol2'},
+                         model_update)
+        self.assertEqual(('vol2', entry['id']), self.driver.clones[-1])
+
+    def test_add_is_skipped_without_checksum(self):
+        self._add('vol1', 'image', {})
+        self.assertFalse(self._entries())
+
+    def test_add_is_skipped_when_cached(self):
+        meta = {'checksum': 'abc'}
+        self._add('vol1', 'image', meta)
+        self._add('vol2', 'image', meta)
+        self.assertEqual(1, len(self._entries()))
+        self.assertEqual(1, len(self.driver.copies))
+
+    def test_add_sized_for_image(self):
+        self._add('vol1', 'image1',
+                  {'checksum': 'abc', 'virtual_size': 3 * units.GiB / 2},
+                  size=10)
+        self._add('vol2', 'image2',
+                  {'checksum': 'abc', 'disk_format': 'raw',
+                   'size': units.GiB / 2},
+                  size=10)
+        self._add('vol3', 'image3',
+                  {'checksum': 'abc', 'disk_format': 'qcow2',
+                   'size': units.GiB / 2},
+                  size=10)
+        self.assertEqual([2, 1, 10],
+                         [size for entry_id, size, image_id
+                          in self.driver.copies])
+
+    def test_concurrent_adds_cache_once(self):
+        self.cache.max_count = 1
+        self._add('vol1', 'image1', {'checksum': 'abc'})
+        pool = eventlet.GreenPool()
+        for volume_id in ('vol2', 'vol3'):
+            pool.spawn(self._add, volume_id, 'image2', {'checksum': 'abc'})
+        pool.waitall()
+        self.assertEqual(['image2'],
+                         [entry['image_id'] for entry in self._entries()])
+        self.assertEqual(2, len(self.driver.copies))
+
+    def test_clone_miss(self):
+        self.assertEqual((None, False),
+                         self.cache.clone(self.context, self._volume('vol1'),
+                                          'image', {'checksum': 'abc'}))
+        self.assertFalse(self.driver.clones)
+
+    def test_clone_smaller_volume_misses(self):
+        meta = {'checksum': 'abc'}
+        self._add('vol1', 'image', meta, size=2)
+        self.assertEqual((None, False),
+                         self.cache.clone(self.context, self._volume('vol2'),
+                                          'image', meta))
+
+    def test_changed_checksum_invalidates(self):
+        self._add('vol1', 'image', {'checksum': 'abc'})
+        entry_id = self._entries()[0]['id']
+
+        self.assertEqual((None, False),
+                         self.cache.clone(self.context, self._volume('vol2'),
+                                          'image', {'checksum': 'def'}))
+        self.assertEqual([entry_id], self.driver.deleted)
+        self.assertFalse(self._entries())
+
+    def test_count_limit_evicts_least_recently_used(self):
+        self.cache.max_count = 2
+        meta = {'checksum': 'abc'}
+        self._add('vol1', 'image1', meta)
+        self._add('vol2', 'image2', meta)
+        image1 = db.image_volume_cache_get_by_image(self.context, 'host',
+                                                    'image1')
+        image2 = db.image_volume_cache_get_by_image(self.context, 'host',
+                                                    'image2')
+        self.cache.clone(self.context, self._volume('vol3'), 'image1', meta)
+
+        self._add('vol4', 'image3', meta)
+        self.assertEqual([image2['id']], self.driver.deleted)
+        self.assertEqual(set(['image1', 'image3']),
+                         set(entry['image_id'] for entry in self._entries()))
+        self.assertTrue(db.image_volume_cache_get_by_image(self.context,
+                                                           'host',
+                                                           'image1'))
+        self.assertNotEqual(image1['last_used'],
+                            db.image_volume_cache_get_by_image(
+                                self.context, 'host',
+                                'image1')['last_used'])
+
+    def test_size_limit(self):
+        self.cache.max_size_gb = 3
+        meta = {'checksum': 'abc'}
+        self._add('vol1', 'image1', meta, size=4)
+        self.assertFalse(self._entries())
+
+        self._add('vol2', 'image2', meta, size=2)
+        self._add('vol3', 'image3', meta, size=2)
+        self.assertEqual(['image3'],
+                         [entry['image_id'] for entry in self._entries()])
+
+    def test_failed_add_is_removed(self):
+        def fail_copy(context, volume, image_service, image_id):
+            raise test.TestingException()
+
+        self.stubs.Set(self.driver, 'copy_image_to_volume', fail_copy)
+        self._add('vol1', 'image', {'checksum': 'abc'})
+        self.assertFalse(self._entries())
+        self.assertEqual(1, len(self.driver.deleted))
+
+    def test_cleanup_removes_incomplete_entries(self):
+        db.image_volume_cache_create(self.context,
+                                     {'host': 'host', 'image_id': 'image1',
+                                      'size': 1, 'status': 'creating'})
+        db.image_volume_cache_create(self.context,
+                                     {'host': 'host', 'image_id': 'image2',
+                                      'size': 1, 'status': 'available'})
+        self.cache.cleanup(self.context)
+        self.assertEqual(['image2'],
+                         [entry['image_id'] for entry in self._entries()])
+        self.assertEqual(1, len(self.driver.deleted))
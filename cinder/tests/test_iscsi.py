@@ -20,6 +20,7 @@ import string
 import tempfile
 
 from cinder.brick.iscsi import iscsi
+from cinder import exception
 from cinder import test
 from cinder.volume import utils as volume_utils
 
@@ -112,6 +113,33 @@ class TgtAdmTestCase(test.TestCase, TargetAdminTestCase):
             pass
         super(TgtAdmTestCase, self).tearDown()
 
+    def _fake_bulk_execute(self, *cmd, **kwargs):
+        self.cmds.append(string.join(cmd))
+        if cmd == ('tgt-admin', '--show'):
+            return ("Target 1: iqn.2011-09.org.foo.bar:blaa\n"
+                    "    System information:\n"
+                    "Target 2: iqn.2011-09.org.foo.bar:blaa2\n", None)
+        return "", None
+
+    def test_create_iscsi_targets(self):
+        tgtadm = iscsi.get_target_admin()
+        tgtadm.set_execute(self._fake_bulk_execute)
+        tids = tgtadm.create_iscsi_targets(
+            [('iqn.2011-09.org.foo.bar:blaa', '/foo', None, None),
+             ('iqn.2011-09.org.foo.bar:blaa2', '/bar', None, None)])
+        self.assertEqual({'iqn.2011-09.org.foo.bar:blaa': '1',
+                          'iqn.2011-09.org.foo.bar:blaa2': '2'}, tids)
+        self.verify_cmds(['tgt-admin --update ALL', 'tgt-admin --show'])
+        self.assertEqual(['blaa', 'blaa2'],
+                         sorted(os.listdir(self.persist_tempdir)))
+
+    def test_create_iscsi_targets_missing(self):
+        tgtadm = iscsi.get_target_admin()
+        tgtadm.set_execute(self._fake_bulk_execute)
+        self.assertRaises(exception.NotFound, tgtadm.create_iscsi_targets,
+                          [('iqn.2011-09.org.foo.bar:blaa3', '/foo', None,
+                            None)])
+
 
 class IetAdmTestCase(test.TestCase, TargetAdminTestCase):
 
@@ -188,3 +216,123 @@ class LioAdmTestCase(test.TestCase, TargetAdminTestCase):
             'rtstool create '
             '/foo iqn.2011-09.org.foo.bar:blaa test_id test_pass',
             'rtstool delete iqn.2010-10.org.openstack:volume-blaa'])
+
+
+class TgtAdmTargetsTestCase(test.TestCase):
+
+    def setUp(self):
+        super(TgtAdmTargetsTestCase, self).setUp()
+        self.persist_tempdir = tempfile.mkdtemp()
+        self.flags(volumes_dir=self.persist_tempdir)
+        self.cmds = []
+        self.targets = ['iqn.2010-10.org.openstack:volume-a']
+        self.tgtadm = iscsi.TgtAdm(execute=self.fake_execute)
+
+    def tearDown(self):
+        shutil.rmtree(self.persist_tempdir)
+        super(TgtAdmTargetsTestCase, self).tearDown()
+
+    def fake_execute(self, *cmd, **kwargs):
+        self.cmds.append(cmd)
+        if cmd[1] == '--show':
+            return ''.join('Target %d: %s\n    System information:\n' %
+                           (tid, name)
+                           for tid, name in enumerate(self.targets, 1)), None
+        elif cmd[1] == '--update':
+            self.targets.append(cmd[2])
+        elif cmd[2] == '--delete':
+            if cmd[3] not in self.targets:
+                raise exception.ProcessExecutionError(exit_code=22)
+            self.targets.remove(cmd[3])
+        return '', None
+
+    def _count(self, option):
+        return len([cmd for cmd in self.cmds if option in cmd])
+
+    def test_targets_listed_once(self):
+        name_a = 'iqn.2010-10.org.openstack:volume-a'
+        name_b = 'iqn.2010-10.org.openstack:volume-b'
+        self.assertEqual('2', self.tgtadm.create_iscsi_target(name_b, 1, 0,
+                                                              '/dev/b'))
+        self.tgtadm.show_target(1, iqn=name_a)
+        self.tgtadm.show_target(2, iqn=name_b)
+        self.assertEqual(1, self._count('--show'))
+
+        self.tgtadm.remove_iscsi_target(2, 0, 'b')
+        self.assertFalse(os.path.exists(os.path.join(self.persist_tempdir,
+                                                     'volume-b')))
+        self.tgtadm.show_target(1, iqn=name_a)
+        self.assertEqual(1, self._count('--show'))
+
+        # Unknown targets are looked up again
+        self.assertRaises(exception.NotFound, self.tgtadm.show_target,
+                          2, iqn=name_b)
+        self.assertEqual(2, self._count('--show'))
+
+    def test_recreated_target_gets_new_tid(self):
+        name_a = 'iqn.2010-10.org.openstack:volume-a'
+        self.tgtadm.show_target(1, iqn=name_a)
+        # tgtd restarted and a target took the first tid
+        self.targets = ['iqn.2010-10.org.openstack:volume-c']
+        self.assertEqual('2', self.tgtadm.create_iscsi_target(name_a, 1, 0,
+                                                              '/dev/a'))
+        self.tgtadm.show_target(2, iqn=name_a)
+
+    def test_remove_vanished_target(self):
+        self.tgtadm.show_target(1, iqn='iqn.2010-10.org.openstack:volume-a')
+        volume_path = os.path.join(self.persist_tempdir, 'volume-a')
+        open(volume_path, 'w').close()
+        # tgtd restarted
+        self.targets = []
+        self.tgtadm.remove_iscsi_target(1, 0, 'a')
+        self.assertFalse(os.path.exists(volume_path))
+
+
+class LioAdmTargetsTestCase(test.TestCase):
+
+    def setUp(self):
+        super(LioAdmTargetsTestCase, self).setUp()
+        self.cmds = []
+        self.targets = []
+        self.lioadm = iscsi.LioAdm(execute=self.fake_execute)
+
+    def fake_execute(self, *cmd, **kwargs):
+        self.cmds.append(cmd[:2])
+        if cmd[1] == 'get-targets':
+            return '\n'.join(self.targets), None
+        elif cmd[1] == 'create':
+            self.targets.append(cmd[3])
+        elif cmd[1] == 'delete':
+            self.targets.remove(cmd[2])
+        return '', None
+
+    def test_create_iscsi_targets(self):
+        names = ['iqn.2010-10.org.openstack:volume-a',
+                 'iqn.2010-10.org.openstack:volume-b']
+        tids = self.lioadm.create_iscsi_targets(
+            [(name, '/dev/x', 'IncomingUser user pass', None)
+             for name in names])
+        self.assertEqual(dict((name, name) for name in names), tids)
+        self.assertEqual([('rtstool', 'verify'),
+                          ('rtstool', 'create'),
+                          ('rtstool', 'create'),
+                          ('rtstool', 'get-targets')], self.cmds)
+
+    def test_recreated_target_is_not_listed_again(self):
+        name = 'iqn.2010-10.org.openstack:volume-a'
+        self.lioadm.create_iscsi_target(name, 1, 0, '/dev/a')
+        self.lioadm.remove_iscsi_target(1, 0, 'a')
+        self.assertEqual(name, self.lioadm.create_iscsi_target(name, 1, 0,
+                                                               '/dev/a'))
+        self.assertEqual(1, self.cmds.count(('rtstool', 'get-targets')))
+
+    def test_initialize_connection_always_adds_acl(self):
+        name = 'iqn.2010-10.org.openstack:volume-a'
+        volume = {'id': 'a',
+                  'provider_location': '10.0.0.1:3260,1 %s 0' % name,
+                  'provider_auth': 'CHAP user pass'}
+        connector = {'initiator': 'iqn.2013-01.org.foo:host'}
+        # The ACL may have been lost if LIO was reconfigured meanwhile
+        self.lioadm.initialize_connection(volume, connector)
+        self.lioadm.initialize_connection(volume, connector)
+        self.assertEqual(2, self.cmds.count(('rtstool', 'add-initiator')))
@@ -773,3 +773,69 @@ class TestMigrations(test.TestCase):
                                        metadata,
                                        autoload=True)
             self.assertTrue('provider_geometry' not in volumes.c)
+
+    def test_migration_014(self):
+        """Test that adding parent_id column to backups works correctly."""
+        for (key, engine) in self.engines.items():
+            migration_api.version_control(engine,
+                                          TestMigrations.REPOSITORY,
+                                          migration.INIT_VERSION)
+            migration_api.upgrade(engine, TestMigrations.REPOSITORY, 13)
+            metadata = sqlalchemy.schema.MetaData()
+            metadata.bind = engine
+
+            migration_api.upgrade(engine, TestMigrations.REPOSITORY, 14)
+            backups = sqlalchemy.Table('backups',
+                                       metadata,
+                                       autoload=True)
+            self.assertTrue(isinstance(backups.c.parent_id.type,
+                                       sqlalchemy.types.VARCHAR))
+
+            migration_api.downgrade(engine, TestMigrations.REPOSITORY, 13)
+            metadata = sqlalchemy.schema.MetaData()
+            metadata.bind = engine
+
+            backups = sqlalchemy.Table('backups',
+                                       metadata,
+                                       autoload=True)
+            self.assertTrue('parent_id' not in backups.c)
+
+    def test_migration_015(self):
+        """Test adding image_volume_cache_entries table works correctly."""
+        for (key, engine) in self.engines.items():
+            migration_api.version_control(engine,
+                                          TestMigrations.REPOSITORY,
+                                          migration.INIT_VERSION)
+            migration_api.upgrade(engine, TestMigrations.REPOSITORY, 14)
+            metadata = sqlalchemy.schema.MetaData()
+            metadata.bind = engine
+
+            migration_api.upgrade(engine, TestMigrations.REPOSITORY, 15)
+
+            self.assertTrue(engine.dialect.has_table(
+                engine.connect(), "image_volume_cache_entries"))
+            entries = sqlalchemy.Table('image_volume_cache_entries',
+                                       metadata,
+                                       autoload=True)
+
+            self.assertTrue(isinstance(entries.c.id.type,
+                                       sqlalchemy.types.VARCHAR))
+            self.assertTrue(isinstance(entries.c.host.type,
+                                       sqlalchemy.types.VARCHAR))
+            self.assertTrue(isinstance(entries.c.image_id.type,
+                                       sqlalchemy.types.VARCHAR))
+            self.assertTrue(isinstance(entries.c.image_checksum.type,
+                                       sqlalchemy.types.VARCHAR))
+            self.assertTrue(isinstance(entries.c.size.type,
+                                       sqlalchemy.types.INTEGER))
+            self.assertTrue(isinstance(entries.c.status.type,
+                                       sqlalchemy.types.VARCHAR))
+            self.assertTrue(isinstance(entries.c.provider_location.type,
+                                       sqlalchemy.types.VARCHAR))
+            self.assertTrue(isinstance(entries.c.last_used.type,
+                                       sqlalchemy.types.DATETIME))
+
+            migration_api.downgrade(engine, TestMigrations.REPOSITORY, 14)
+
+            self.assertFalse(engine.dialect.has_table(
+                engine.connect(), "image_volume_cache_entries"))
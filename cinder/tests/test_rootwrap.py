@@ -0,0 +1,142 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for loading and matching the rootwrap filters."""
+
+
+import ConfigParser
+import os
+import shutil
+import tempfile
+
+from cinder.openstack.common.rootwrap import filters
+from cinder.openstack.common.rootwrap import wrapper
+from cinder.rootwrap import filtercache
+from cinder import test
+
+
+class RootwrapFiltersTestCase(test.TestCase):
+
+    def setUp(self):
+        super(RootwrapFiltersTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.filters_dir = os.path.join(self.tmpdir, 'rootwrap.d')
+        os.mkdir(self.filters_dir)
+        self._write_filters('volume.filters',
+                            "lvs: CommandFilter, /sbin/lvs, root\n"
+                            "tgt: RegExpFilter, tgt-admin, root, tgt-admin, "
+                            "--update, .*\n"
+                            "any_dd: RegExpFilter, dd, root, d.*, .*\n"
+                            "unknown: NoSuchFilter, foo, root\n"
+                            "cat: ReadFileFilter, /etc/iscsi/initiatorname\n")
+        self.configfile = os.path.join(self.tmpdir, 'rootwrap.conf')
+        with open(self.configfile, 'w') as f:
+            f.write("[DEFAULT]\n"
+                    "filters_path=%s\n"
+                    "exec_dirs=/sbin,/bin\n" % self.filters_dir)
+        self.cache_path = self.configfile + '.cache'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(RootwrapFiltersTestCase, self).tearDown()
+
+    def _write_filters(self, name, content):
+        path = os.path.join(self.filters_dir, name)
+        with open(path, 'w') as f:
+            f.write("[Filters]\n" + content)
+        # Make sure the change is seen whatever the mtime granularity
+        os.utime(path, (0, os.stat(path).st_mtime + 1))
+
+    def _load(self):
+        return filtercache.load_config_and_filters(self.configfile)
+
+    def _stub_parsing(self):
+        def fail(*args, **kwargs):
+            raise AssertionError('configuration parsed')
+        self.stubs.Set(ConfigParser.RawConfigParser, 'read', fail)
+
+    def test_index(self):
+        filterlist = filtercache.load_filters([self.filters_dir])
+        self.assertEqual(['lvs', 'tgt', 'cat'],
+                         [f.name for f in filterlist
+                          if filtercache.get_index_key(f) is not None])
+        self.assertEqual(['lvs', 'any_dd'],
+                         [f.name for f in filterlist.candidates(['lvs'])])
+        self.assertEqual(['any_dd'],
+                         [f.name for f in filterlist.candidates(['dd'])])
+        self.assertEqual(['any_dd'],
+                         [f.name for f in filterlist.candidates([])])
+
+    def test_match_filter_uses_index(self):
+        filterlist = filtercache.load_filters([self.filters_dir])
+        self.stubs.Set(filters.CommandFilter, 'get_exec',
+                       lambda self, exec_dirs=[]: self.exec_path)
+        self.assertEqual('tgt', filtercache.match_filter(
+            filterlist, ['tgt-admin', '--update', 'iqn']).name)
+        self.assertEqual('any_dd', filtercache.match_filter(
+            filterlist, ['dd', 'if=/dev/zero']).name)
+        self.assertRaises(wrapper.NoFilterMatched, filtercache.match_filter,
+                          filterlist, ['tgt-admin', '--delete', 'iqn'])
+
+    def test_cache(self):
+        config, filterlist = self._load()
+        self.assertTrue(os.path.exists(self.cache_path))
+
+        self._stub_parsing()
+        cached_config, cached_filters = self._load()
+        self.assertEqual(['/sbin', '/bin'], cached_config.exec_dirs)
+        self.assertEqual(config.filters_path, cached_config.filters_path)
+        self.assertEqual([(f.name, type(f), f.exec_path, f.args)
+                          for f in filterlist],
+                         [(f.name, type(f), f.exec_path, f.args)
+                          for f in cached_filters])
+        self.assertEqual(filterlist.index, cached_filters.index)
+        self.assertEqual(filterlist.unindexed, cached_filters.unindexed)
+        self.assertTrue(isinstance(cached_filters[0].exec_path, str))
+
+    def test_cache_is_invalidated(self):
+        self._load()
+        self._write_filters('volume.filters',
+                            "lvs: CommandFilter, /sbin/lvs, root\n")
+        config, filterlist = self._load()
+        self.assertEqual(['lvs'], [f.name for f in filterlist])
+
+        self._write_filters('more.filters',
+                            "vgs: CommandFilter, /sbin/vgs, root\n")
+        config, filterlist = self._load()
+        self.assertEqual(['lvs', 'vgs'], sorted(f.name for f in filterlist))
+
+        self._stub_parsing()
+        self._load()
+
+    def test_cache_writeable_by_others_is_ignored(self):
+        self._load()
+        os.chmod(self.cache_path, 0o666)
+        self._stub_parsing()
+        self.assertRaises(AssertionError, self._load)
+
+    def test_exec_dirs_from_path_are_not_cached(self):
+        with open(self.configfile, 'w') as f:
+            f.write("[DEFAULT]\n"
+                    "filters_path=%s\n" % self.filters_dir)
+        os.utime(self.configfile, (0, os.stat(self.configfile).st_mtime + 1))
+        self._load()
+        self.stubs.Set(os, 'environ', {'PATH': '/opt/bin'})
+        config, filterlist = self._load()
+        self.assertEqual(['/opt/bin'], config.exec_dirs)
+
+    def test_unwriteable_cache(self):
+        config, filterlist = filtercache.load_config_and_filters(
+            self.configfile, os.path.join(self.tmpdir, 'missing', 'cache'))
+        self.assertEqual(4, len(filterlist))
@@ -0,0 +1,123 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for running commands through the root wrapper daemon."""
+
+
+import os
+import shutil
+import sys
+import tempfile
+
+from cinder import exception
+from cinder.openstack.common.rootwrap import cmd
+from cinder import test
+from cinder import utils
+
+
+DAEMON = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                      'bin', 'cinder-rootwrap-daemon')
+
+
+class RootwrapDaemonTestCase(test.TestCase):
+
+    def setUp(self):
+        super(RootwrapDaemonTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        filters_dir = os.path.join(self.tmpdir, 'rootwrap.d')
+        os.mkdir(filters_dir)
+        with open(os.path.join(filters_dir, 'test.filters'), 'w') as f:
+            f.write("[Filters]\n"
+                    "cat: CommandFilter, cat, root\n"
+                    "false: CommandFilter, false, root\n")
+        config = os.path.join(self.tmpdir, 'rootwrap.conf')
+        with open(config, 'w') as f:
+            f.write("[DEFAULT]\n"
+                    "filters_path=%s\n"
+                    "exec_dirs=/bin,/usr/bin\n" % filters_dir)
+        self.client = utils.RootwrapDaemonClient([sys.executable, DAEMON,
+                                                  config])
+
+    def tearDown(self):
+        self.client._stop()
+        shutil.rmtree(self.tmpdir)
+        super(RootwrapDaemonTestCase, self).tearDown()
+
+    def test_execute(self):
+        self.assertEqual((0, 'hello', ''),
+                         self.client.execute(['cat'], 'hello'))
+        data = ''.join(chr(i) for i in range(256))
+        self.assertEqual((0, data, ''), self.client.execute(['cat'], data))
+
+    def test_daemon_is_reused(self):
+        self.client.execute(['cat'], 'a')
+        process = self.client._process
+        self.client.execute(['cat'], 'b')
+        self.assertTrue(process is self.client._process)
+
+    def test_unauthorized_command(self):
+        returncode, stdout, stderr = self.client.execute(['ls'])
+        self.assertEqual(cmd.RC_UNAUTHORIZED, returncode)
+        self.assertTrue('Unauthorized command: ls' in stdout)
+
+    def test_restart(self):
+        self.client.execute(['cat'], 'a')
+        process = self.client._process
+        self.client._stop()
+        # The daemon is reaped, not left a zombie
+        self.assertEqual(0, process.returncode)
+        self.assertEqual((0, 'b', ''), self.client.execute(['cat'], 'b'))
+
+    def test_start_failure(self):
+        client = utils.RootwrapDaemonClient(['false'])
+        self.assertRaises(exception.ProcessExecutionError,
+                          client.execute, ['cat'])
+
+    def test_execute_routes_to_daemon(self):
+        self.stubs.Set(os, 'geteuid', lambda: 1000)
+        self.stubs.Set(utils, '_ROOTWRAP_DAEMON', self.client)
+        self.flags(use_rootwrap_daemon=True)
+        self.assertEqual(('hello', ''),
+                         utils.execute('cat', process_input='hello',
+                                       run_as_root=True))
+        exc = self.assertRaises(exception.ProcessExecutionError,
+                                utils.execute, 'false', run_as_root=True,
+                                attempts=2, delay_on_retry=False)
+        self.assertEqual(1, exc.exit_code)
+        self.assertEqual(('', ''),
+                         utils.execute('false', run_as_root=True,
+                                       check_exit_code=[1]))
+        out, err = utils.trycmd('false', run_as_root=True)
+        self.assertTrue('Exit code: 1' in err)
+
+    def test_execute_without_daemon(self):
+        executed = []
+
+        def fake_execute(*cmd, **kwargs):
+            executed.append(kwargs['root_helper'])
+            return '', ''
+
+        self.stubs.Set(utils.processutils, 'execute', fake_execute)
+        self.flags(rootwrap_config='/etc/cinder/rootwrap.conf')
+        utils.execute('cat', run_as_root=True)
+        self.assertEqual(['sudo cinder-rootwrap /etc/cinder/rootwrap.conf'],
+                         executed)
+
+    def test_get_rootwrap_daemon(self):
+        self.flags(rootwrap_config='/etc/cinder/rootwrap.conf')
+        self.stubs.Set(utils, '_ROOTWRAP_DAEMON', None)
+        client = utils._get_rootwrap_daemon()
+        self.assertEqual(['sudo', 'cinder-rootwrap-daemon',
+                          '/etc/cinder/rootwrap.conf'], client.daemon_cmd)
+        self.assertTrue(client is utils._get_rootwrap_daemon())
@@ -22,8 +22,10 @@ import os
 import paramiko
 import StringIO
 import tempfile
+import time
 import uuid
 
+from eventlet import greenthread
 import mox
 from oslo.config import cfg
 
@@ -455,6 +457,30 @@ class GenericUtilsTestCase(test.TestCase):
         h2 = hashlib.sha1(data).hexdigest()
         self.assertEquals(h1, h2)
 
+    def test_is_all_zero(self):
+        self.assertTrue(utils.is_all_zero('\0' * 4096))
+        self.assertTrue(utils.is_all_zero(''))
+        self.assertFalse(utils.is_all_zero('\0' * 4095 + '\1'))
+
+    def test_token_bucket(self):
+        now = [100.0]
+        slept = []
+
+        def fake_sleep(seconds):
+            slept.append(seconds)
+            now[0] += seconds
+
+        self.stubs.Set(time, 'time', lambda: now[0])
+        self.stubs.Set(greenthread, 'sleep', fake_sleep)
+        bucket = utils.TokenBucket(1000, 2000)
+        bucket.consume(2000)
+        self.assertEquals(slept, [])
+        bucket.consume(500)
+        self.assertEquals(slept, [0.5])
+        now[0] += 0.25
+        bucket.consume(3000)
+        self.assertEquals(slept, [0.5, 2.75])
+
 
 class MonkeyPatchTestCase(test.TestCase):
     """Unit test for utils.monkey_patch()."""
@@ -26,6 +26,8 @@ import re
 import shutil
 import tempfile
 
+import eventlet
+from eventlet import event
 import mox
 from oslo.config import cfg
 
@@ -43,9 +45,11 @@ from cinder import quota
 from cinder import test
 from cinder.tests import conf_fixture
 from cinder.tests.image import fake as fake_image
+from cinder import units
 from cinder.volume import configuration as conf
 from cinder.volume import driver
 from cinder.volume.drivers import lvm
+from cinder.volume import image_cache
 from cinder.volume import utils as volutils
 
 
@@ -825,6 +829,52 @@ class VolumeTestCase(test.TestCase):
         db.volume_destroy(self.context, volume_id)
         os.unlink(dst_path)
 
+    def test_create_volume_from_image_cached(self):
+        """Verify that a second volume created from the same image is cloned
+        from the image volume cache instead of copying the image again.
+        """
+        copies = []
+        clones = []
+
+        def fake_copy_image_to_volume(context, volume,
+                                      image_service, image_id):
+            copies.append(volume['id'])
+
+        def fake_create_cloned_volume(volume, src_vref):
+            clones.append((volume['id'], src_vref['id']))
+
+        def fake_show(image_service, context, image_id):
+            return {'id': image_id, 'checksum': 'abc'}
+
+        self.stubs.Set(self.volume, '_copy_image_to_volume',
+                       fake_copy_image_to_volume)
+        self.stubs.Set(self.volume.driver, 'copy_image_to_volume',
+                       fake_copy_image_to_volume)
+        self.stubs.Set(self.volume.driver, 'create_cloned_volume',
+                       fake_create_cloned_volume)
+        self.stubs.Set(fake_image._FakeImageService, 'show', fake_show)
+        self.volume.image_cache = image_cache.ImageVolumeCache(
+            db, self.volume.driver, self.volume.host)
+
+        image_id = 'c905cedb-7281-47e4-8a62-f26bc5fc4c77'
+        first_id = self._create_volume(size=1, status='creating')['id']
+        self.volume.create_volume(self.context, first_id, image_id=image_id)
+        # Let the image be cached in the background
+        eventlet.sleep(0)
+        second_id = self._create_volume(size=1, status='creating')['id']
+        self.volume.create_volume(self.context, second_id, image_id=image_id)
+
+        entry = db.image_volume_cache_get_by_image(self.context,
+                                                   self.volume.host,
+                                                   image_id)
+        self.assertEqual([first_id, entry['id']], copies)
+        self.assertEqual([(second_id, entry['id'])], clones)
+        volume = db.volume_get(self.context, second_id)
+        self.assertEqual('available', volume['status'])
+        self.assertTrue(volume['bootable'])
+        self.volume.delete_volume(self.context, first_id)
+        self.volume.delete_volume(self.context, second_id)
+
     def test_copy_volume_to_image_status_available(self):
         dst_fd, dst_path = tempfile.mkstemp()
         os.close(dst_fd)
@@ -1342,7 +1392,7 @@ class VolumeTestCase(test.TestCase):
         """Test context does't change after volume creation failure."""
         def fake_create_volume(context, volume_ref, snapshot_ref,
                                sourcevol_ref, image_service, image_id,
-                               image_location):
+                               image_location, image_meta):
             raise exception.CinderException('fake exception')
 
         def fake_reschedule_or_error(context, volume_id, exc_info,
@@ -1518,17 +1568,45 @@ class VolumeDriverTestCase(DriverTestCase):
                        lambda x: False)
         self.stubs.Set(self.volume.driver, '_delete_volume',
                        lambda x: False)
-        # Want DriverTestCase._fake_execute to return 'o' so that
+
+        def _fake_lvs(*cmd, **kwargs):
+            if cmd[0] == 'lvs':
+                return self.output, None
+            return '', None
+
+        self.volume.driver.set_execute(_fake_lvs)
+        # Want lvs to list test1 as an origin so that
         # volume.driver.delete_volume() raises the VolumeIsBusy exception.
-        self.output = 'o'
+        self.output = '  cinder-volumes test1 1024.00g owi-a-----'
         self.assertRaises(exception.VolumeIsBusy,
                           self.volume.driver.delete_volume,
                           {'name': 'test1', 'size': 1024})
-        # when DriverTestCase._fake_execute returns something other than
-        # 'o' volume.driver.delete_volume() does not raise an exception.
-        self.output = 'x'
+        # when lvs lists test1 with other attributes
+        # volume.driver.delete_volume() does not raise an exception.
+        self.output = '  cinder-volumes test1 1024.00g -wi-a-----'
+        self.volume.driver.inventory.invalidate()
         self.volume.driver.delete_volume({'name': 'test1', 'size': 1024})
 
+    def test_ensure_exports(self):
+        """Test exports are recreated one after the other by default."""
+        exported = []
+        self.stubs.Set(self.volume.driver, 'ensure_export',
+                       lambda context, volume: exported.append(volume['id']))
+        self.stubs.Set(eventlet, 'GreenPool', None)
+        volumes = [{'id': str(i)} for i in xrange(5)]
+        self.volume.driver.ensure_exports(self.context, volumes)
+        self.assertEqual(['0', '1', '2', '3', '4'], exported)
+
+    def test_ensure_exports_pool(self):
+        """Test exports are recreated from a bounded pool when enabled."""
+        exported = []
+        self.stubs.Set(self.volume.driver, 'ensure_export',
+                       lambda context, volume: exported.append(volume['id']))
+        self.volume.driver.configuration.export_recovery_workers = 2
+        volumes = [{'id': str(i)} for i in xrange(5)]
+        self.volume.driver.ensure_exports(self.context, volumes)
+        self.assertEqual(['0', '1', '2', '3', '4'], sorted(exported))
+
 
 class LVMVolumeDriverTestCase(DriverTestCase):
     """Test case for VolumeDriver"""
@@ -1558,6 +1636,262 @@ class LVMVolumeDriverTestCase(DriverTestCase):
         volume = dict(fake_volume)
         self.assertEquals(None, lvm_driver.clear_volume(volume))
 
+    def _stub_deferred_wipe(self):
+        """Record what a deferred delete does, blocking in the wipe.
+
+        Returns the list of commands run and an event that lets the wipes
+        finish.
+        """
+        self.flags(volume_clear_deferred=True)
+        lvm_driver = self.volume.driver
+        executed = []
+        wiping = event.Event()
+
+        def fake_execute(*cmd, **kwargs):
+            executed.append(cmd)
+            return self.output, None
+
+        def fake_clear_volume(volume):
+            executed.append(('clear', volume['name'], volume['size']))
+            wiping.wait()
+
+        lvm_driver.set_execute(fake_execute)
+        self.stubs.Set(lvm_driver, 'clear_volume', fake_clear_volume)
+        self.stubs.Set(lvm_driver, '_volume_not_present', lambda name: False)
+        self.stubs.Set(os.path, 'exists', lambda path: True)
+        return executed, wiping
+
+    def test_delete_volume_deferred(self):
+        self.flags(volume_clear_workers=1)
+        lvm_driver = self.volume.driver
+        executed, wiping = self._stub_deferred_wipe()
+
+        lvm_driver.delete_volume({'name': 'test1', 'size': 2})
+        lvm_driver.delete_volume({'name': 'test2', 'size': 3})
+        self.assertTrue(('lvrename', 'cinder-volumes', 'test1',
+                         'wipe-test1') in executed)
+        self.assertTrue(('lvrename', 'cinder-volumes', 'test2',
+                         'wipe-test2') in executed)
+        self.assertEquals(lvm_driver._pending_wipes,
+                          {'wipe-test1': 2, 'wipe-test2': 3})
+
+        # Only one volume is wiped at a time
+        eventlet.sleep(0)
+        self.assertEquals([cmd for cmd in executed if cmd[0] == 'clear'],
+                          [('clear', 'wipe-test1', 2)])
+
+        wiping.send()
+        while lvm_driver._pending_wipes:
+            eventlet.sleep(0)
+        self.assertEquals(executed[-3:],
+                          [('lvremove', '-f', 'cinder-volumes/wipe-test1'),
+                           ('clear', 'wipe-test2', 3),
+                           ('lvremove', '-f', 'cinder-volumes/wipe-test2')])
+
+    def test_do_setup_resumes_deferred_wipes(self):
+        lvm_driver = self.volume.driver
+        executed, wiping = self._stub_deferred_wipe()
+        self.output = "  volume-1  1,00\n  wipe-volume-2  4.00\n"
+
+        lvm_driver.do_setup(self.context)
+        self.assertEquals(lvm_driver._pending_wipes, {'wipe-volume-2': 4})
+
+        wiping.send()
+        while lvm_driver._pending_wipes:
+            eventlet.sleep(0)
+        self.assertEquals(executed[-1],
+                          ('lvremove', '-f', 'cinder-volumes/wipe-volume-2'))
+
+    def test_inventory_tracks_changes(self):
+        lvm_driver = self.volume.driver
+        executed = []
+
+        def fake_execute(*cmd, **kwargs):
+            executed.append(cmd[0])
+            if cmd[0] == 'vgs':
+                return '  cinder-volumes 10.00g 10.00g', None
+            return '', None
+
+        lvm_driver.set_execute(fake_execute)
+        self.assertEquals(lvm_driver.inventory.get_capacity(), (10.0, 10.0))
+        lvm_driver.create_volume({'name': 'test1', 'size': 1})
+        snapshot = {'name': 'snap1', 'volume_name': 'test1',
+                    'volume_size': 1}
+        lvm_driver.create_snapshot(snapshot)
+        self.assertEquals(lvm_driver.inventory.get_capacity(), (10.0, 8.0))
+        self.assertRaises(exception.VolumeIsBusy,
+                          lvm_driver.delete_volume,
+                          {'name': 'test1', 'size': 1})
+
+        lvm_driver.delete_snapshot(snapshot)
+        lvm_driver.delete_volume({'name': 'test1', 'size': 1})
+        self.assertEquals(lvm_driver.inventory.get_capacity(), (10.0, 10.0))
+        self.assertEquals(executed.count('lvs'), 1)
+        self.assertEquals(executed.count('vgs'), 1)
+
+    def test_clear_volume_parallel(self):
+        self.flags(volume_clear_io_depth=3)
+        cleared = []
+        self.stubs.Set(volutils, 'clear_volume_ranges',
+                       lambda path, ranges, execute: cleared.append(ranges))
+        self.volume.driver.clear_volume({'name': 'test1', 'id': 'test1',
+                                         'size': '1'})
+        chunk = 342 * units.MiB
+        self.assertEquals(cleared, [[(0, chunk), (chunk, chunk),
+                                     (2 * chunk, units.GiB - 2 * chunk)]])
+
+
+class ThinLVMVolumeDriverTestCase(DriverTestCase):
+    """Test case for ThinLVMVolumeDriver"""
+    driver_name = "cinder.volume.drivers.lvm.ThinLVMVolumeDriver"
+
+    THIN_DUMP = """<superblock uuid="" time="1" transaction="2"
+data_block_size="128" nr_data_blocks="1024">
+  <device dev_id="3" mapped_blocks="4" transaction="0" creation_time="0"
+  snap_time="1">
+    <range_mapping origin_begin="0" data_begin="10" length="2" time="0"/>
+    <single_mapping origin_block="2" data_block="40" time="0"/>
+    <single_mapping origin_block="8" data_block="41" time="1"/>
+  </device>
+</superblock>"""
+
+    # Device 4 is a snapshot of device 3 that shares pool blocks 11 and 41
+    # with it. Its volume blocks 6 and 7 have since been written.
+    THIN_DUMP_SNAPSHOT = """<superblock uuid="" time="2" transaction="3"
+data_block_size="128" nr_data_blocks="1024">
+  <device dev_id="3" mapped_blocks="4" transaction="0" creation_time="0"
+  snap_time="1">
+    <range_mapping origin_begin="0" data_begin="10" length="2" time="0"/>
+    <single_mapping origin_block="2" data_block="40" time="0"/>
+    <single_mapping origin_block="8" data_block="41" time="1"/>
+  </device>
+  <device dev_id="4" mapped_blocks="4" transaction="1" creation_time="1"
+  snap_time="1">
+    <single_mapping origin_block="1" data_block="11" time="0"/>
+    <range_mapping origin_begin="5" data_begin="41" length="3" time="1"/>
+  </device>
+</superblock>"""
+
+    def _stub_execute(self, zero='  0', thin_id='  3', thin_dump=None,
+                      failing=()):
+        executed = []
+        replies = {'zero': zero, 'thin_id': thin_id,
+                   'thin_dump': thin_dump or self.THIN_DUMP}
+
+        def fake_execute(*cmd, **kwargs):
+            executed.append(cmd)
+            if cmd[0] in failing:
+                raise exception.ProcessExecutionError(stderr='failed')
+            if cmd[0] == 'thin_dump':
+                return replies['thin_dump'], None
+            if cmd[0] == 'lvs':
+                return replies[cmd[3]], None
+            return '', None
+
+        self.volume.driver.set_execute(fake_execute)
+        self.cleared = []
+        self.stubs.Set(volutils, 'clear_volume_ranges',
+                       lambda path, ranges, execute:
+                       self.cleared.append((path, ranges)))
+        self.shredded = []
+        self.stubs.Set(volutils, 'shred_volume_ranges',
+                       lambda path, ranges, execute:
+                       self.shredded.append((path, ranges)))
+        return executed
+
+    def test_parse_thin_dump(self):
+        ranges = self.volume.driver._parse_thin_dump(self.THIN_DUMP, '3')
+        block = 64 * units.KiB
+        self.assertEquals(ranges, [(0, 3 * block), (8 * block, block)])
+
+    def test_parse_thin_dump_skips_shared_blocks(self):
+        block = 64 * units.KiB
+        origin = self.volume.driver._parse_thin_dump(self.THIN_DUMP_SNAPSHOT,
+                                                     '3')
+        self.assertEquals(origin, [(0, block), (2 * block, block)])
+        snapshot = self.volume.driver._parse_thin_dump(
+            self.THIN_DUMP_SNAPSHOT, '4')
+        self.assertEquals(snapshot, [(6 * block, 2 * block)])
+
+    def test_clear_snapshot_shared_blocks(self):
+        self._stub_execute(thin_id='  4', thin_dump=self.THIN_DUMP_SNAPSHOT)
+        self.volume.driver.clear_volume({'name': 'snapshot-1', 'id': '1',
+                                         'size': 1})
+        block = 64 * units.KiB
+        self.assertEquals(self.cleared,
+                          [('/dev/mapper/cinder--volumes-_snapshot--1',
+                            [(6 * block, 2 * block)])])
+
+    def test_clear_volume_provisioned_blocks(self):
+        executed = self._stub_execute()
+        self.volume.driver.clear_volume({'name': 'volume-1', 'id': '1',
+                                         'size': 1})
+
+        block = 64 * units.KiB
+        self.assertEquals(self.cleared,
+                          [('/dev/mapper/cinder--volumes-volume--1',
+                            [(0, 3 * block), (8 * block, block)])])
+        pool = 'cinder--volumes-cinder--volumes--pool'
+        self.assertEquals(executed[-3:],
+                          [('dmsetup', 'message', pool + '-tpool', '0',
+                            'reserve_metadata_snap'),
+                           ('thin_dump', '--metadata-snap',
+                            '/dev/mapper/%s_tmeta' % pool),
+                           ('dmsetup', 'message', pool + '-tpool', '0',
+                            'release_metadata_snap')])
+
+    def test_clear_volume_provisioned_blocks_size(self):
+        self.flags(volume_clear_size=1)
+        self._stub_execute()
+        self.stubs.Set(self.volume.driver, '_get_provisioned_ranges',
+                       lambda volume: [(0, units.MiB / 2),
+                                       (units.MiB / 2 + units.KiB, units.MiB),
+                                       (2 * units.MiB, units.MiB)])
+        self.volume.driver.clear_volume({'name': 'volume-1', 'id': '1',
+                                         'size': 1})
+        self.assertEquals(self.cleared[0][1],
+                          [(0, units.MiB / 2),
+                           (units.MiB / 2 + units.KiB,
+                            units.MiB / 2 - units.KiB)])
+
+    def test_clear_volume_discards_when_pool_zeroes(self):
+        executed = self._stub_execute(zero='  zero')
+        self.volume.driver.clear_volume({'name': 'volume-1', 'id': '1',
+                                         'size': 1})
+        self.assertEquals(executed[-1],
+                          ('blkdiscard',
+                           '/dev/mapper/cinder--volumes-volume--1'))
+        self.assertEquals(self.cleared, [])
+
+    def test_clear_volume_shred_provisioned_blocks(self):
+        self.flags(volume_clear='shred')
+        self._stub_execute()
+        self.volume.driver.clear_volume({'name': 'volume-1', 'id': '1',
+                                         'size': 1})
+        block = 64 * units.KiB
+        self.assertEquals(self.shredded,
+                          [('/dev/mapper/cinder--volumes-volume--1',
+                            [(0, 3 * block), (8 * block, block)])])
+        self.assertEquals(self.cleared, [])
+
+    def test_clear_volume_discards_when_blocks_unknown(self):
+        executed = self._stub_execute(failing=('thin_dump',))
+        self.volume.driver.clear_volume({'name': 'volume-1', 'id': '1',
+                                         'size': 1})
+        self.assertEquals(executed[-1],
+                          ('blkdiscard',
+                           '/dev/mapper/cinder--volumes-volume--1'))
+        self.assertEquals(self.cleared, [])
+
+    def test_clear_volume_discard_fails(self):
+        executed = self._stub_execute(failing=('thin_dump', 'blkdiscard'))
+        self.volume.driver.clear_volume({'name': 'volume-1', 'id': '1',
+                                         'size': 1})
+        self.assertEquals(executed[-1][0], 'blkdiscard')
+        self.assertFalse([cmd for cmd in executed
+                          if cmd[0] in ('dd', 'shred')])
+        self.assertEquals(self.cleared, [])
+
 
 class ISCSITestCase(DriverTestCase):
     """Test Case for ISCSIDriver"""
@@ -1605,6 +1939,33 @@ class ISCSITestCase(DriverTestCase):
         self.assertEquals(result["target_iqn"], "iqn:iqn")
         self.assertEquals(result["target_lun"], 0)
 
+    def test_init_host_exports_at_once(self):
+        """Test all the tgt targets are updated with a single command."""
+        names = []
+        for index in xrange(3):
+            volume = db.volume_create(self.context, {'size': 0,
+                                                     'host': CONF.host,
+                                                     'status': 'available'})
+            names.append(volume['name'])
+        cmds = []
+
+        def _fake_execute(*cmd, **kwargs):
+            cmds.append(cmd)
+            if cmd == ('tgt-admin', '--show'):
+                return ''.join('Target %d: %s%s\n' %
+                               (tid, CONF.iscsi_target_prefix, name)
+                               for tid, name in enumerate(names)), None
+            return '', None
+
+        self.volume.driver.tgtadm = iscsi.TgtAdm()
+        self.volume.driver.set_execute(_fake_execute)
+        self.stubs.Set(self.volume.driver, 'check_for_setup_error',
+                       lambda: None)
+        self.volume.init_host()
+        updates = [cmd for cmd in cmds if cmd[:2] == ('tgt-admin', '--update')]
+        self.assertEqual([('tgt-admin', '--update', 'ALL')], updates)
+        self.assertEqual(sorted(names), sorted(os.listdir(CONF.volumes_dir)))
+
     def test_get_volume_stats(self):
         def _emulate_vgs_execute(_command, *_args, **_kwargs):
             out = "  test1-volumes  5,52  0,52"
@@ -1619,6 +1980,12 @@ class ISCSITestCase(DriverTestCase):
 
         self.assertEquals(stats['total_capacity_gb'], float('5.52'))
         self.assertEquals(stats['free_capacity_gb'], float('0.52'))
+        self.assertEquals(stats['pending_reclaim_gb'], 0)
+
+    def test_get_volume_stats_pending_reclaim(self):
+        self.volume.driver._pending_wipes = {'wipe-test1': 2, 'wipe-test2': 3}
+        self.volume.driver._update_volume_status()
+        self.assertEquals(self.volume.driver._stats['pending_reclaim_gb'], 5)
 
     def test_validate_connector(self):
         iscsi_driver = driver.ISCSIDriver()
@@ -17,6 +17,8 @@
 
 """Tests For miscellaneous util methods used with volume."""
 
+import os
+import tempfile
 
 from oslo.config import cfg
 
@@ -27,6 +29,8 @@ from cinder.openstack.common import log as logging
 from cinder.openstack.common.notifier import api as notifier_api
 from cinder.openstack.common.notifier import test_notifier
 from cinder import test
+from cinder import units
+from cinder import utils
 from cinder.volume import utils as volume_utils
 
 
@@ -156,3 +160,141 @@ class LVMVolumeDriverTestCase(test.TestCase):
         bs, count = volume_utils._calculate_count(1024)
         self.assertEquals(bs, '1M')
         self.assertEquals(count, 1024)
+
+
+class CopyVolumeTestCase(test.TestCase):
+    def setUp(self):
+        super(CopyVolumeTestCase, self).setUp()
+        self.flags(volume_dd_blocksize='256K')
+        self.flags(volume_copy_method='native')
+        self.block = 256 * units.KiB
+        self.src = self._make_file('a' * self.block + '\0' * self.block +
+                                   'b' * 2 * self.block)
+        self.dest = self._make_file('x' * units.MiB)
+
+    def _make_file(self, data):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        os.write(fd, data)
+        os.close(fd)
+        return path
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_copy_volume_native(self):
+        progress = []
+        volume_utils.copy_volume(self.src, self.dest, 1,
+                                 progress_callback=lambda copied, total:
+                                 progress.append((copied, total)))
+        self.assertEquals(self._read(self.dest), self._read(self.src))
+        self.assertEquals(progress, [(self.block * (i + 1), units.MiB)
+                                     for i in range(4)])
+
+    def test_copy_progress_logger(self):
+        logged = []
+        self.stubs.Set(volume_utils.LOG, 'debug', logged.append)
+        progress = volume_utils.copy_progress_logger('copy', step=30)
+        for copied in range(0, 101, 5):
+            progress(copied, 100)
+        self.assertEquals(logged, ['copy: %d%% copied' % percent
+                                   for percent in (30, 60, 90, 100)])
+
+    def test_copy_volume_native_sparse(self):
+        volume_utils.copy_volume(self.src, self.dest, 1, sparse=True)
+        # The all-zero block is not written
+        self.assertEquals(self._read(self.dest),
+                          'a' * self.block + 'x' * self.block +
+                          'b' * 2 * self.block)
+
+    def test_copy_volume_native_clear(self):
+        volume_utils.copy_volume('/dev/zero', self.dest, 1, sync=True,
+                                 sparse=True)
+        self.assertEquals(self._read(self.dest), '\0' * units.MiB)
+
+    def test_copy_volume_native_rate_limit(self):
+        consumed = []
+        self.flags(volume_copy_bps_limit=units.MiB)
+        self.stubs.Set(utils.TokenBucket, 'consume',
+                       lambda inst, amount: consumed.append(amount))
+        volume_utils.copy_volume(self.src, self.dest, 1)
+        self.assertEquals(consumed, [self.block] * 4)
+
+    def test_clear_volume_native_shared_rate_limit(self):
+        consumed = []
+        self.flags(volume_clear_bps_limit=units.MiB)
+        self.stubs.Set(utils.TokenBucket, 'consume',
+                       lambda inst, amount: consumed.append(inst))
+        volume_utils.copy_volume('/dev/zero', self.dest, 1)
+        volume_utils.copy_volume('/dev/zero', self.dest, 1)
+        # Copies other than clears are not limited
+        volume_utils.copy_volume(self.src, self.dest, 1)
+        self.assertEquals(len(consumed), 8)
+        self.assertEquals(len(set(consumed)), 1)
+
+    def test_copy_volume_native_short_source(self):
+        src = self._make_file('a' * self.block)
+        self.assertRaises(IOError, volume_utils._copy_volume_native,
+                          src, self.dest, 1)
+
+    def test_clear_volume_ranges_native(self):
+        self.flags(volume_clear_io_depth=2)
+        volume_utils.clear_volume_ranges(self.dest,
+                                         [(0, self.block),
+                                          (2 * self.block, 2 * self.block)])
+        self.assertEquals(self._read(self.dest),
+                          '\0' * self.block + 'x' * self.block +
+                          '\0' * 2 * self.block)
+
+    def _fake_execute(self, *cmd, **kwargs):
+        self.executed.append(cmd)
+        return '', ''
+
+    def test_copy_volume_dd(self):
+        self.executed = []
+        self.flags(volume_copy_method='dd')
+        volume_utils.copy_volume(self.src, self.dest, 1, sparse=True,
+                                 execute=self._fake_execute)
+        self.assertEquals(self.executed[-1],
+                          ('dd', 'if=%s' % self.src, 'of=%s' % self.dest,
+                           'count=4', 'bs=256K', 'iflag=direct',
+                           'oflag=direct', 'conv=sparse'))
+        self.assertEquals(self._read(self.dest), 'x' * units.MiB)
+
+    def test_copy_volume_falls_back_to_dd(self):
+        self.executed = []
+        volume_utils.copy_volume('/nonexistent', self.dest, 1,
+                                 execute=self._fake_execute)
+        self.assertEquals(self.executed[-1][:3],
+                          ('dd', 'if=/nonexistent', 'of=%s' % self.dest))
+
+    def test_clear_volume_ranges_dd(self):
+        self.executed = []
+        self.flags(volume_copy_method='dd')
+        volume_utils.clear_volume_ranges(self.dest, [(0, self.block),
+                                                     (units.MiB, units.MiB)],
+                                         execute=self._fake_execute)
+        self.assertEquals(self.executed,
+                          [('dd', 'if=/dev/zero', 'of=%s' % self.dest,
+                            'bs=256K', 'seek=0', 'count=%d' % self.block,
+                            'iflag=count_bytes', 'oflag=seek_bytes',
+                            'conv=fdatasync'),
+                           ('dd', 'if=/dev/zero', 'of=%s' % self.dest,
+                            'bs=256K', 'seek=%d' % units.MiB,
+                            'count=%d' % units.MiB, 'iflag=count_bytes',
+                            'oflag=seek_bytes', 'conv=fdatasync')])
+
+    def test_shred_volume_ranges(self):
+        self.executed = []
+        volume_utils.shred_volume_ranges(self.dest, [(0, self.block),
+                                                     (units.MiB, units.MiB)],
+                                         passes=2,
+                                         execute=self._fake_execute)
+        self.assertEquals(len(self.executed), 4)
+        self.assertEquals(self.executed[0],
+                          ('dd', 'if=/dev/urandom', 'of=%s' % self.dest,
+                           'bs=256K', 'seek=0', 'count=%d' % self.block,
+                           'iflag=count_bytes', 'oflag=seek_bytes',
+                           'conv=fdatasync'))
+        self.assertEquals(self.executed[2], self.executed[0])
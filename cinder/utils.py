@@ -31,6 +31,7 @@ import pyclbr
 import random
 import re
 import shutil
+import socket
 import sys
 import tempfile
 import time
@@ -41,8 +42,10 @@ from xml.sax import expatreader
 from xml.sax import saxutils
 
 from eventlet import event
+from eventlet.green import subprocess
 from eventlet import greenthread
 from eventlet import pools
+from eventlet import semaphore
 
 from oslo.config import cfg
 
@@ -53,6 +56,7 @@ from cinder.openstack.common import lockutils
 from cinder.openstack.common import log as logging
 from cinder.openstack.common import processutils
 from cinder.openstack.common import timeutils
+from cinder.rootwrap import daemon as rootwrap_daemon
 
 
 CONF = cfg.CONF
@@ -91,13 +95,193 @@ def fetchfile(url, target):
     execute('curl', '--fail', url, '-o', target)
 
 
+class RootwrapDaemonClient(object):
+    """Runs commands as root through a cinder-rootwrap-daemon.
+
+    The daemon is started on first use, and again if it goes away.
+    """
+
+    def __init__(self, daemon_cmd):
+        self.daemon_cmd = daemon_cmd
+        self._process = None
+        self._socket_path = None
+        self._lock = semaphore.Semaphore()
+
+    def _start(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                return
+            LOG.info(_('Starting root helper daemon: %s'),
+                     ' '.join(self.daemon_cmd))
+            self._process = subprocess.Popen(self.daemon_cmd,
+                                             stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE,
+                                             close_fds=True)
+            self._socket_path = self._process.stdout.readline().strip()
+            if not self._socket_path:
+                self._process.wait()
+                raise exception.ProcessExecutionError(
+                    exit_code=self._process.returncode,
+                    cmd=' '.join(self.daemon_cmd),
+                    description=_('Unable to start the root helper daemon'))
+
+    def _stop(self):
+        with self._lock:
+            if self._process is not None:
+                # The daemon runs as root, closing its stdin makes it exit
+                self._process.stdin.close()
+                self._process.wait()
+                self._process = None
+
+    def _connect(self):
+        for attempt in (1, 2):
+            self._start()
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self._socket_path)
+                return sock
+            except socket.error as exc:
+                sock.close()
+                if attempt == 2:
+                    raise exception.ProcessExecutionError(
+                        cmd=' '.join(self.daemon_cmd),
+                        description=_('Unable to reach the root helper '
+                                      'daemon: %s') % exc)
+                LOG.warning(_('Unable to reach the root helper daemon, '
+                              'restarting it: %s'), exc)
+                self._stop()
+
+    def execute(self, cmd, process_input=None):
+        """Run a command as root.
+
+        :returns: (returncode, stdout, stderr)
+        """
+        sock = self._connect()
+        try:
+            sock.sendall(rootwrap_daemon.dump_message(
+                {'cmd': cmd, 'stdin': process_input}))
+            sock.shutdown(socket.SHUT_WR)
+            chunks = []
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                chunks.append(data)
+        finally:
+            sock.close()
+
+        if not chunks:
+            raise exception.ProcessExecutionError(
+                cmd=' '.join(cmd),
+                description=_('The root helper daemon closed the '
+                              'connection without a reply'))
+        reply = rootwrap_daemon.load_message(''.join(chunks))
+        return reply['returncode'], reply['stdout'], reply['stderr']
+
+
+_ROOTWRAP_DAEMON = None
+
+
+def _get_rootwrap_daemon():
+    """Return the client of the rootwrap daemon of this service."""
+    global _ROOTWRAP_DAEMON
+    if _ROOTWRAP_DAEMON is None:
+        _ROOTWRAP_DAEMON = RootwrapDaemonClient(
+            ['sudo', 'cinder-rootwrap-daemon', CONF.rootwrap_config])
+    return _ROOTWRAP_DAEMON
+
+
+def _daemon_execute(*cmd, **kwargs):
+    """Run a command as root through the rootwrap daemon.
+
+    Takes the same arguments as processutils.execute(), and retries and
+    checks the exit code of the command the same way.
+    """
+    process_input = kwargs.pop('process_input', None)
+    check_exit_code = kwargs.pop('check_exit_code', [0])
+    ignore_exit_code = False
+    delay_on_retry = kwargs.pop('delay_on_retry', True)
+    attempts = kwargs.pop('attempts', 1)
+    kwargs.pop('run_as_root', None)
+    if kwargs.pop('shell', False):
+        raise processutils.InvalidArgumentError(
+            _('shell is not supported by the rootwrap daemon'))
+
+    if isinstance(check_exit_code, bool):
+        ignore_exit_code = not check_exit_code
+        check_exit_code = [0]
+    elif isinstance(check_exit_code, int):
+        check_exit_code = [check_exit_code]
+
+    if kwargs:
+        raise processutils.UnknownArgumentError(
+            _('Got unknown keyword args to utils.execute: %r') % kwargs)
+
+    cmd = map(str, cmd)
+    client = _get_rootwrap_daemon()
+    while attempts > 0:
+        attempts -= 1
+        try:
+            LOG.debug(_('Running cmd (rootwrap daemon): %s'), ' '.join(cmd))
+            returncode, stdout, stderr = client.execute(cmd, process_input)
+            if returncode:
+                LOG.debug(_('Result was %s') % returncode)
+                if not ignore_exit_code and returncode not in check_exit_code:
+                    raise processutils.ProcessExecutionError(
+                        exit_code=returncode,
+                        stdout=stdout,
+                        stderr=stderr,
+                        cmd=' '.join(cmd))
+            return stdout, stderr
+        except processutils.ProcessExecutionError:
+            if not attempts:
+                raise
+            LOG.debug(_('%r failed. Retrying.'), cmd)
+            if delay_on_retry:
+                greenthread.sleep(random.randint(20, 200) / 100.0)
+
+
+def _daemon_trycmd(*args, **kwargs):
+    """processutils.trycmd() for commands run by the rootwrap daemon."""
+    discard_warnings = kwargs.pop('discard_warnings', False)
+
+    try:
+        out, err = _daemon_execute(*args, **kwargs)
+        failed = False
+    except processutils.ProcessExecutionError as exn:
+        out, err = '', str(exn)
+        failed = True
+
+    if not failed and discard_warnings and err:
+        # Handle commands that output to stderr but otherwise succeed
+        err = ''
+
+    return out, err
+
+
+def _use_rootwrap_daemon(kwargs):
+    """Return whether a command should be run by the rootwrap daemon.
+
+    Otherwise the cinder-rootwrap root_helper is set in kwargs where
+    needed.
+    """
+    if 'run_as_root' not in kwargs or 'root_helper' in kwargs:
+        return False
+    if (CONF.use_rootwrap_daemon and kwargs['run_as_root'] and
+            os.geteuid() != 0):
+        return True
+    kwargs['root_helper'] = 'sudo cinder-rootwrap %s' % CONF.rootwrap_config
+    return False
+
+
 def execute(*cmd, **kwargs):
     """Convenience wrapper around oslo's execute() method."""
-    if 'run_as_root' in kwargs and not 'root_helper' in kwargs:
-        kwargs['root_helper'] =\
-            'sudo cinder-rootwrap %s' % CONF.rootwrap_config
+    if _use_rootwrap_daemon(kwargs):
+        _execute = _daemon_execute
+    else:
+        _execute = processutils.execute
     try:
-        (stdout, stderr) = processutils.execute(*cmd, **kwargs)
+        (stdout, stderr) = _execute(*cmd, **kwargs)
     except processutils.ProcessExecutionError as ex:
         raise exception.ProcessExecutionError(
             exit_code=ex.exit_code,
@@ -112,11 +296,12 @@ def execute(*cmd, **kwargs):
 
 def trycmd(*args, **kwargs):
     """Convenience wrapper around oslo's trycmd() method."""
-    if 'run_as_root' in kwargs and not 'root_helper' in kwargs:
-        kwargs['root_helper'] =\
-            'sudo cinder-rootwrap %s' % CONF.rootwrap_config
+    if _use_rootwrap_daemon(kwargs):
+        _trycmd = _daemon_trycmd
+    else:
+        _trycmd = processutils.trycmd
     try:
-        (stdout, stderr) = processutils.trycmd(*args, **kwargs)
+        (stdout, stderr) = _trycmd(*args, **kwargs)
     except processutils.ProcessExecutionError as ex:
         raise exception.ProcessExecutionError(
             exit_code=ex.exit_code,
@@ -872,6 +1057,11 @@ def hash_file(file_like_object):
     return checksum.hexdigest()
 
 
+def is_all_zero(data):
+    """Return True if the given block of data contains only zero bytes."""
+    return data.count('\0') == len(data)
+
+
 @contextlib.contextmanager
 def temporary_mutation(obj, **kwargs):
     """Temporarily set the attr on a particular object to a given value then
@@ -1022,3 +1212,29 @@ class UndoManager(object):
                 LOG.exception(msg, **kwargs)
 
             self._rollback()
+
+
+class TokenBucket(object):
+    """Limits the rate of a stream of work to a number of units per second.
+
+    Up to capacity units may be consumed in a burst. Consumers that run
+    ahead of the rate sleep until the bucket has refilled, so concurrent
+    greenthreads sharing a bucket share its rate between them.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.last = time.time()
+
+    def consume(self, amount):
+        """Take amount units from the bucket, sleeping if it runs dry."""
+        now = time.time()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        # Going into debt lets a single request larger than the capacity
+        # through, at the cost of a proportionally longer wait.
+        self.tokens -= amount
+        if self.tokens < 0:
+            greenthread.sleep(-self.tokens / self.rate)
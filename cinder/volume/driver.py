@@ -24,6 +24,7 @@ import os
 import socket
 import time
 
+import eventlet
 from oslo.config import cfg
 
 from cinder.brick.initiator import connector as initiator
@@ -62,7 +63,13 @@ volume_opts = [
     cfg.BoolOpt('use_multipath_for_image_xfer',
                 default=False,
                 help='Do we attach/detach volumes in cinder using multipath '
-                     'for volume to image and image to volume transfers?'), ]
+                     'for volume to image and image to volume transfers?'),
+    cfg.IntOpt('export_recovery_workers',
+               default=1,
+               help='Maximum number of volume exports recreated at once '
+                    'when the volume service starts. Only raise it for '
+                    'drivers whose exports can safely be recreated '
+                    'concurrently'), ]
 
 CONF = cfg.CONF
 CONF.register_opts(volume_opts)
@@ -149,6 +156,26 @@ class VolumeDriver(object):
         """Synchronously recreates an export for a volume."""
         raise NotImplementedError()
 
+    def ensure_exports(self, context, volumes):
+        """Synchronously recreates the exports of several volumes.
+
+        Calls ensure_export for one volume after the other, or for up to
+        export_recovery_workers volumes at once when that is set above 1.
+        Drivers able to recreate many exports in one go should override
+        this.
+        """
+        workers = self.configuration.export_recovery_workers
+        if workers <= 1:
+            for volume in volumes:
+                self.ensure_export(context, volume)
+            return
+
+        pool = eventlet.GreenPool(workers)
+        for result in pool.imap(lambda volume:
+                                self.ensure_export(context, volume),
+                                volumes):
+            pass
+
     def create_export(self, context, volume):
         """Exports the volume. Can optionally return a Dictionary of changes
         to the volume object to be persisted.
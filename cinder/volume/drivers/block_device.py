@@ -308,9 +308,13 @@ class BlockDeviceDriver(driver.ISCSIDriver):
     def create_cloned_volume(self, volume, src_vref):
         LOG.info(_('Creating clone of volume: %s') % src_vref['id'])
         device = self.find_appropriate_size_device(src_vref['size'])
+        progress = volutils.copy_progress_logger(
+            _('Cloning volume %(src)s to %(device)s') %
+            {'src': src_vref['id'], 'device': device})
         volutils.copy_volume(self.local_path(src_vref), device,
                              self._get_device_size(device) * 2048,
-                             execute=self._execute)
+                             execute=self._execute,
+                             progress_callback=progress)
         return {
             'provider_location': self._iscsi_location(None, None, None, None,
                                                       device),
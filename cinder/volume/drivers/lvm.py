@@ -20,17 +20,23 @@ Driver for Linux servers running LVM.
 
 """
 
+import bisect
 import math
 import os
 import re
+from xml.etree import ElementTree as ETree
 
+import eventlet
+from eventlet import semaphore
 from oslo.config import cfg
 
 from cinder.brick.iscsi import iscsi
+from cinder.brick.local_dev import lvm as brick_lvm
 from cinder import exception
 from cinder.image import image_utils
 from cinder.openstack.common import fileutils
 from cinder.openstack.common import log as logging
+from cinder import units
 from cinder import utils
 from cinder.volume import driver
 from cinder.volume import utils as volutils
@@ -48,6 +54,14 @@ volume_opts = [
     cfg.IntOpt('volume_clear_size',
                default=0,
                help='Size in MiB to wipe at start of old volumes. 0 => all'),
+    cfg.BoolOpt('volume_clear_deferred',
+                default=False,
+                help='Rename deleted volumes and wipe them in the background '
+                     'instead of before the delete returns'),
+    cfg.IntOpt('volume_clear_workers',
+               default=1,
+               help='The number of deleted volumes wiped at once in the '
+                    'background'),
     cfg.StrOpt('pool_size',
                default=None,
                help='Size of thin provisioning pool '
@@ -56,6 +70,11 @@ volume_opts = [
                default=0,
                help='If set, create lvms with multiple mirrors. Note that '
                     'this requires lvm_mirrors + 2 pvs with available space'),
+    cfg.IntOpt('lvm_inventory_ttl',
+               default=brick_lvm.DEFAULT_INVENTORY_TTL,
+               help='Seconds the cached list of logical volumes and volume '
+                    'group capacity is used before the volume group is '
+                    'listed again, 0 lists it every time'),
 ]
 
 CONF = cfg.CONF
@@ -67,9 +86,49 @@ class LVMVolumeDriver(driver.VolumeDriver):
 
     VERSION = '1.0'
 
+    # Deleted volumes waiting to be wiped in the background are renamed
+    # with this prefix.
+    WIPE_PREFIX = 'wipe-'
+
     def __init__(self, *args, **kwargs):
         super(LVMVolumeDriver, self).__init__(*args, **kwargs)
         self.configuration.append_config_values(volume_opts)
+        self._wipe_slots = None
+        # Sizes in GB of the volumes waiting to be wiped, by LV name
+        self._pending_wipes = {}
+        self._inventory = None
+
+    @property
+    def inventory(self):
+        """The LVMInventory of the volume group, created on first use."""
+        if self._inventory is None:
+            self._inventory = brick_lvm.LVMInventory(
+                self.configuration.volume_group,
+                executor=lambda *cmd, **kwargs: self._execute(*cmd,
+                                                              **kwargs),
+                root_helper=None,
+                ttl=self.configuration.lvm_inventory_ttl)
+        return self._inventory
+
+    def do_setup(self, context):
+        """Resume wiping the volumes a previous run did not finish."""
+        if not self.configuration.volume_clear_deferred:
+            return
+        try:
+            out, err = self._execute('lvs', '--noheadings', '--nosuffix',
+                                     '--unit=g', '-o', 'name,size',
+                                     self.configuration.volume_group,
+                                     run_as_root=True)
+        except exception.ProcessExecutionError as exc:
+            LOG.error(_("Error listing volumes to wipe: %s"), exc.stderr)
+            return
+
+        for line in (out or '').splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[0].startswith(self.WIPE_PREFIX):
+                size_in_g = int(math.ceil(float(fields[1].replace(',',
+                                                                  '.'))))
+                self._queue_wipe(fields[0], size_in_g)
 
     def check_for_setup_error(self):
         """Returns an error if prerequisites aren't met"""
@@ -98,15 +157,13 @@ class LVMVolumeDriver(driver.VolumeDriver):
                 cmd += ['-R', str(rsize)]
 
         self._try_execute(*cmd, run_as_root=True, no_retry_list=no_retry_list)
+        if self.configuration.lvm_mirrors:
+            self.inventory.invalidate()
+        else:
+            self.inventory.add_volume(volume_name, sizestr)
 
     def _volume_not_present(self, volume_name):
-        path_name = '%s/%s' % (self.configuration.volume_group, volume_name)
-        try:
-            self._try_execute('lvdisplay', path_name, run_as_root=True)
-        except Exception as e:
-            # If the volume isn't present
-            return True
-        return False
+        return not self.inventory.volume_exists(volume_name)
 
     def _delete_volume(self, volume):
         """Deletes a logical volume."""
@@ -120,6 +177,7 @@ class LVMVolumeDriver(driver.VolumeDriver):
                           (self.configuration.volume_group,
                            self._escape_snapshot(volume['name'])),
                           run_as_root=True)
+        self.inventory.remove_volume(self._escape_snapshot(volume['name']))
 
     def _sizestr(self, size_in_g):
         if int(size_in_g) == 0:
@@ -142,10 +200,14 @@ class LVMVolumeDriver(driver.VolumeDriver):
     def create_volume_from_snapshot(self, volume, snapshot):
         """Creates a volume from a snapshot."""
         self._create_volume(volume['name'], self._sizestr(volume['size']))
+        progress = volutils.copy_progress_logger(
+            _('Creating volume %(volume)s from snapshot %(snapshot)s') %
+            {'volume': volume['id'], 'snapshot': snapshot['id']})
         volutils.copy_volume(self.local_path(snapshot),
                              self.local_path(volume),
                              snapshot['volume_size'] * 1024,
-                             execute=self._execute)
+                             execute=self._execute,
+                             progress_callback=progress)
 
     def delete_volume(self, volume):
         """Deletes a logical volume."""
@@ -155,18 +217,53 @@ class LVMVolumeDriver(driver.VolumeDriver):
 
         # TODO(yamahata): lvm can't delete origin volume only without
         # deleting derived snapshots. Can we do something fancy?
-        out, err = self._execute('lvdisplay', '--noheading',
-                                 '-C', '-o', 'Attr',
-                                 '%s/%s' % (self.configuration.volume_group,
-                                            volume['name']),
-                                 run_as_root=True)
-        # fake_execute returns None resulting unit test error
-        if out:
-            out = out.strip()
-            if (out[0] == 'o') or (out[0] == 'O'):
-                raise exception.VolumeIsBusy(volume_name=volume['name'])
+        if self.inventory.lv_has_snapshot(volume['name']):
+            raise exception.VolumeIsBusy(volume_name=volume['name'])
 
-        self._delete_volume(volume)
+        if self.configuration.volume_clear_deferred:
+            self._defer_delete_volume(volume)
+        else:
+            self._delete_volume(volume)
+
+    def _defer_delete_volume(self, volume):
+        """Rename a volume so that it is wiped and removed in the background.
+
+        The volume's name can be reused as soon as this returns.
+        """
+        if (self.configuration.volume_clear == 'none' or
+                not os.path.exists(self.local_path(volume))):
+            self._delete_volume(volume)
+            return
+
+        wipe_name = self.WIPE_PREFIX + volume['name']
+        self._try_execute('lvrename', self.configuration.volume_group,
+                          volume['name'], wipe_name, run_as_root=True)
+        self.inventory.rename_volume(volume['name'], wipe_name)
+        self._queue_wipe(wipe_name, volume['size'])
+
+    def _queue_wipe(self, name, size_in_g):
+        if self._wipe_slots is None:
+            self._wipe_slots = semaphore.Semaphore(
+                max(1, self.configuration.volume_clear_workers))
+        self._pending_wipes[name] = size_in_g
+        eventlet.spawn_n(self._wipe_volume, name, size_in_g)
+
+    def _wipe_volume(self, name, size_in_g):
+        """Wipe and remove a volume renamed by _defer_delete_volume."""
+        try:
+            with self._wipe_slots:
+                LOG.debug(_("Wiping deleted volume %s") % name)
+                self.clear_volume({'name': name, 'id': name,
+                                   'size': size_in_g})
+                self._try_execute('lvremove', '-f', "%s/%s" %
+                                  (self.configuration.volume_group, name),
+                                  run_as_root=True)
+                self.inventory.remove_volume(name)
+        except Exception:
+            LOG.exception(_("Failed to wipe deleted volume %s, it will be "
+                            "retried when the service restarts") % name)
+        finally:
+            del self._pending_wipes[name]
 
     def clear_volume(self, volume):
         """unprovision old volumes to prevent data leaking between users."""
@@ -185,6 +282,15 @@ class LVMVolumeDriver(driver.VolumeDriver):
         LOG.info(_("Performing secure delete on volume: %s") % volume['id'])
 
         if self.configuration.volume_clear == 'zero':
+            if size_in_m == 0 and CONF.volume_clear_io_depth > 1:
+                # Zero several regions of the volume at once
+                size = int(size_in_g) * units.GiB
+                chunk = int(math.ceil(float(size) / units.MiB /
+                                      CONF.volume_clear_io_depth)) * units.MiB
+                ranges = [(offset, min(chunk, size - offset))
+                          for offset in xrange(0, size, chunk)]
+                return volutils.clear_volume_ranges(vol_path, ranges,
+                                                    execute=self._execute)
             if size_in_m == 0:
                 return volutils.copy_volume('/dev/zero',
                                             vol_path, size_in_g * 1024,
@@ -208,10 +314,12 @@ class LVMVolumeDriver(driver.VolumeDriver):
         """Creates a snapshot."""
         orig_lv_name = "%s/%s" % (self.configuration.volume_group,
                                   snapshot['volume_name'])
-        self._try_execute('lvcreate', '-L',
-                          self._sizestr(snapshot['volume_size']),
+        sizestr = self._sizestr(snapshot['volume_size'])
+        self._try_execute('lvcreate', '-L', sizestr,
                           '--name', self._escape_snapshot(snapshot['name']),
                           '--snapshot', orig_lv_name, run_as_root=True)
+        self.inventory.add_snapshot(self._escape_snapshot(snapshot['name']),
+                                    snapshot['volume_name'], size_str=sizestr)
 
     def delete_snapshot(self, snapshot):
         """Deletes a snapshot."""
@@ -258,10 +366,14 @@ class LVMVolumeDriver(driver.VolumeDriver):
         self.create_snapshot(temp_snapshot)
         self._create_volume(volume['name'], self._sizestr(volume['size']))
         try:
+            progress = volutils.copy_progress_logger(
+                _('Cloning volume %(src)s to %(volume)s') %
+                {'src': src_vref['id'], 'volume': volume['id']})
             volutils.copy_volume(self.local_path(temp_snapshot),
                                  self.local_path(volume),
                                  src_vref['size'] * 1024,
-                                 execute=self._execute)
+                                 execute=self._execute,
+                                 progress_callback=progress)
         finally:
             self.delete_snapshot(temp_snapshot)
 
@@ -280,7 +392,9 @@ class LVMVolumeDriver(driver.VolumeDriver):
         """Restore an existing backup to a new or existing volume."""
         volume_path = self.local_path(volume)
         with utils.temporary_chown(volume_path):
-            with fileutils.file_open(volume_path, 'wb') as volume_file:
+            # Opened for update so that restores can leave regions which
+            # already read back as zeros untouched.
+            with fileutils.file_open(volume_path, 'r+b') as volume_file:
                 backup_service.restore(backup, volume['id'], volume_file)
 
 
@@ -315,24 +429,10 @@ class LVMISCSIDriver(LVMVolumeDriver, driver.ISCSIDriver):
         # cooresponding target admin class
 
         if isinstance(self.tgtadm, iscsi.LioAdm):
-            try:
-                volume_info = self.db.volume_get(context, volume['id'])
-                (auth_method,
-                 auth_user,
-                 auth_pass) = volume_info['provider_auth'].split(' ', 3)
-                chap_auth = self._iscsi_authentication(auth_method,
-                                                       auth_user,
-                                                       auth_pass)
-            except exception.NotFound:
-                LOG.debug("volume_info:", volume_info)
-                LOG.info(_("Skipping ensure_export. No iscsi_target "
-                           "provision for volume: %s"), volume['id'])
+            lio_export = self._get_lio_export(context, volume)
+            if lio_export is None:
                 return
-
-            iscsi_name = "%s%s" % (self.configuration.iscsi_target_prefix,
-                                   volume['name'])
-            volume_path = "/dev/%s/%s" % (self.configuration.volume_group,
-                                          volume['name'])
+            iscsi_name, volume_path, chap_auth = lio_export
             iscsi_target = 1
 
             self.tgtadm.create_iscsi_target(iscsi_name, iscsi_target,
@@ -353,7 +453,72 @@ class LVMISCSIDriver(LVMVolumeDriver, driver.ISCSIDriver):
             iscsi_target = 1  # dummy value when using TgtAdm
 
         chap_auth = None
+        iscsi_name, volume_path, old_name = self._get_export_names(context,
+                                                                   volume)
+
+        # NOTE(jdg): For TgtAdm case iscsi_name is the ONLY param we need
+        # should clean this all up at some point in the future
+        self.tgtadm.create_iscsi_target(iscsi_name, iscsi_target,
+                                        0, volume_path, chap_auth,
+                                        check_exit_code=False,
+                                        old_name=old_name)
+
+    def ensure_exports(self, context, volumes):
+        """Recreates the exports of several logical volumes.
 
+        With tgtadm the configuration of every target is written first and
+        tgtd is then updated once for all of them. With LIO the targets
+        are listed once after all of them are created.
+        """
+        targets = []
+        if isinstance(self.tgtadm, iscsi.LioAdm):
+            for volume in volumes:
+                lio_export = self._get_lio_export(context, volume)
+                if lio_export is not None:
+                    iscsi_name, volume_path, chap_auth = lio_export
+                    targets.append((iscsi_name, volume_path, chap_auth, None))
+        elif isinstance(self.tgtadm, iscsi.TgtAdm):
+            for volume in volumes:
+                iscsi_name, volume_path, old_name = self._get_export_names(
+                    context, volume)
+                targets.append((iscsi_name, volume_path, None, old_name))
+        else:
+            return super(LVMISCSIDriver, self).ensure_exports(context,
+                                                              volumes)
+        self.tgtadm.create_iscsi_targets(targets)
+
+    def _get_lio_export(self, context, volume):
+        """Returns the target name, device path and CHAP auth of an export.
+
+        Returns None if the volume has no CHAP credentials to export it
+        with.
+        """
+        try:
+            volume_info = self.db.volume_get(context, volume['id'])
+            (auth_method,
+             auth_user,
+             auth_pass) = volume_info['provider_auth'].split(' ', 3)
+            chap_auth = self._iscsi_authentication(auth_method,
+                                                   auth_user,
+                                                   auth_pass)
+        except exception.NotFound:
+            LOG.debug("volume_info:", volume_info)
+            LOG.info(_("Skipping ensure_export. No iscsi_target "
+                       "provision for volume: %s"), volume['id'])
+            return None
+
+        iscsi_name = "%s%s" % (self.configuration.iscsi_target_prefix,
+                               volume['name'])
+        volume_path = "/dev/%s/%s" % (self.configuration.volume_group,
+                                      volume['name'])
+        return iscsi_name, volume_path, chap_auth
+
+    def _get_export_names(self, context, volume):
+        """Returns the target name, device path and stale name of an export.
+
+        The stale name is the name of a target created before the fix for
+        bug 1065702 that has to be replaced, or None.
+        """
         # Check for https://bugs.launchpad.net/cinder/+bug/1065702
         old_name = None
         volume_name = volume['name']
@@ -371,13 +536,7 @@ class LVMISCSIDriver(LVMVolumeDriver, driver.ISCSIDriver):
                                volume_name)
         volume_path = "/dev/%s/%s" % (self.configuration.volume_group,
                                       volume_name)
-
-        # NOTE(jdg): For TgtAdm case iscsi_name is the ONLY param we need
-        # should clean this all up at some point in the future
-        self.tgtadm.create_iscsi_target(iscsi_name, iscsi_target,
-                                        0, volume_path, chap_auth,
-                                        check_exit_code=False,
-                                        old_name=old_name)
+        return iscsi_name, volume_path, old_name
 
     def _fix_id_migration(self, context, volume):
         """Fix provider_location and dev files to address bug 1065702.
@@ -561,18 +720,14 @@ class LVMISCSIDriver(LVMVolumeDriver, driver.ISCSIDriver):
         data['QoS_support'] = False
 
         try:
-            out, err = self._execute('vgs', '--noheadings', '--nosuffix',
-                                     '--unit=G', '-o', 'name,size,free',
-                                     self.configuration.volume_group,
-                                     run_as_root=True)
+            (data['total_capacity_gb'],
+             data['free_capacity_gb']) = self.inventory.get_capacity()
         except exception.ProcessExecutionError as exc:
             LOG.error(_("Error retrieving volume status: %s"), exc.stderr)
-            out = False
 
-        if out:
-            volume = out.split()
-            data['total_capacity_gb'] = float(volume[1].replace(',', '.'))
-            data['free_capacity_gb'] = float(volume[2].replace(',', '.'))
+        # Space held by deleted volumes that are still being wiped, it is
+        # not part of free_capacity_gb until they are removed.
+        data['pending_reclaim_gb'] = sum(self._pending_wipes.values())
 
         self._stats = data
 
@@ -594,11 +749,8 @@ class ThinLVMVolumeDriver(LVMISCSIDriver):
 
     def check_for_setup_error(self):
         """Returns an error if prerequisites aren't met"""
-        out, err = self._execute('lvs', '--option',
-                                 'name', '--noheadings',
-                                 run_as_root=True)
         pool_name = "%s-pool" % self.configuration.volume_group
-        if pool_name not in out:
+        if not self.inventory.volume_exists(pool_name):
             if not self.configuration.pool_size:
                 out, err = self._execute('vgs',
                                          self.configuration.volume_group,
@@ -615,6 +767,7 @@ class ThinLVMVolumeDriver(LVMISCSIDriver):
                                    pool_name)
             out, err = self._execute('lvcreate', '-T', '-L', size,
                                      pool_path, run_as_root=True)
+            self.inventory.invalidate()
 
     def _do_lvm_snapshot(self, src_lvm_name, dest_vref, is_cinder_snap=True):
             if is_cinder_snap:
@@ -624,6 +777,8 @@ class ThinLVMVolumeDriver(LVMISCSIDriver):
 
             self._try_execute('lvcreate', '-s', '-n', new_name,
                               src_lvm_name, run_as_root=True)
+            self.inventory.add_snapshot(new_name, src_lvm_name.split('/')[-1],
+                                        thin=True)
 
     def _create_volume(self, volume):
         sizestr = self._sizestr(volume['size'])
@@ -631,6 +786,7 @@ class ThinLVMVolumeDriver(LVMISCSIDriver):
                                    self.configuration.volume_group))
         self._try_execute('lvcreate', '-T', '-V', sizestr, '-n',
                           volume['name'], vg_name, run_as_root=True)
+        self.inventory.add_volume(volume['name'], sizestr, thin=True)
 
     def create_volume(self, volume):
         """Creates a logical volume."""
@@ -640,10 +796,157 @@ class ThinLVMVolumeDriver(LVMISCSIDriver):
         """Deletes a logical volume."""
         if self._volume_not_present(volume['name']):
             return True
-        self._try_execute('lvremove', '-f', "%s/%s" %
-                          (self.configuration.volume_group,
-                           self._escape_snapshot(volume['name'])),
-                          run_as_root=True)
+        self._delete_volume(volume)
+
+    def _get_pool_dm_name(self):
+        """Return the device-mapper name of the thin pool."""
+        volume_group = self.configuration.volume_group
+        return "%s-%s" % (volume_group.replace('-', '--'),
+                          ("%s-pool" % volume_group).replace('-', '--'))
+
+    def _pool_zeroes_new_blocks(self):
+        """Return whether the thin pool zeroes blocks it provisions."""
+        out, err = self._execute('lvs', '--noheadings', '-o', 'zero',
+                                 "%s/%s-pool" %
+                                 (self.configuration.volume_group,
+                                  self.configuration.volume_group),
+                                 run_as_root=True)
+        return out.strip() in ('1', 'zero')
+
+    def _parse_thin_dump(self, dump, thin_id):
+        """Return the byte ranges only thin device thin_id maps in a dump.
+
+        Blocks the device shares with other thin devices, such as its
+        origin or its snapshots, are left out. Writing to them would make
+        the pool copy them. Adjacent ranges are merged.
+        """
+        superblock = ETree.fromstring(dump)
+        # The block size is in 512 byte sectors
+        block_size = int(superblock.get('data_block_size')) * 512
+        # (volume block, pool block, length) of the device's mappings
+        own = []
+        # (first, last + 1) pool blocks mapped by the other devices
+        others = []
+        for device in superblock.findall('device'):
+            for mapping in device:
+                if mapping.tag == 'single_mapping':
+                    begin = int(mapping.get('origin_block'))
+                    data_begin = int(mapping.get('data_block'))
+                    length = 1
+                elif mapping.tag == 'range_mapping':
+                    begin = int(mapping.get('origin_begin'))
+                    data_begin = int(mapping.get('data_begin'))
+                    length = int(mapping.get('length'))
+                else:
+                    continue
+                if device.get('dev_id') == thin_id:
+                    own.append((begin, data_begin, length))
+                else:
+                    others.append((data_begin, data_begin + length))
+
+        shared = []
+        for first, end in sorted(others):
+            if shared and first <= shared[-1][1]:
+                shared[-1] = (shared[-1][0], max(shared[-1][1], end))
+            else:
+                shared.append((first, end))
+        shared_starts = [first for first, end in shared]
+
+        ranges = []
+
+        def add(begin, length):
+            offset, length = begin * block_size, length * block_size
+            if ranges and sum(ranges[-1]) == offset:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
+            else:
+                ranges.append((offset, length))
+
+        for begin, data_begin, length in sorted(own):
+            # Split the mapping around the pool blocks that are shared
+            data_end = data_begin + length
+            pos = data_begin
+            index = max(bisect.bisect_right(shared_starts, data_begin) - 1, 0)
+            for first, end in shared[index:]:
+                if first >= data_end:
+                    break
+                if first > pos:
+                    add(begin + pos - data_begin, first - pos)
+                pos = max(pos, end)
+            if pos < data_end:
+                add(begin + pos - data_begin, data_end - pos)
+        return ranges
+
+    def _get_provisioned_ranges(self, volume):
+        """Return the byte ranges provisioned in the pool for a thin volume.
+
+        Only the blocks that no other thin device shares are returned. The
+        mappings of all the devices are read from a snapshot of the pool
+        metadata so that the pool can stay in use meanwhile.
+        """
+        out, err = self._execute('lvs', '--noheadings', '-o', 'thin_id',
+                                 "%s/%s" % (self.configuration.volume_group,
+                                            self._escape_snapshot(
+                                                volume['name'])),
+                                 run_as_root=True)
+        thin_id = out.strip()
+        pool = self._get_pool_dm_name()
+        self._execute('dmsetup', 'message', '%s-tpool' % pool, '0',
+                      'reserve_metadata_snap', run_as_root=True)
+        try:
+            out, err = self._execute('thin_dump', '--metadata-snap',
+                                     '/dev/mapper/%s_tmeta' % pool,
+                                     run_as_root=True)
+        finally:
+            self._execute('dmsetup', 'message', '%s-tpool' % pool, '0',
+                          'release_metadata_snap', run_as_root=True)
+        return self._parse_thin_dump(out, thin_id)
+
+    def _discard_volume(self, volume, vol_path):
+        """Return the blocks of a thin volume to the pool."""
+        LOG.info(_("Discarding the blocks of volume: %s") % volume['id'])
+        try:
+            self._execute('blkdiscard', vol_path, run_as_root=True)
+        except exception.ProcessExecutionError as exc:
+            LOG.warning(_("Unable to discard the blocks of volume %(id)s, "
+                          "not clearing it: %(err)s") %
+                        {'id': volume['id'], 'err': exc.stderr})
+
+    def clear_volume(self, volume):
+        """Clear only the blocks provisioned for a thin volume alone.
+
+        Blocks that were never written, and blocks shared with the origin
+        or the snapshots of the volume, are not touched, so the pool does
+        not grow while the volume is cleared. They are zeroed, or
+        overwritten with random data for shred. If the pool zeroes blocks
+        as it provisions them, or the provisioned blocks cannot be found,
+        the volume's blocks are discarded instead.
+        """
+        if self.configuration.volume_clear not in ('zero', 'shred'):
+            return super(ThinLVMVolumeDriver, self).clear_volume(volume)
+
+        vol_path = self.local_path(volume)
+        try:
+            if self._pool_zeroes_new_blocks():
+                return self._discard_volume(volume, vol_path)
+            ranges = self._get_provisioned_ranges(volume)
+        except exception.ProcessExecutionError as exc:
+            LOG.warning(_("Unable to find the provisioned blocks of volume "
+                          "%(id)s: %(err)s") %
+                        {'id': volume['id'], 'err': exc.stderr})
+            return self._discard_volume(volume, vol_path)
+
+        clear_size = self.configuration.volume_clear_size * units.MiB
+        if clear_size:
+            ranges = [(offset, min(length, clear_size - offset))
+                      for offset, length in ranges if offset < clear_size]
+
+        LOG.info(_("Performing secure delete on volume: %s") % volume['id'])
+        if self.configuration.volume_clear == 'shred':
+            volutils.shred_volume_ranges(vol_path, ranges,
+                                         execute=self._execute)
+        else:
+            volutils.clear_volume_ranges(vol_path, ranges,
+                                         execute=self._execute)
 
     def create_cloned_volume(self, volume, src_vref):
         """Creates a clone of the specified volume."""
@@ -21,6 +21,7 @@ from __future__ import absolute_import
 import io
 import json
 import os
+import re
 import tempfile
 import urllib
 
@@ -383,13 +384,33 @@ class RBDDriver(driver.VolumeDriver):
         if int(volume['size']):
             self._resize(volume)
 
+    def _delete_backup_snaps(self, volume_name):
+        """Remove snapshots left on a volume by differential backups.
+
+        Returns True if any were removed.
+        """
+        with RBDVolumeProxy(self, volume_name) as volume:
+            snaps = [snap['name'] for snap in volume.list_snaps()
+                     if re.match(r'^backup\..+\.snap\.[\d.]+$', snap['name'])]
+            for snap in snaps:
+                LOG.debug(_('removing backup snapshot %(snap)s of '
+                            '%(volume)s') % {'snap': snap,
+                                             'volume': volume_name})
+                volume.remove_snap(str(snap))
+        return bool(snaps)
+
     def delete_volume(self, volume):
         """Deletes a logical volume."""
         with RADOSClient(self) as client:
             try:
                 self.rbd.RBD().remove(client.ioctx, str(volume['name']))
             except self.rbd.ImageHasSnapshots:
-                raise exception.VolumeIsBusy(volume_name=volume['name'])
+                if not self._delete_backup_snaps(volume['name']):
+                    raise exception.VolumeIsBusy(volume_name=volume['name'])
+                try:
+                    self.rbd.RBD().remove(client.ioctx, str(volume['name']))
+                except self.rbd.ImageHasSnapshots:
+                    raise exception.VolumeIsBusy(volume_name=volume['name'])
 
     def create_snapshot(self, snapshot):
         """Creates an rbd snapshot"""
@@ -540,7 +561,9 @@ class RBDDriver(driver.VolumeDriver):
         pool = self.configuration.rbd_pool
         volname = volume['name']
 
-        with RBDVolumeProxy(self, volname, pool, read_only=True) as rbd_image:
+        # Not opened read-only so that differential backup drivers can take
+        # snapshots of the volume.
+        with RBDVolumeProxy(self, volname, pool) as rbd_image:
             rbd_fd = RBDImageIOWrapper(rbd_image)
             backup_service.backup(backup, rbd_fd)
 
@@ -0,0 +1,224 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Per-backend cache of volumes created from images.
+
+The first volume created from an image on a backend also has the image
+copied into a "golden" cache volume, sized for the image.  Later requests
+for the same image are served with the driver's create_cloned_volume()
+instead of downloading and converting the image again.  Entries are keyed
+on the image id and checksum, and are evicted least recently used first
+when the configured limits are reached.
+"""
+
+import math
+
+from oslo.config import cfg
+
+from cinder.openstack.common import log as logging
+from cinder.openstack.common import timeutils
+from cinder.openstack.common import uuidutils
+from cinder import units
+from cinder import utils
+
+
+LOG = logging.getLogger(__name__)
+
+image_cache_opts = [
+    cfg.BoolOpt('image_volume_cache_enabled',
+                default=False,
+                help='Keep a cached volume for each image used to create '
+                     'volumes on this backend and clone later volumes '
+                     'created from the same image from it'),
+    cfg.IntOpt('image_volume_cache_max_size_gb',
+               default=0,
+               help='Maximum total size in GB of the cached image volumes '
+                    'on this backend, 0 means unlimited'),
+    cfg.IntOpt('image_volume_cache_max_count',
+               default=0,
+               help='Maximum number of cached image volumes on this '
+                    'backend, 0 means unlimited'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(image_cache_opts)
+
+
+class ImageVolumeCache(object):
+    """Tracks the cached image volumes of a single volume backend."""
+
+    def __init__(self, db, driver, host, max_size_gb=0, max_count=0):
+        self.db = db
+        self.driver = driver
+        self.host = host
+        self.max_size_gb = max_size_gb
+        self.max_count = max_count
+
+    def _cache_volume(self, entry):
+        """Return a volume reference for the driver to use."""
+        return {'id': entry['id'],
+                'name': CONF.volume_name_template % entry['id'],
+                'size': entry['size'],
+                'host': self.host,
+                'status': 'available',
+                'provider_location': entry['provider_location'],
+                'provider_auth': None,
+                'volume_type_id': None}
+
+    def _evict(self, context, entry):
+        LOG.info(_("Evicting image %(image_id)s from the image volume "
+                   "cache"), {'image_id': entry['image_id']})
+        try:
+            self.driver.delete_volume(self._cache_volume(entry))
+        except Exception:
+            LOG.exception(_("Failed to delete cached image volume %s"),
+                          entry['id'])
+            return False
+        self.db.image_volume_cache_destroy(context, entry['id'])
+        return True
+
+    def _make_room(self, context, size):
+        """Evict entries until a volume of the given size fits."""
+        if self.max_size_gb and size > self.max_size_gb:
+            return False
+
+        entries = self.db.image_volume_cache_get_all_for_host(context,
+                                                              self.host)
+        count = len(entries)
+        total = sum(entry['size'] for entry in entries)
+        victims = [entry for entry in entries
+                   if entry['status'] == 'available']
+        while ((self.max_count and count + 1 > self.max_count) or
+               (self.max_size_gb and total + size > self.max_size_gb)):
+            if not victims:
+                return False
+            entry = victims.pop(0)
+            if not self._evict(context, entry):
+                return False
+            count -= 1
+            total -= entry['size']
+        return True
+
+    def clone(self, context, volume, image_id, image_meta):
+        """Create the volume from the cached copy of the image.
+
+        Returns a (model_update, cloned) tuple, like the driver's
+        clone_image().
+        """
+        entry = self.db.image_volume_cache_get_by_image(context, self.host,
+                                                        image_id)
+        if entry is None or entry['status'] != 'available':
+            return None, False
+
+        if entry['image_checksum'] != image_meta.get('checksum'):
+            LOG.info(_("Image %s has changed, invalidating its cached "
+                       "volume"), image_id)
+            self._evict(context, entry)
+            return None, False
+
+        if volume['size'] < entry['size']:
+            return None, False
+
+        LOG.debug(_("volume %(vol)s: cloning image %(image)s from the "
+                    "image volume cache"),
+                  {'vol': volume['name'], 'image': image_id})
+        model_update = self.driver.create_cloned_volume(
+            volume, self._cache_volume(entry))
+        self.db.image_volume_cache_update(context, entry['id'],
+                                          {'last_used': timeutils.utcnow()})
+        return model_update, True
+
+    def _image_size_gb(self, volume, image_meta):
+        """Return the size in GB of a volume holding the image.
+
+        This is the virtual size of the image if glance reports it, or the
+        size of a raw image, and the size of the volume created from the
+        image otherwise.
+        """
+        size = image_meta.get('virtual_size')
+        if size is None and image_meta.get('disk_format') == 'raw':
+            size = image_meta.get('size')
+        if not size:
+            return volume['size']
+        return min(volume['size'],
+                   max(1, int(math.ceil(float(size) / units.GiB))))
+
+    def _create_entry(self, context, image_id, checksum, size):
+        """Record a new entry for the image unless it is cached already."""
+        lock = 'image-volume-cache-%s-%s' % (self.host, image_id)
+
+        @utils.synchronized(lock)
+        def create():
+            if self.db.image_volume_cache_get_by_image(context, self.host,
+                                                       image_id):
+                return None
+
+            if not self._make_room(context, size):
+                LOG.debug(_("Not caching image %s, the image volume cache "
+                            "is full"), image_id)
+                return None
+
+            return self.db.image_volume_cache_create(
+                context,
+                {'id': uuidutils.generate_uuid(),
+                 'host': self.host,
+                 'image_id': image_id,
+                 'image_checksum': checksum,
+                 'size': size,
+                 'status': 'creating',
+                 'last_used': timeutils.utcnow()})
+
+        return create()
+
+    def add(self, context, volume, image_id, image_meta, image_service):
+        """Cache an image a volume was just created from.
+
+        The cache volume is written from the image rather than copied from
+        the volume, so the volume can be handed to its user while this
+        runs.
+        """
+        checksum = image_meta.get('checksum')
+        if not checksum:
+            return
+
+        size = self._image_size_gb(volume, image_meta)
+        entry = self._create_entry(context, image_id, checksum, size)
+        if entry is None:
+            return
+
+        cache_volume = self._cache_volume(entry)
+        try:
+            model_update = self.driver.create_volume(cache_volume)
+            if model_update and model_update.get('provider_location'):
+                cache_volume['provider_location'] = (
+                    model_update['provider_location'])
+            self.driver.copy_image_to_volume(context, cache_volume,
+                                             image_service, image_id)
+        except Exception:
+            LOG.exception(_("Failed to cache image %s"), image_id)
+            self._evict(context, entry)
+            return
+
+        values = {'status': 'available'}
+        if cache_volume['provider_location']:
+            values['provider_location'] = cache_volume['provider_location']
+        self.db.image_volume_cache_update(context, entry['id'], values)
+
+    def cleanup(self, context):
+        """Remove entries left behind by an interrupted add()."""
+        entries = self.db.image_volume_cache_get_all_for_host(context,
+                                                              self.host)
+        for entry in entries:
+            if entry['status'] != 'available':
+                self._evict(context, entry)
@@ -41,11 +41,13 @@ intact.
 import sys
 import traceback
 
+from eventlet import greenthread
 from oslo.config import cfg
 
 from cinder import context
 from cinder import exception
 from cinder.image import glance
+from cinder.image import image_utils
 from cinder import manager
 from cinder.openstack.common import excutils
 from cinder.openstack.common import importutils
@@ -56,6 +58,7 @@ from cinder.openstack.common import uuidutils
 from cinder import quota
 from cinder import utils
 from cinder.volume.configuration import Configuration
+from cinder.volume import image_cache
 from cinder.volume import utils as volume_utils
 
 LOG = logging.getLogger(__name__)
@@ -111,6 +114,7 @@ class VolumeManager(manager.SchedulerDependentManager):
         """Load the driver from the one specified in args, or from flags."""
         self.configuration = Configuration(volume_manager_opts,
                                            config_group=service_name)
+        self.configuration.append_config_values(image_cache.image_cache_opts)
         if not volume_driver:
             # Get from configuration, which will get the default
             # if its not using the multi backend
@@ -128,6 +132,12 @@ class VolumeManager(manager.SchedulerDependentManager):
         # NOTE(vish): Implementation specific db handling is done
         #             by the driver.
         self.driver.db = self.db
+        self.image_cache = None
+        if self.configuration.image_volume_cache_enabled:
+            self.image_cache = image_cache.ImageVolumeCache(
+                self.db, self.driver, self.host,
+                max_size_gb=self.configuration.image_volume_cache_max_size_gb,
+                max_count=self.configuration.image_volume_cache_max_count)
 
     def init_host(self):
         """Do any initialization that needs to be run if this is a
@@ -138,11 +148,15 @@ class VolumeManager(manager.SchedulerDependentManager):
         self.driver.do_setup(ctxt)
         self.driver.check_for_setup_error()
 
+        if self.image_cache:
+            self.image_cache.cleanup(ctxt)
+        image_utils.cleanup_image_cache()
+
         volumes = self.db.volume_get_all_by_host(ctxt, self.host)
-        LOG.debug(_("Re-exporting %s volumes"), len(volumes))
+        exports = []
         for volume in volumes:
             if volume['status'] in ['available', 'in-use']:
-                self.driver.ensure_export(ctxt, volume)
+                exports.append(volume)
             elif volume['status'] == 'downloading':
                 LOG.info(_("volume %s stuck in a downloading state"),
                          volume['id'])
@@ -151,6 +165,9 @@ class VolumeManager(manager.SchedulerDependentManager):
             else:
                 LOG.info(_("volume %s: skipping export"), volume['name'])
 
+        LOG.debug(_("Re-exporting %s volumes"), len(exports))
+        self.driver.ensure_exports(ctxt, exports)
+
         LOG.debug(_('Resuming any in progress delete operations'))
         for volume in volumes:
             if volume['status'] == 'deleting':
@@ -161,7 +178,8 @@ class VolumeManager(manager.SchedulerDependentManager):
         self.publish_service_capabilities(ctxt)
 
     def _create_volume(self, context, volume_ref, snapshot_ref,
-                       srcvol_ref, image_service, image_id, image_location):
+                       srcvol_ref, image_service, image_id, image_location,
+                       image_meta=None):
         cloned = None
         model_update = False
 
@@ -192,6 +210,13 @@ class VolumeManager(manager.SchedulerDependentManager):
             # and clone status
             model_update, cloned = self.driver.clone_image(
                 volume_ref, image_location)
+            if not cloned and self.image_cache and image_meta:
+                model_update, cloned = self.image_cache.clone(
+                    context, volume_ref, image_id, image_meta)
+                if cloned:
+                    self.db.volume_update(context,
+                                          volume_ref['id'],
+                                          {'bootable': True})
             if not cloned:
                 model_update = self.driver.create_volume(volume_ref)
 
@@ -209,6 +234,10 @@ class VolumeManager(manager.SchedulerDependentManager):
                 self.db.volume_update(context,
                                       volume_ref['id'],
                                       {'bootable': True})
+                if self.image_cache and image_meta:
+                    greenthread.spawn_n(self.image_cache.add, context,
+                                        volume_ref, image_id, image_meta,
+                                        image_service)
         return model_update, cloned
 
     def create_volume(self, context, volume_id, request_spec=None,
@@ -269,7 +298,8 @@ class VolumeManager(manager.SchedulerDependentManager):
                                                            sourcevol_ref,
                                                            image_service,
                                                            image_id,
-                                                           image_location)
+                                                           image_location,
+                                                           image_meta)
             except exception.ImageCopyFailure as ex:
                 LOG.error(_('Setting volume: %s status to error '
                             'after failed image copy.'), volume_ref['id'])
@@ -17,10 +17,16 @@
 """Volume-related Utilities and helpers."""
 
 
+import contextlib
+import errno
+import io
 import math
+import mmap
 import os
 import stat
 
+import eventlet
+from eventlet import tpool
 from oslo.config import cfg
 
 from cinder import exception
@@ -37,6 +43,23 @@ volume_opts = [
                default='1M',
                help='The default block size used when copying/clearing '
                     'volumes'),
+    cfg.StrOpt('volume_copy_method',
+               default='dd',
+               help='Method used to copy and clear volumes (valid options '
+                    'are: dd, native). native copies in process and falls '
+                    'back to dd when the volumes cannot be copied that way'),
+    cfg.IntOpt('volume_copy_bps_limit',
+               default=0,
+               help='The maximum number of bytes per second a single copy '
+                    'or clear of a volume may transfer. 0 => unlimited'),
+    cfg.IntOpt('volume_clear_bps_limit',
+               default=0,
+               help='The maximum number of bytes per second all clears of '
+                    'volumes together may write. 0 => unlimited'),
+    cfg.IntOpt('volume_clear_io_depth',
+               default=1,
+               help='The number of regions of a volume zeroed at once when '
+                    'clearing it'),
 ]
 
 CONF = cfg.CONF
@@ -44,6 +67,8 @@ CONF.register_opts(volume_opts)
 
 LOG = logging.getLogger(__name__)
 
+_CLEAR_BUCKET = None
+
 
 def get_host_from_queue(queuename):
     # This assumes the queue is named something like cinder-volume
@@ -172,8 +197,160 @@ def _calculate_count(size_in_m):
     return blocksize, int(count)
 
 
-def copy_volume(srcstr, deststr, size_in_m, sync=False,
-                execute=utils.execute):
+@contextlib.contextmanager
+def _no_chown():
+    yield
+
+
+def _open_direct(path, flags):
+    """Open path with O_DIRECT, or without it where it is not supported.
+
+    Returns the file descriptor and whether O_DIRECT is in use.
+    """
+    try:
+        return os.open(path, flags | getattr(os, 'O_DIRECT', 0)), True
+    except OSError as err:
+        if err.errno != errno.EINVAL:
+            raise
+    return os.open(path, flags), False
+
+
+def _volume_owner(path, flags):
+    """Return a context in which path can be opened with flags.
+
+    The volume is temporarily chowned if the service cannot open it.
+    """
+    access = os.W_OK if flags & os.O_WRONLY else os.R_OK
+    if os.access(path, access):
+        return _no_chown()
+    return utils.temporary_chown(path)
+
+
+@contextlib.contextmanager
+def _open_file(path, flags):
+    """Yields a file object for path and whether O_DIRECT is in use."""
+    fd, direct = _open_direct(path, flags)
+    with io.FileIO(fd, 'wb' if flags & os.O_WRONLY else 'rb') as f:
+        yield f, direct
+
+
+@contextlib.contextmanager
+def _open_volume(path, flags):
+    """Open a volume for an in process copy, taking ownership if needed.
+
+    Yields a file object for the volume and whether O_DIRECT is in use.
+    """
+    with _volume_owner(path, flags):
+        with _open_file(path, flags) as volume:
+            yield volume
+
+
+def _get_clear_bucket():
+    """Return the bucket shared by all clears, None if they are unlimited."""
+    global _CLEAR_BUCKET
+    if not CONF.volume_clear_bps_limit:
+        return None
+    if (_CLEAR_BUCKET is None or
+            _CLEAR_BUCKET.rate != CONF.volume_clear_bps_limit):
+        _CLEAR_BUCKET = utils.TokenBucket(CONF.volume_clear_bps_limit)
+    return _CLEAR_BUCKET
+
+
+def _write_block(dest, buf, length):
+    """Write the first length bytes of buf to dest."""
+    written = 0
+    while written < length:
+        written += dest.write(buffer(buf, written, length - written))
+
+
+def _copy_blocks(src, dest, bs, total, sparse, progress_callback, start=0):
+    """Copy total bytes from src to dest in blocks of bs bytes.
+
+    Blocks are read into page aligned buffers so they can be used with
+    O_DIRECT, and the next block is read while the current one is written.
+    Both are done in native threads so other green threads keep running.
+    If src is None zeros are written. Writes begin at offset start of dest.
+    """
+    buckets = []
+    if CONF.volume_copy_bps_limit:
+        buckets.append(utils.TokenBucket(CONF.volume_copy_bps_limit))
+    # Clears also share a limit between them
+    clear_bucket = _get_clear_bucket() if src is None else None
+    if clear_bucket is not None:
+        buckets.append(clear_bucket)
+    # Anonymous mappings are zero filled
+    buffers = [mmap.mmap(-1, bs)]
+    reader = None
+    if src is not None:
+        buffers.append(mmap.mmap(-1, bs))
+        reader = eventlet.spawn(tpool.execute, src.readinto, buffers[0])
+
+    offset = 0
+    block = 0
+    try:
+        while offset < total:
+            length = min(bs, total - offset)
+            buf = buffers[block % len(buffers)]
+            if reader is not None:
+                read = reader.wait()
+                reader = None
+                if read < length:
+                    raise IOError(errno.EIO, _('Unexpected end of source'))
+                if offset + length < total:
+                    reader = eventlet.spawn(tpool.execute, src.readinto,
+                                            buffers[(block + 1) % 2])
+                # All-zero blocks need not be written to a destination
+                # that already reads as zeros.
+                if sparse and utils.is_all_zero(buf[:length]):
+                    buf = None
+            if buf is not None:
+                dest.seek(start + offset)
+                tpool.execute(_write_block, dest, buf, length)
+            for bucket in buckets:
+                bucket.consume(length)
+            offset += length
+            block += 1
+            if progress_callback is not None:
+                progress_callback(offset, total)
+    finally:
+        # Do not let the volumes be closed under a read in progress
+        if reader is not None:
+            try:
+                reader.wait()
+            except Exception:
+                pass
+
+
+def _native_blocksize():
+    """Return volume_dd_blocksize rounded down to a whole number of pages."""
+    blocksize, count = _calculate_count(1)
+    # O_DIRECT needs transfers aligned to the logical block size
+    return max(strutils.to_bytes(blocksize) // mmap.PAGESIZE,
+               1) * mmap.PAGESIZE
+
+
+def _copy_volume_native(srcstr, deststr, size_in_m, sync=False, sparse=False,
+                        progress_callback=None):
+    """Copy a volume in process, clearing it if srcstr is /dev/zero."""
+    bs = _native_blocksize()
+    total = size_in_m * units.MiB
+
+    with _open_volume(deststr, os.O_WRONLY) as (dest, dest_direct):
+        if srcstr == '/dev/zero':
+            _copy_blocks(None, dest, bs, total, False, progress_callback)
+        else:
+            with _open_volume(srcstr, os.O_RDONLY) as (src, src_direct):
+                _copy_blocks(src, dest, bs, total, sparse, progress_callback)
+
+        # If the volume is being unprovisioned then request the data is
+        # persisted before returning, so that it's not discarded from the
+        # cache.
+        if sync and not dest_direct:
+            os.fdatasync(dest.fileno())
+
+
+def _copy_volume_dd(srcstr, deststr, size_in_m, sync=False, sparse=False,
+                    execute=utils.execute):
     # Use O_DIRECT to avoid thrashing the system buffer cache
     extra_flags = ['iflag=direct', 'oflag=direct']
 
@@ -190,6 +367,10 @@ def copy_volume(srcstr, deststr, size_in_m, sync=False,
     if sync and not extra_flags:
         extra_flags.append('conv=fdatasync')
 
+    # Seek over all-zero blocks rather than writing them
+    if sparse:
+        extra_flags.append('conv=sparse')
+
     blocksize, count = _calculate_count(size_in_m)
 
     # Perform the copy
@@ -197,3 +378,102 @@ def copy_volume(srcstr, deststr, size_in_m, sync=False,
             'count=%d' % count,
             'bs=%s' % blocksize,
             *extra_flags, run_as_root=True)
+
+
+def copy_progress_logger(description, step=10):
+    """Return a copy_volume progress_callback that logs the progress.
+
+    A message is logged each time another step percent of the data has
+    been copied.
+    """
+    logged = [0]
+
+    def log_progress(copied, total):
+        percent = copied * 100 // total if total else 100
+        if percent >= min(logged[0] + step, 100) > logged[0]:
+            logged[0] = percent
+            LOG.debug(_('%(description)s: %(percent)d%% copied') %
+                      {'description': description, 'percent': percent})
+
+    return log_progress
+
+
+def copy_volume(srcstr, deststr, size_in_m, sync=False,
+                execute=utils.execute, sparse=False, progress_callback=None):
+    """Copy size_in_m MiB of srcstr to deststr.
+
+    :param sync: persist the data before returning
+    :param sparse: the destination reads as zeros, so all-zero blocks need
+                   not be written
+    :param progress_callback: called with the number of bytes copied so far
+                              and the total after each block of an in
+                              process copy
+    """
+    if CONF.volume_copy_method == 'native':
+        try:
+            return _copy_volume_native(srcstr, deststr, size_in_m, sync=sync,
+                                       sparse=sparse,
+                                       progress_callback=progress_callback)
+        except (OSError, IOError, exception.ProcessExecutionError) as err:
+            LOG.warn(_("Unable to copy %(src)s to %(dest)s in process, "
+                       "falling back to dd: %(err)s") %
+                     {'src': srcstr, 'dest': deststr, 'err': err})
+
+    _copy_volume_dd(srcstr, deststr, size_in_m, sync=sync, sparse=sparse,
+                    execute=execute)
+
+
+def _zero_range(deststr, offset, length, bs):
+    with _open_file(deststr, os.O_WRONLY) as (dest, direct):
+        _copy_blocks(None, dest, bs, length, False, None, start=offset)
+        if not direct:
+            os.fdatasync(dest.fileno())
+
+
+def _clear_ranges_native(deststr, ranges):
+    bs = _native_blocksize()
+    pool = eventlet.GreenPool(max(1, CONF.volume_clear_io_depth))
+    with _volume_owner(deststr, os.O_WRONLY):
+        # Each range has its own file so that they can be written at once
+        for result in pool.starmap(_zero_range,
+                                   ((deststr, offset, length, bs)
+                                    for offset, length in ranges)):
+            pass
+
+
+def clear_volume_ranges(deststr, ranges, execute=utils.execute):
+    """Zero the given (offset, length) byte ranges of deststr.
+
+    Up to volume_clear_io_depth ranges are zeroed at once. Offsets and
+    lengths must be multiples of the logical block size of deststr.
+    """
+    if CONF.volume_copy_method == 'native':
+        try:
+            return _clear_ranges_native(deststr, ranges)
+        except (OSError, IOError, exception.ProcessExecutionError) as err:
+            LOG.warn(_("Unable to clear %(dest)s in process, falling back "
+                       "to dd: %(err)s") % {'dest': deststr, 'err': err})
+
+    blocksize, count = _calculate_count(1)
+    for offset, length in ranges:
+        execute('dd', 'if=/dev/zero', 'of=%s' % deststr,
+                'bs=%s' % blocksize,
+                'seek=%d' % offset, 'count=%d' % length,
+                'iflag=count_bytes', 'oflag=seek_bytes',
+                'conv=fdatasync', run_as_root=True)
+
+
+def shred_volume_ranges(deststr, ranges, passes=3, execute=utils.execute):
+    """Overwrite the given (offset, length) byte ranges of deststr.
+
+    Each range is overwritten passes times with random data, like shred
+    does for a whole volume.
+    """
+    blocksize, count = _calculate_count(1)
+    for i in xrange(passes):
+        for offset, length in ranges:
+            execute('dd', 'if=/dev/urandom', 'of=%s' % deststr,
+                    'bs=%s' % blocksize,
+                    'seek=%d' % offset, 'count=%d' % length,
+                    'iflag=count_bytes', 'oflag=seek_bytes',
+                    'conv=fdatasync', run_as_root=True)
@@ -0,0 +1,84 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Measure the startup time of cinder-rootwrap.
+
+Runs "cinder-rootwrap <config> <command>" repeatedly, alternately without
+the compiled filter cache (cold) and with it (warm), and prints the median
+wall clock time of each. The command must be allowed by the filters, and
+should be as cheap as possible.
+
+    python tools/rootwrap_startup.py [--runs N] <rootwrap.conf> [command]
+
+Without sudo and as a user able to write next to the configuration file,
+this measures the work done by the root wrapper itself.
+"""
+
+import optparse
+import os
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+ROOTWRAP = os.path.join(ROOT, 'bin', 'cinder-rootwrap')
+
+
+def _time(configfile, command, devnull):
+    start = time.time()
+    subprocess.check_call([sys.executable, ROOTWRAP, configfile] + command,
+                          stdout=devnull)
+    return time.time() - start
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) / 2]
+
+
+def run(configfile, command, runs):
+    """Returns the median cold and warm start times.
+
+    Cold and warm runs alternate so that both see the same system noise.
+    """
+    cache_path = configfile + '.cache'
+    cold, warm = [], []
+    with open(os.devnull, 'w') as devnull:
+        for i in xrange(runs):
+            if os.path.exists(cache_path):
+                os.unlink(cache_path)
+            cold.append(_time(configfile, command, devnull))
+            warm.append(_time(configfile, command, devnull))
+    return _median(cold), _median(warm)
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog [--runs N] <rootwrap.conf> [command]')
+    parser.add_option('--runs', type='int', default=50,
+                      help='number of runs of each case (default 50)')
+    options, args = parser.parse_args()
+    if not args:
+        parser.error('the rootwrap configuration file is required')
+    configfile = os.path.abspath(args[0])
+    command = args[1:] or ['cat', '/dev/null']
+
+    cold, warm = run(configfile, command, options.runs)
+    print('cold start: %.1f ms' % (cold * 1000))
+    print('warm start: %.1f ms' % (warm * 1000))
+
+
+if __name__ == '__main__':
+    main()